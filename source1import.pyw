@@ -6,6 +6,7 @@ from tkinter import filedialog, messagebox, ttk
 from tkinter import *
 import sys
 import json
+import multiprocessing
 from traceback import format_exception_only, format_tb
 
 def initialization_fail(type, value, traceback):
@@ -573,5 +574,8 @@ class Console(): # create file like object
         pass
 
 
-app = SampleApp("source1import")
-app.mainloop()
+if __name__ == "__main__":
+    # materials are converted in worker processes, which start by running this script again
+    multiprocessing.freeze_support()
+    app = SampleApp("source1import")
+    app.mainloop()
@@ -0,0 +1,227 @@
+# Compare the buffered binary DMX reader in datamodel.load with the old stream reader (one file.read per value),
+# time writing the loaded model back, patching strings in place, and loading only some element types or lazily.
+# python dev/bench_dmx.py [file.pcf ...]
+# Without arguments a synthetic binary v5 pcf, a session with long animation channels and a keyvalues2 vmap are generated.
+
+import io
+import struct
+import sys
+import tempfile
+import tracemalloc
+import uuid
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).parents[1]))
+
+import shared.datamodel as dmx
+
+def synthetic_pcf(n_systems: int, n_operators: int = 12) -> bytes:
+    strings: dict[str, int] = {}
+    def ref(s: str) -> bytes:
+        return struct.pack("<i", strings.setdefault(s, len(strings)))
+
+    headers, bodies = [], []
+    def element(elemtype: str, name: str, attributes: bytes, count: int) -> int:
+        headers.append(ref(elemtype) + ref(name) + uuid.uuid4().bytes_le)
+        bodies.append(struct.pack("<i", count) + attributes)
+        return len(headers) - 1
+
+    root = element("DmElement", "untitled", b"", 0)
+    systems = []
+    for i in range(n_systems):
+        operators = []
+        for j in range(n_operators):
+            attributes = (
+                ref("functionName") + b"\x05" + ref(f"Operator {j % 30}")
+                + ref("operator start fadein") + b"\x03" + struct.pack("<f", 0.25)
+                + ref("output field") + b"\x02" + struct.pack("<i", j)
+                + ref("color") + b"\x08" + bytes((255, 128, j % 256, 255))
+                + ref("offset") + b"\x0a" + struct.pack("<3f", 1.0, 2.0, 3.0)
+                + ref("disabled") + b"\x04" + b"\x00"
+            )
+            operators.append(element("DmeParticleOperator", f"op{i}_{j}", attributes, 6))
+        attributes = (
+            ref("material") + b"\x05" + ref(f"particle/fire_{i % 50}.vmt")
+            + ref("max_particles") + b"\x02" + struct.pack("<i", 1000)
+            + ref("operators") + b"\x0f" + struct.pack("<i", len(operators)) + b"".join(struct.pack("<i", o) for o in operators)
+        )
+        systems.append(element("DmeParticleSystemDefinition", f"system_{i}", attributes, 3))
+    bodies[root] = struct.pack("<i", 1) + ref("particleSystemDefinitions") + b"\x0f" \
+        + struct.pack("<i", len(systems)) + b"".join(struct.pack("<i", s) for s in systems)
+
+    out = bytearray(b"<!-- dmx encoding binary 5 format pcf 2 -->\n\0")
+    out += struct.pack("<i", len(strings)) + b"".join(s.encode() + b"\0" for s in strings)
+    out += struct.pack("<i", len(headers)) + b"".join(headers) + b"".join(bodies)
+    return bytes(out)
+
+def synthetic_channels(n_channels: int, n_samples: int) -> bytes:
+    "DmeChannel-like elements with time, float and vector3 sample arrays."
+    strings = ["DmElement", "session", "DmeChannel", "channels", "times", "values", "positions"]
+    ref = lambda s: struct.pack("<i", strings.index(s))
+    times = struct.pack("<i", n_samples) + struct.pack(f"<{n_samples}i", *range(0, n_samples * 10000, 10000))
+    values = struct.pack("<i", n_samples) + struct.pack(f"<{n_samples}f", *(i * 0.5 for i in range(n_samples)))
+    positions = struct.pack("<i", n_samples) + struct.pack(f"<{n_samples*3}f", *(float(i) for i in range(n_samples * 3)))
+
+    out = bytearray(b"<!-- dmx encoding binary 5 format sfm_session 22 -->\n\0")
+    out += struct.pack("<i", len(strings)) + b"".join(s.encode() + b"\0" for s in strings)
+    out += struct.pack("<i", n_channels + 1)
+    out += ref("DmElement") + ref("session") + uuid.uuid4().bytes_le
+    for i in range(n_channels):
+        out += ref("DmeChannel") + ref("channels") + uuid.uuid4().bytes_le
+    out += struct.pack("<i", 1) + ref("channels") + b"\x0f" + struct.pack(f"<{n_channels + 1}i", n_channels, *range(1, n_channels + 1))
+    for i in range(n_channels):
+        out += struct.pack("<i", 3)
+        out += ref("times") + b"\x15" + times
+        out += ref("values") + b"\x11" + values
+        out += ref("positions") + b"\x18" + positions
+    return bytes(out)
+
+def synthetic_vmap(n_entities: int, n_keys: int = 20) -> bytes:
+    "keyvalues2 vmap with inline entities, as maps_import writes them."
+    dm = dmx.DataModel("vmap", 29)
+    dm.prefix_attributes.type = "$prefix_element$"
+    root = dm.add_element("", "CMapRootElement")
+    world = root["world"] = dm.add_element("world", "CMapWorld")
+    entities = []
+    for i in range(n_entities):
+        entity = dm.add_element(f"entity{i}", "CMapEntity")
+        properties = entity["entity_properties"] = dm.add_element("", "EditGameClassProps")
+        properties["classname"] = "prop_static"
+        properties["model"] = f"models/props/crate{i % 40}.vmdl"
+        for k in range(n_keys):
+            properties[f"key{k}"] = f"value {k}"
+        entity["origin"] = dmx.Vector3([i, i * 2, 64])
+        entity["angles"] = dmx.QAngle([0, i % 360, 0])
+        entity["nodeID"] = i
+        entity["referenceID"] = dmx.uint64(i * 7919)
+        entity["editorOnly"] = False
+        entity["variableNames"] = dmx.make_array(["a", "b"], str)
+        entities.append(entity)
+    world["children"] = dmx.make_array(entities, dmx.Element)
+    return dm.echo("keyvalues2", 4).encode()
+
+def legacy_load(data: bytes) -> dmx.DataModel:
+    "The pre-buffer binary path: file.read + struct.unpack per value, byte at a time strings."
+    in_file = io.BytesIO(data)
+    header = ""
+    while not header.endswith(">"):
+        header += dmx.get_char(in_file)
+    encoding, encoding_ver, format, format_ver = __import__("re").findall(dmx.header_format_regex, header)[0]
+    encoding_ver = int(encoding_ver)
+    dm = dmx.DataModel(format, format_ver)
+    in_file.seek(2, 1)
+
+    def get_value(attr_type, from_array=False):
+        if attr_type == dmx.Element:
+            index = dmx.get_int(in_file)
+            return None if index == -1 else dm.elements[index]
+        elif attr_type == str: return dmx.get_str(in_file) if from_array else dm._string_dict.read_string(in_file)
+        elif attr_type == int: return dmx.get_int(in_file)
+        elif attr_type == float: return dmx.get_float(in_file)
+        elif attr_type == bool: return dmx.get_bool(in_file)
+        elif attr_type == dmx.Vector3: return dmx.Vector3(dmx.get_vec(in_file, 3))
+        elif attr_type == dmx.Color: return dmx.get_color(in_file)
+        elif attr_type == dmx.Time: return dmx.Time.from_int(dmx.get_int(in_file))
+        raise TypeError(attr_type)
+
+    dm._string_dict = dmx._StringDictionary(encoding, encoding_ver, in_file=in_file)
+    for _ in range(dmx.get_int(in_file)):
+        elemtype = dm._string_dict.read_string(in_file)
+        name = dm._string_dict.read_string(in_file)
+        dm.add_element(name, elemtype, uuid.UUID(bytes_le=in_file.read(16)))
+    for elem in dm.elements:
+        for _ in range(dmx.get_int(in_file)):
+            name = dm._string_dict.read_string(in_file)
+            attr_type = dmx._get_dmx_id_type(encoding, encoding_ver, dmx.get_byte(in_file))
+            if attr_type in dmx._dmxtypes:
+                elem[name] = get_value(attr_type)
+            else:
+                arr = elem[name] = attr_type()
+                item_type = dmx._get_single_type(attr_type)
+                for _ in range(dmx.get_int(in_file)):
+                    arr.append(get_value(item_type, from_array=True))
+    return dm
+
+def bench(name: str, data: bytes, legacy: bool = True):
+    start = perf_counter()
+    dm = dmx.load(in_file=io.BytesIO(data))
+    t_new = perf_counter() - start
+    line = f"{name}: {len(data)/1024:.0f} KiB, {len(dm.elements)} elements | buffered {t_new*1000:.0f} ms"
+
+    if legacy:
+        start = perf_counter()
+        old = legacy_load(data)
+        t_old = perf_counter() - start
+        assert [dict(e) for e in old.elements] == [dict(e) for e in dm.elements], "readers disagree"
+        line += f" | stream {t_old*1000:.0f} ms | x{t_old/max(t_new, 1e-9):.1f}"
+
+    start = perf_counter()
+    out = dm.echo("binary", 5)
+    t_write = perf_counter() - start
+    written = {e.id: dict(e) for e in dmx.load(in_file=io.BytesIO(out)).elements}
+    assert written == {e.id: dict(e) for e in dm.elements}, "write round trip"
+    line += f" | write {t_write*1000:.0f} ms"
+    print(line)
+
+def bench_partial(name: str, data: bytes, element_types: list[str]):
+    "Full load against decoding only element_types (and what they reference), and against lazy loading."
+    line = f"{name}:"
+    for label, kwargs in (("full", {}), (f"only {', '.join(element_types)}", {"element_types": element_types}), ("lazy", {"lazy": True})):
+        tracemalloc.start()
+        start = perf_counter()
+        dmx.load(in_file=io.BytesIO(data), **kwargs)
+        t = perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        line += f" | {label} {t*1000:.0f} ms, peak {peak/1024/1024:.1f} MiB"
+    print(line)
+
+def bench_patch(name: str, data: bytes):
+    "Renaming every element through datamodel.patch, against loading and writing the whole file."
+    with tempfile.TemporaryDirectory() as tmp:
+        path, out_path = Path(tmp) / "in.dmx", Path(tmp) / "out.dmx"
+        path.write_bytes(data)
+        start = perf_counter()
+        changed = dmx.patch(path, out_path, lambda elemtype, key, value: value + "_2" if key == "name" else None)
+        t_patch = perf_counter() - start
+
+        start = perf_counter()
+        dm = dmx.load(path)
+        for elem in dm.elements:
+            elem.name += "_2"
+        dm.write(out_path, "binary", 5)
+        t_full = perf_counter() - start
+    print(f"{name}: patch {changed} names {t_patch*1000:.0f} ms | load and write {t_full*1000:.0f} ms | x{t_full/max(t_patch, 1e-9):.1f}")
+
+def bench_kv2(name: str, data: bytes):
+    start = perf_counter()
+    dm = dmx.load(in_file=io.BytesIO(data))
+    t = perf_counter() - start
+    line = f"{name}: {len(data)/1024/1024:.1f} MiB, {len(dm.elements)} elements | {t*1000:.0f} ms | {len(data)/1024/1024/t:.1f} MiB/s"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = perf_counter()
+        dm.write(Path(tmp) / "out.vmap", "keyvalues2", 4)
+        t_write = perf_counter() - start
+        # again, traced: tracemalloc slows everything down
+        tracemalloc.start()
+        dm.write(Path(tmp) / "out.vmap", "keyvalues2", 4)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    print(f"{line} | write {t_write*1000:.0f} ms, peak {peak/1024/1024:.1f} MiB")
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        for file in sys.argv[1:]:
+            bench(file, Path(file).read_bytes(), legacy=False)
+    else:
+        for n in (50, 100, 200):
+            bench(f"synthetic {n} systems", synthetic_pcf(n))
+        for n in (20, 100):
+            bench(f"synthetic {n} channels x 10000 samples", synthetic_channels(n, 10000))
+        bench_patch("synthetic 100 channels x 10000 samples", synthetic_channels(100, 10000))
+        bench_partial("synthetic 200 systems", synthetic_pcf(200), ["DmeParticleSystemDefinition"])
+        bench_partial("synthetic 100 channels x 10000 samples", synthetic_channels(100, 10000), ["DmElement"])
+        for n in (1000, 10000):
+            bench_kv2(f"synthetic keyvalues2 vmap, {n} entities", synthetic_vmap(n))
@@ -0,0 +1,65 @@
+# Compare KeyValues1 token readers, and KV building via a KeyValues tree vs directly.
+# python dev/bench_keyvalues.py [game_sounds_*.txt ...]
+# Without arguments a synthetic game_sounds file is generated.
+
+import sys
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).parents[1]))
+
+from shared.cppkeyvalues import KeyValues, CUtlBuffer, CKeyValuesTokenReader, CKeyValuesTokenCursor
+from shared.keyvalues1 import KV
+
+def synthetic_game_sounds(n_entries: int = 2000) -> str:
+    entry = (
+        '"Weapon_{0}.Single"\n{{\n'
+        '\t"channel"\t\t"CHAN_WEAPON"\n'
+        '\t"volume"\t\t"0.7, 1.0"\n'
+        '\t"soundlevel"\t"SNDLVL_GUNFIRE" // loud\n'
+        '\t"pitch"\t\t"95,105"\n'
+        '\t"rndwave"\n\t{{\n'
+        '\t\t"wave"\t")weapons/w{0}/fire1.wav"\n'
+        '\t\t"wave"\t")weapons/w{0}/fire2.wav"\n'
+        '\t}}\n}}\n'
+    )
+    return "".join(entry.format(i) for i in range(n_entries))
+
+def load(text: str, reader) -> KeyValues:
+    kv = KeyValues("")
+    kv.RecursiveLoadFromBuffer("bench", reader, True)
+    return kv
+
+def bench(name: str, text: str):
+    start = perf_counter()
+    new = load(text, CKeyValuesTokenCursor(text))
+    t_cursor = perf_counter() - start
+
+    start = perf_counter()
+    old = load(text, CKeyValuesTokenReader(CUtlBuffer(text)))
+    t_reader = perf_counter() - start
+
+    assert old.ToString() == new.ToString(), "readers disagree"
+    print(f"{name}: {len(text)/1024:.0f} KiB | reader {t_reader*1000:.0f} ms | cursor {t_cursor*1000:.0f} ms"
+          f" | x{t_reader/max(t_cursor, 1e-9):.1f}")
+
+    # KeyValues tree -> ToBuiltin() -> KV   vs   straight to KV
+    start = perf_counter()
+    tree = KV(new.keyName, load(text, CKeyValuesTokenCursor(text)).value.ToBuiltin())
+    t_tree = perf_counter() - start
+
+    start = perf_counter()
+    direct = KV.CollectionFromBuffer(text)
+    t_direct = perf_counter() - start
+
+    assert tree == direct, "KV.CollectionFromBuffer disagrees with the KeyValues tree"
+    print(f"{' '*len(name)}  KV via tree {t_tree*1000:.0f} ms | KV direct {t_direct*1000:.0f} ms"
+          f" | x{t_tree/max(t_direct, 1e-9):.1f}")
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        for file in sys.argv[1:]:
+            bench(file, Path(file).read_text(encoding="utf-8"))
+    else:
+        for n in (250, 500, 1000):
+            bench(f"synthetic {n}", synthetic_game_sounds(n))
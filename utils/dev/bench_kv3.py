@@ -0,0 +1,91 @@
+# Compare the old recursive KV3 string builder with KV3File.write streaming, on a vpcf sized structure.
+# python dev/bench_kv3.py [n_operators ...]
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).parents[1]))
+
+from shared.keyvalues3 import KV3File, resource
+
+def synthetic_vpcf(n_operators: int) -> KV3File:
+    operator = lambda i: {
+        '_class': f'C_OP_Operator{i % 40}',
+        'm_flOpStartFadeInTime': 0.1 * i,
+        'm_vecOutputMin': [0.0, 0.5, 1.0],
+        'm_bDisableOperator': bool(i % 2),
+        'm_nFieldOutput': '6',
+        'm_Children': [{'m_ChildRef': resource(Path(f'particles/child_{i}.vpcf'))}],
+    }
+    return KV3File(
+        _class='CParticleSystemDefinition',
+        m_Operators=[operator(i) for i in range(n_operators)],
+        m_Initializers=[operator(i) for i in range(n_operators // 2)],
+        m_Renderers=[{'_class': 'C_OP_RenderSprites', 'm_hTexture': resource(Path('materials/particle/fire.vtex'))}],
+    )
+
+def old_serialize(self):
+    kv3 = str(self.header) + '\n'
+    def obj_serialize(obj, indent = 1, dictKey = False):
+        preind = ('\t' * (indent-1))
+        ind = ('\t' * indent)
+        if obj is None:
+            return 'null'
+        elif isinstance(obj, bool):
+            if obj: return 'true'
+            return 'false'
+        elif isinstance(obj, str):
+            return '"' + obj + '"'
+        elif isinstance(obj, list):
+            s = '['
+            if any(isinstance(item, dict) for item in obj):
+                s = f'\n{preind}[\n'
+                for item in obj:
+                    s += (obj_serialize(item, indent+1) + ',\n')
+                return s + preind + ']\n'
+            return f'[{", ".join((obj_serialize(item, indent+1) for item in obj))}]'
+        elif isinstance(obj, dict):
+            s = preind + '{\n'
+            if dictKey:
+                s = '\n' + s
+            for key, value in obj.items():
+                if not isinstance(key, str):
+                    key = f'"{key}"'
+                s +=  ind + f"{key} = {obj_serialize(value, indent+1, dictKey=True)}\n"
+            return s + preind + '}'
+        else:
+            if type(obj) == float:
+                obj = round(obj, 6)
+            return str(obj)
+    return kv3 + obj_serialize(self)
+
+def bench(n_operators: int):
+    kv = synthetic_vpcf(n_operators)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp, 'bench.vpcf')
+
+        start = perf_counter()
+        path.write_text(old_serialize(kv))
+        t_old = perf_counter() - start
+        old_text = path.read_text()
+
+        start = perf_counter()
+        kv.save(path)
+        t_new = perf_counter() - start
+        assert path.read_text() == old_text, "writers disagree"
+
+        start = perf_counter()
+        kv.save(path, compact=True)
+        t_compact = perf_counter() - start
+        compact_size = os.path.getsize(path)
+
+    print(f"{n_operators} operators: {len(old_text)/1024:.0f} KiB | concat {t_old*1000:.0f} ms"
+          f" | write {t_new*1000:.0f} ms x{t_old/max(t_new, 1e-9):.1f}"
+          f" | compact {t_compact*1000:.0f} ms, {compact_size/1024:.0f} KiB")
+
+if __name__ == "__main__":
+    for n in map(int, sys.argv[1:]) if len(sys.argv) > 1 else (500, 2000, 8000):
+        bench(n)
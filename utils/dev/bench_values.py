@@ -0,0 +1,75 @@
+# Compare ad-hoc vector / texture transform string parsing against the memoized shared.typedvalues versions.
+# python dev/bench_values.py [materials dir]
+# Without arguments a synthetic vmt corpus is generated.
+
+import re
+import sys
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).parents[1]))
+
+from shared.typedvalues import ParseVector, ParseTexTransform, TypedValue
+
+re_vmt_value = re.compile(r'"?\$\w+"?\s+"([^"\n]*)"')
+
+def synthetic_values(n_materials: int = 5000) -> list[str]:
+    common = ('[1 1 1]', '{255 255 255}', '[0 0 0]', '.5', '1', '"[.5 .5 .5]"', '{128 64 0}', '[1 1]',
+              'center .5 .5 scale 1 1 rotate 0 translate 0 0', 'models/props/metal01', '0')
+    return [common[(i * 7) % len(common)] for i in range(n_materials * 6)]
+
+def corpus_values(root: Path) -> list[str]:
+    values = []
+    for vmt in root.rglob("*.vmt"):
+        values.extend(re_vmt_value.findall(vmt.read_text(encoding="utf-8", errors="replace")))
+    return values
+
+def adhoc_vector(s):
+    likelyColorInt = '{' in s or '}' in s
+    s = s.strip().replace('"', '').replace("'", "")
+    s = s.strip().replace(",", "").strip('][}{').strip(')(')
+    try:
+        values = [float(i) for i in s.split(' ') if i != '']
+    except ValueError:
+        return None
+    if not values:
+        return None
+    if likelyColorInt and len(values) >= 3:
+        values = [v / 255 for v in values]
+    return tuple(values)
+
+def adhoc_transform(s):
+    terms = [i.strip("'") for i in s.strip('"').split(' ')]
+    rv = []
+    for i, term in enumerate(terms):
+        try: nextTerm = float(terms[i+1])
+        except (IndexError, ValueError): continue
+        if term == 'rotate':
+            rv.append((term, nextTerm))
+            continue
+        try: nextnextTerm = float(terms[i+2])
+        except (IndexError, ValueError): continue
+        if term in ('center', 'scale', 'translate'):
+            rv.append((term, (nextTerm, nextnextTerm)))
+    return tuple(rv)
+
+def timed(fn, values):
+    start = perf_counter()
+    rv = [fn(v) for v in values]
+    return rv, perf_counter() - start
+
+def bench(name: str, values: list[str]):
+    for label, old, new in (("vector", adhoc_vector, ParseVector), ("transform", adhoc_transform, ParseTexTransform)):
+        a, t_old = timed(old, values)
+        b, t_new = timed(new, values)
+        assert a == b, f"{label} parsers disagree"
+        print(f"{name}: {len(values)} values | {label} ad-hoc {t_old*1000:.0f} ms | memoized {t_new*1000:.0f} ms"
+              f" | x{t_old/max(t_new, 1e-9):.1f}")
+    _, t_typed = timed(TypedValue, values)
+    print(f"{' '*len(name)}  TypedValue {t_typed*1000:.0f} ms | {TypedValue.cache_info()}")
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        bench(sys.argv[1], corpus_values(Path(sys.argv[1])))
+    else:
+        bench("synthetic", synthetic_values())
@@ -0,0 +1,74 @@
+# Time VDFDict on typical VMT edit patterns, and its memory per entry.
+# python dev/bench_vdfdict.py
+
+import sys
+import tracemalloc
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).parents[1]))
+
+from shared.keyvalues1 import KV, VDFDict
+
+VMT_KEYS = [
+    ("$basetexture", "models/props/crate01"), ("$bumpmap", "models/props/crate01_normal"),
+    ("$envmap", "env_cubemap"), ("$envmaptint", "[.3 .3 .3]"), ("$envmapmask", "models/props/crate01_mask"),
+    ("$surfaceprop", "wood_crate"), ("$model", 1), ("$phong", 1), ("$phongexponent", 20),
+    ("$phongboost", 0.5), ("$phongfresnelranges", "[.1 .5 1]"), ("$translucent", 1),
+    ("$opaque", 1), ("$additive", 1), ("$alpha", 0.75), ("$selfillum", 1),
+]
+
+def build(n):
+    return [KV("vertexlitgeneric", VMT_KEYS) for _ in range(n)]
+
+def lookups(vmts):
+    for kv in vmts:
+        for key, _ in VMT_KEYS:
+            kv[key]
+        kv["$missing"]
+
+def deletes(vmts):
+    # del vmt.KeyValues['$envmap'], $opaque cleanup in particles_import
+    for kv in vmts:
+        del kv["$envmap"]
+        for key in ("$translucent", "$additive", "$selfillum"):
+            del kv[key]
+
+def patches(vmts):
+    # patch material: copy, clear, update from include, drop insert/include
+    for kv in vmts:
+        patch = kv.copy()
+        patch.add("include", "materials/master.vmt")
+        patch.add("insert", {"$color2": "[1 0 0]"})
+        kv.clear()
+        kv.update(patch)
+        kv.update(kv["insert"])
+        del kv["insert"]
+        del kv["include"]
+
+def remap_table(n):
+    # one big block with duplicate keys, deleted from the front
+    kv = VDFDict()
+    for i in range(n):
+        kv.add(f"key{i % 100}", i)
+    for i in range(n):
+        del kv[f"key{i % 100}"]
+
+def timed(name, func, *args):
+    start = perf_counter()
+    func(*args)
+    print(f"{name:<28} {(perf_counter() - start) * 1000:8.1f} ms")
+
+if __name__ == "__main__":
+    n = 20000
+    timed(f"build {n} vmts", build, n)
+    vmts = build(n)
+    timed("lookups", lookups, vmts)
+    timed("deletes", deletes, vmts)
+    timed("patches", patches, build(n))
+    timed("remap table 20000 deletes", remap_table, 20000)
+
+    tracemalloc.start()
+    vmts = build(2000)
+    size, _ = tracemalloc.get_traced_memory()
+    print(f"{'memory per entry':<28} {size / (2000 * len(VMT_KEYS)):8.1f} B")
@@ -0,0 +1,76 @@
+# Import a few materials whose masks come from textures that texture jobs make, serially and in worker processes.
+# python dev/test_materials_import.py
+
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+UTILS = Path(__file__).parents[1]
+
+GAMEINFO = '"GameInfo"\n{\n\tgame "Test"\n\tFileSystem\n\t{\n\t\tSearchPaths\n\t\t{\n\t\t\tgame |gameinfo_path|.\n\t\t}\n\t}\n}\n'
+
+VMTS = {
+    # animated sheet of fire000..002, with a translucency mask from the sheet
+    "anim/fire.vmt": '"UnlitGeneric"\n{\n\t"$basetexture" "anim/fire"\n\t"$translucent" 1\n}\n',
+    # csgo viewmodel, with an ao mask from the ao texture copied from weapons/customization
+    "models/weapons/v_models/rif_ak47/rif_ak47.vmt":
+        '"VertexLitGeneric"\n{\n\t"$basetexture" "models/weapons/v_models/rif_ak47/rif_ak47"\n}\n',
+    "missing.vmt": '"UnlitGeneric"\n{\n\t"$basetexture" "nope"\n\t"$translucent" 1\n}\n',
+}
+
+def image(path: Path, bands: int, rng: np.random.Generator):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    pixels = rng.integers(0, 256, (16, 16, bands), dtype=np.uint8)
+    if bands == 4:
+        pixels[..., 3] = 255
+    Image.fromarray(pixels).save(path)
+
+class Test_TextureJobs(unittest.TestCase):
+    def convert(self, max_workers: int) -> tuple[Path, str]:
+        "Content materials folder and printed output of an import of `VMTS`"
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        root = Path(tmp.name)
+        src, game, content = root / "src", root / "game" / "mymod", root / "content" / "mymod" / "materials"
+        src.mkdir()
+        (src / "gameinfo.txt").write_text(GAMEINFO)
+        for path, text in VMTS.items():
+            (src / "materials" / path).parent.mkdir(parents=True, exist_ok=True)
+            (src / "materials" / path).write_text(text)
+        game.mkdir(parents=True)
+        rng = np.random.default_rng(1)
+        for frame in range(3):
+            image(content / f"anim/fire{frame:03}.tga", 4, rng)
+        image(content / "models/weapons/v_models/rif_ak47/rif_ak47.tga", 3, rng)
+        image(content / "models/weapons/customization/rif_ak47/rif_ak47_ao.tga", 3, rng)
+        run = subprocess.run([sys.executable, "materials_import.py", "-i", src, "-e", game, "-b", "hlvr",
+            "--kvcache", "bypass", f"--max_workers={max_workers}"], cwd=UTILS, capture_output=True, text=True)
+        self.assertEqual(run.returncode, 0, run.stderr)
+        return content, run.stdout
+
+    def check(self, max_workers: int):
+        content, log = self.convert(max_workers)
+        self.assertTrue((content / "anim/fire.tga").is_file())
+        self.assertIn('TextureTranslucency\t"[1.000000 1.000000 1.000000 1.000000]"', (content / "anim/fire.vmat").read_text())
+
+        ao = "models/weapons/v_models/rif_ak47/rif_ak47_ao_g_ao.tga"
+        self.assertTrue((content / ao).is_file())
+        self.assertIn(f'TextureAmbientOcclusion\t"materials/{ao}"',
+            (content / "models/weapons/v_models/rif_ak47/rif_ak47.vmat").read_text())
+
+        self.assertIn('TextureTranslucency\t"materials/default/default_trans.tga"', (content / "missing.vmat").read_text())
+        self.assertIn("createMask not found\n\tmaterials/nope.tga\n", log)
+
+    def test_serial(self):
+        self.check(1)
+
+    def test_workers(self):
+        self.check(3)
+
+if __name__ == "__main__":
+    unittest.main()
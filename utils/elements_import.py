@@ -4,46 +4,57 @@ from pathlib import Path
 
 SHOULD_OVERWRITE = False
 KEEP_AS_TEXT = True
+# Binary sessions get their strings patched in place of a full load, and stay binary
+PATCH_BINARY = True
+
+def _sound_name(soundname: str):
+    file = Path(soundname) # 'sounds'/ 
+    return file.with_suffix('.vsnd').as_posix() if file.name else None
+
+# String attributes to update, by element type. "name" is the element's own name.
+REMAPS = {
+    'DmeFilmClip': {'mapname': lambda mapname: mapname.replace('.bsp', '.vmap')}, # Map
+    'DmeMaterialOverlayFXClip': {'material': lambda material: material.replace('.vmt', '.vmat')}, # Materials
+    'DmeGameModel': {'modelName': lambda modelName: modelName.replace('.mdl', '.vmdl')}, # Models
+    'DmeGameParticleSystem': {'particleSystemType': lambda system: sh.RemapTable.get('vpcf', {}).get(system, '')}, # Particles
+    'DmeProjectedLight': {'texture': lambda texture: texture.replace('.vtf', '.vtex')}, # Projected Lights (cookies)
+    'DmeGameSound': {'name': lambda name: name.replace('\\', '/'), 'soundname': _sound_name}, # Sounds
+}
+
+def remap_string(elemtype: str, key: str, value: str):
+    remap = REMAPS[elemtype].get(key)
+    return remap(value) if remap else None
 
 def ImportSFMSession(session_path: Path):
     """Update SFM resource references for S2FM."""
+    session_out_path = sh.output(session_path, dest=sh.EXPORT_GAME)
+    session_out_path.parent.MakeDir()
+
     sh.status(f"- Opening {session_path.local}...")
     try:
+        if PATCH_BINARY and dmx.read_header(session_path)[0] == 'binary':
+            # only the strings change, everything else is copied over
+            dmx.patch(session_path, session_out_path, remap_string, element_types=REMAPS)
+            print('+ Imported', session_path.local)
+            return session_out_path
         session = dmx.load(session_path)
     except Exception:
         return print("Error while reading:", session_path.local)
 
-    # Map
-    for clip in session.find_elements(elemtype='DmeFilmClip'):
-        clip['mapname'] = clip.get('mapname', '').replace('.bsp', '.vmap')
-
-    # Materials
-    for overlay in session.find_elements(elemtype='DmeMaterialOverlayFXClip'):
-        overlay['material'] = overlay.get('material', '').replace('.vmt', '.vmat')
+    for elemtype, remaps in REMAPS.items():
+        for element in session.find_elements(elemtype=elemtype) or ():
+            for key in remaps:
+                if key == 'name':
+                    element.name = remap_string(elemtype, key, element.name)
+                    continue
+                value = remap_string(elemtype, key, element.get(key, ''))
+                if value is not None:
+                    element[key] = value
 
-    # Models
-    for game_model in session.find_elements(elemtype='DmeGameModel'):
-        game_model['modelName'] = game_model.get('modelName', '').replace('.mdl', '.vmdl')
-
-    # Particles
-    for game_particle in session.find_elements(elemtype='DmeGameParticleSystem'):
-        game_particle['particleSystemType'] = sh.RemapTable.get('vpcf', {}).get(game_particle.get('particleSystemType', ''), '')
-
-    # Projected Lights (cookies)
-    for projected_light in session.find_elements(elemtype='DmeProjectedLight'):
-        projected_light['texture'] = projected_light.get('texture', '').replace('.vtf', '.vtex')
-
-    # Sounds
-    for game_sound in session.find_elements(elemtype='DmeGameSound'):
-        game_sound.name = game_sound.name.replace('\\', '/')
-        file = Path(game_sound.get('soundname', '')) # 'sounds'/ 
-        if file.name:
-            game_sound['soundname'] = file.with_suffix('.vsnd').as_posix()
-
-    session_out_path = sh.output(session_path, dest=sh.EXPORT_GAME)
-    session_out_path.parent.MakeDir()
-    # text cuz binary won't work right now.
-    session.write(session_out_path, 'keyvalues2', 4)
+    if KEEP_AS_TEXT:
+        session.write(session_out_path, 'keyvalues2', 4)
+    else:
+        session.write(session_out_path, 'binary', 5)
     print('+ Imported', session_path.local)
     return session_out_path
 
@@ -54,17 +65,6 @@ def main():
     for session in sh.collect('elements', '.dmx', '.dmx', SHOULD_OVERWRITE, searchPath=sh.src('elements/sessions')):
         ImportSFMSession(session)
     
-    if False and not KEEP_AS_TEXT:
-        # convert to binary through dmxconvert.exe
-        # won't accept args somehow
-        sh.eEngineUtils.dmxconvert([
-            f'-i {imported.parent}\demo.dmx"',
-            '-ie', "keyvalues2",
-            f'-o {imported.parent}\demo.dmx',
-            "-oe", "binary",
-            "-of", "sfm_session",
-        ])
-
     print("Looks like we are done!")
 
 if __name__ == "__main__":
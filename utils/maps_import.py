@@ -4,8 +4,11 @@ import shared.base_utils2 as sh
 import vdf
 import bsp_tool
 import itertools
+import functools
+import io
 from pathlib import Path
 import shared.datamodel as dmx
+from shared.typedvalues import ParseFloats
 from shared.datamodel import (
     uint64,
     Vector3 as vector3,
@@ -109,8 +112,12 @@ class base_vmf(str, Enum):
     cordon = "cordon"
     cordons = "cordons"
 
+@functools.cache
+def _empty_vmap() -> bytes:
+    return (Path(__file__).parent / "shared/empty.vmap.txt").read_bytes()
+
 def create_fresh_vmap() -> dmx.DataModel:
-    boilerplate = dmx.load(Path(__file__).parent / "shared/empty.vmap.txt")
+    boilerplate = dmx.load(in_file=io.BytesIO(_empty_vmap()))
     boilerplate.prefix_attributes.type = "$prefix_element$"
     return boilerplate
 
@@ -152,6 +159,8 @@ class _BaseNode(_CustomElement):
             return v
         _type = self.__annotations__[k]
 
+        if issubclass(_type, dmx._Vector):
+            return _type(ParseFloats(v) or v.split())
         if issubclass(_type, list):
             if issubclass(_type, dmx._Array):
                 return dmx.make_array(v.split(), _type)
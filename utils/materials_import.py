@@ -1,14 +1,24 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext, redirect_stdout
 from enum import Enum, auto
+from hashlib import blake2b
+import io
 import math
+import os
+import sys
+from collections import OrderedDict
 from pathlib import Path
 from shutil import copyfile
-from typing import Any, Callable, Literal
-from PIL import Image, ImageOps
+from threading import Lock
+from time import perf_counter
+from typing import Any, Callable, Iterator, Literal
+from PIL import Image
 
 import shared.base_utils2 as sh
 from shared.base_utils2 import IMPORT_MOD, DOTA2, STEAMVR, HLVR, SBOX, ADJ, CS2
-from shared.keyvalues1 import KV
+from shared.keyvalues1 import KV, g_KVFileCache, g_KVDiskCache
 from shared.material_proxies import ProxiesToDynamicParams
+from shared.typedvalues import ParseVector, ParseTexTransform
 
 import numpy as np
 from shared import PFM
@@ -28,6 +38,11 @@ PRINT_LEGACY_IMPORT = False  # Print vmt inside vmat as reference. Increases fil
 IGNORE_PROXIES = False
 CSGO_EXPORT_TOUCHSTONE = False # Use *generic shaders when on CS2 Branch
 
+# Convert materials in this many processes. 1 to convert them one after another in this process.
+MAX_WORKERS = min(os.cpu_count() or 1, 8)
+# Decoded source textures kept in memory for reuse, in MiB per process.
+IMAGE_CACHE_MIB = 256
+
 sh.DEBUG = False
 
 # File format of the textures. Needs to be lowercase
@@ -57,6 +72,13 @@ class Failures(dict):
         self[err].append(file)
     def __len__(self):
         return sum(len(filelist) for filelist in self.values())
+    def add_kv_errors(self, kv: KV):
+        for error in kv.parseErrors:
+            self.add(f"KeyValues error: {error.message.strip()}", error.Where())
+
+    def merge(self, other: 'Failures'):
+        for err, files in other.items():
+            self.setdefault(err, list()).extend(files)
 
     #def __bool__(self):
     #    return len(self.data) > 0
@@ -64,9 +86,85 @@ class Failures(dict):
 failureList = Failures()
 total=import_total=import_invalid=import_extra = 0
 
-def main():
-    print('\nSource 2 Material Converter!')
+class MaterialContext:
+    """
+    Everything the conversion of one vmt reads and writes, in place of module globals,
+    so materials can be converted in worker processes.
+    Textures are queued in `textures`, to be written once every material is translated.
+    Other writes to files other materials also write to are deferred as jobs for the main process, run after that.
+    """
+    def __init__(self, vmt_path: Path = None):
+        self.vmt_path = vmt_path
+        self.vmt: VMT = None
+        self.vmat: VMAT = None
+        self.failures = Failures()
+        self.jobs: list[tuple[Callable, tuple, dict]] = []
+        self.textures = TextureJobs()
+        self.masks: list[tuple[str, tuple[str, str]]] = []  # (predicted path in the vmat, job key)
+        self.extra = 0
+        self.result = None
+        self.log: str = None  # printed output, when converted in a worker
+        self.cache_counters: list[int | float] = None
+
+    def defer(self, func: Callable, *args, **kwargs):
+        self.jobs.append((func, args, kwargs))
+
+deferredJobs: list[tuple[Callable, tuple, dict]] = []
+
+# stages of texture jobs: textures made from other files, then textures read, then textures edited in place
+TEXTURE_CREATE, TEXTURE_READ, TEXTURE_EDIT = range(3)
+
+class TextureJobs:
+    """
+    Texture files to write, keyed by the file they write and a hash of their parameters,
+    so a texture that many materials ask for is made once.
+    Jobs run stage by stage. Within a stage, jobs of one group (by default the file they write)
+    run in the order they were added, in one process.
+    """
+    def __init__(self):
+        self.m_Jobs: dict[tuple[str, str], tuple[int, str, Callable, tuple, dict]] = {}
+        self.results: dict[tuple[str, str], Any] = {}
+        self.duplicates = 0
+
+    def add(self, stage: int, path: Path, func: Callable, *args, group: Path = None, **kwargs) -> tuple[str, str]:
+        "Queue ``func(*args, **kwargs)`` to write `path`, unless it is queued already. Returns the key of the job"
+        params = blake2b(repr((func.__name__, args, sorted(kwargs.items()))).encode(), digest_size=16)
+        key = (os.fspath(path), params.hexdigest())
+        if key in self.m_Jobs:
+            self.duplicates += 1
+        else:
+            self.m_Jobs[key] = (stage, os.fspath(group or path), func, args, kwargs)
+        return key
+
+    def merge(self, other: 'TextureJobs'):
+        self.duplicates += other.duplicates
+        for key, job in other.m_Jobs.items():
+            if key in self.m_Jobs:
+                self.duplicates += 1
+            else:
+                self.m_Jobs[key] = job
+
+    def stages(self) -> Iterator[list[list[tuple]]]:
+        "For every stage, the jobs of each group as (key, func, args, kwargs)"
+        for stage in sorted({job[0] for job in self.m_Jobs.values()}):
+            groups: dict[str, list[tuple]] = {}
+            for key, (job_stage, group, func, args, kwargs) in self.m_Jobs.items():
+                if job_stage == stage:
+                    groups.setdefault(group, []).append((key, func, args, kwargs))
+            yield list(groups.values())
+
+    def __str__(self):
+        return f"{len(self.m_Jobs)} written | {self.duplicates} duplicates skipped"
+
+g_TextureJobs = TextureJobs()
 
+class TextureJobFailed(Exception):
+    "A texture job couldn't make its texture. Reported as `error` for `file`, and `result` is used in its place"
+    def __init__(self, error: str, file: str, result: Any):
+        super().__init__(error, file, result)
+        self.error, self.file, self.result = error, file, result
+
+def update_conditionals():
     # update branch conditionals
     globals().update(
         (k,v) for (k, v) in sh.__dict__.items()
@@ -85,9 +183,16 @@ def main():
                 continue
             KNOWN[k] = v
 
-    global total, import_total, import_invalid
+def main():
+    print('\nSource 2 Material Converter!')
+
+    update_conditionals()
+    g_ImageCache.max_bytes = IMAGE_CACHE_MIB * 1024 * 1024
+
+    global total, import_total, import_invalid, g_TextureJobs
+    g_TextureJobs = TextureJobs()
     sh.importing = materials
-    for vmt_path in sh.collect(
+    vmt_paths = sh.collect(
             materials,
             IN_EXT, OUT_EXT,
             existing=OVERWRITE_VMAT,
@@ -97,14 +202,23 @@ def main():
             # "de_nuke/nukwater_movingplane.vmt"
             # "models/weapons/v_models/rif_ak47/ak47.vmt"
             # "test/test.vmt"
-            match=None):
+            match=None)
 
-        total += 1
-        if ImportVMTtoVMAT(vmt_path):
-            import_total += 1
-        else:
-            sh.skip("invalid", vmt_path)
-            import_invalid += 1
+    with WorkerPool() as pool:
+        for ctx in ConvertVMTs(vmt_paths, pool):
+            total += 1
+            if FinishVMT(ctx):
+                import_total += 1
+            else:
+                sh.skip("invalid", ctx.vmt_path)
+                import_invalid += 1
+
+        print("\nTextures...")
+        WriteTextures(pool)
+
+    for func, args, kwargs in deferredJobs:
+        func(*args, **kwargs)
+    deferredJobs.clear()
 
     print("\nSkybox materials...")
 
@@ -126,6 +240,10 @@ def main():
         print(f"Total skipped:\t{import_invalid} / {total}\t| " + "{:.2f}".format((import_invalid/total) * 100) + f" % Skipped")
         print(f"Total errors :\t{len(failureList)} / {total}\t| " + "{:.2f}".format((len(failureList)/total) * 100) + f" % Had Errors")
         print(f"Total extra :\t{import_extra}")
+        print(f"VMT cache   :\t{g_KVFileCache}")
+        print(f"Image cache :\t{g_ImageCache}")
+        print(f"Texture jobs:\t{g_TextureJobs}")
+        print(f"Disk cache  :\t{g_KVDiskCache}")
 
     except Exception: pass
     # csgo -> 183 / 15308 | 1.20 % Error rate -- 4842 / 15308 | 31.63 % Skip rate
@@ -227,9 +345,8 @@ class VMAT(ValveMaterial):
 
     @shader.setter
     def shader(self, n: str):
-        if SBOX:
-            SOURCE2_SHADER_EXT = ".shader"
-        if not n.endswith(SOURCE2_SHADER_EXT): n += SOURCE2_SHADER_EXT
+        ext = ".shader" if SBOX else SOURCE2_SHADER_EXT
+        if not n.endswith(ext): n += ext
         self._shader = n
         self._kv['shader'] = n
 
@@ -372,13 +489,14 @@ shaderDict = {
     #modulate
 }
 
-def chooseShader():
+def chooseShader(ctx: MaterialContext):
+    vmt, vmat = ctx.vmt, ctx.vmat
     get_shader = lambda v: v() if callable(v) else v
     d = {get_shader(x):0 for x in list(shaderDict.values())}
 
     if vmt.shader not in shaderDict:
         if sh.DEBUG:
-            failureList.add(f"{vmt.shader} unsupported shader", vmt.path)
+            ctx.failures.add(f"{vmt.shader} unsupported shader", vmt.path)
         return core.black_unlit()
 
     d[get_shader(shaderDict[vmt.shader])] += 1
@@ -434,7 +552,8 @@ def fixVmtTextureDir(localPath, fileExt = TEXTURE_FILEEXT) -> str:
         return ""
     return (materials / localPath.lstrip('\\/')).with_suffix(fileExt).as_posix()
 
-def formatNewTexturePath(vmtPath: str, textureType: str) -> str:
+def formatNewTexturePath(ctx: MaterialContext, vmtPath: str, textureType: str) -> str:
+    vmat = ctx.vmat
     texturePath = sh.output(fixVmtTextureDir(vmtPath))
     # check if texture exists on disk
     if texturePath.is_file():
@@ -451,7 +570,8 @@ def formatNewTexturePath(vmtPath: str, textureType: str) -> str:
             if not frame.is_file(): break
             frames.append(frame)
         # generate an animation sheet with the name we were looking for
-        grid_w, grid_h, texturePath = TextureFramesToSheet(frames)
+        grid_w, grid_h, texturePath = SheetLayout(frames)
+        ctx.textures.add(TEXTURE_CREATE, texturePath, TextureFramesToSheet, frames)
         vmat.KeyValues["g_nNumAnimationCells"] = len(frames)
         #vmat.KeyValues["g_flAnimationTimePerFrame"] = 1 / fps
         vmat.KeyValues["g_vAnimationGrid"] = f"[{grid_w} {grid_h}]"
@@ -473,7 +593,111 @@ def getTexture(vtf_path):
     # source1import does the same
     return None
 
-def createMask(image_path, copySub = '_mask', channel = 'A', invert = False, queue = True) -> str:
+def _DecodeRGBA(path: Path) -> np.ndarray:
+    with Image.open(path) as image:
+        return np.asarray(image.convert('RGBA'))
+
+class CImageCache:
+    """
+    Decoded images by path, size and mtime, least recently used first out once over `max_bytes`.
+    Materials often share source textures, and one texture can be split into several masks.
+    The arrays are read-only; copy before editing.
+    """
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.m_Entries: OrderedDict[tuple, tuple[np.ndarray, float]] = OrderedDict()
+        self.m_nBytes = 0
+        self.hits = self.misses = self.evictions = 0
+        self.time_saved = 0.0
+        self.m_Lock = Lock()
+
+    def Load(self, path: Path, decode: Callable[[Path], np.ndarray] = _DecodeRGBA) -> np.ndarray:
+        "``decode(path)``, an RGBA array by default, unless the cache has it"
+        st = os.stat(path)
+        key = (decode, os.fspath(path), st.st_size, st.st_mtime_ns)
+        with self.m_Lock:
+            entry = self.m_Entries.get(key)
+            if entry is not None:
+                self.m_Entries.move_to_end(key)
+                self.hits += 1
+                self.time_saved += entry[1]
+                return entry[0]
+
+        start = perf_counter()
+        array = decode(path)
+        array.setflags(write=False)
+        decode_time = perf_counter() - start
+        with self.m_Lock:
+            self.misses += 1
+            if array.nbytes <= self.max_bytes and key not in self.m_Entries:
+                self.m_Entries[key] = array, decode_time
+                self.m_nBytes += array.nbytes
+                while self.m_nBytes > self.max_bytes:
+                    _, (evicted, _) = self.m_Entries.popitem(last=False)
+                    self.m_nBytes -= evicted.nbytes
+                    self.evictions += 1
+        return array
+
+    def Forget(self, path: Path):
+        "Drop the entries of a file that is being rewritten"
+        path = os.fspath(path)
+        with self.m_Lock:
+            for key in [key for key in self.m_Entries if key[1] == path]:
+                self.m_nBytes -= self.m_Entries.pop(key)[0].nbytes
+
+    def __str__(self):
+        lookups = self.hits + self.misses
+        return (f"{self.hits} hits | {self.misses} misses | {self.hits / max(lookups, 1):.0%} hit rate | "
+                f"{self.evictions} evicted | {len(self.m_Entries)} images, ~{self.m_nBytes / (1024 * 1024):.1f} MiB | "
+                f"~{self.time_saved:.1f} s decoding saved")
+
+g_ImageCache = CImageCache()
+
+def extractMask(rgba: np.ndarray, channel = 'A', invert = False) -> np.ndarray:
+    "One channel of an RGBA array, or 'L' for luminance, as a grayscale array"
+    if channel == 'L':
+        # PIL's weighted sum in C beats integer math in numpy several times over
+        mask = np.asarray(Image.fromarray(rgba).convert('L'))
+    else:
+        # contiguous, as the constant check and the writer are faster on it than on a strided view
+        mask = np.ascontiguousarray(rgba[:, :, 'RGBA'.index(channel)])
+    if invert:
+        mask = 255 - mask
+    return mask
+
+_TGA_FOOTER = b"\0" * 8 + b"TRUEVISION-XFILE.\0"
+
+def _TGAHeader(width: int, height: int, bands: int) -> bytes:
+    # no id or colormap, type 3 (grayscale) or 2 (true color), origin 0 0, bottom-up rows, no alpha bits
+    return (bytes((0, 0, 3 if bands == 1 else 2, 0, 0, 0, 0, 0, 0, 0, 0, 0))
+        + width.to_bytes(2, 'little') + height.to_bytes(2, 'little') + bytes((8 * bands, 0)))
+
+def saveMask(path: Path, mask: np.ndarray):
+    "Save a grayscale array. TGAs are written directly: uncompressed, bottom-up rows, as PIL would."
+    if path.suffix.lower() != '.tga':
+        # optimize is the slowest zlib level for a few bytes less; masks are rewritten on every import
+        params = {'compress_level': 1} if path.suffix.lower() == '.png' else {}
+        Image.fromarray(np.ascontiguousarray(mask)).save(path, **params)
+        return
+    height, width = mask.shape
+    with open(path, 'wb') as fp:
+        fp.write(_TGAHeader(width, height, 1))
+        fp.write(np.ascontiguousarray(mask[::-1]).data)
+        fp.write(_TGA_FOOTER)
+
+def mapTGA(path: Path, width: int, height: int) -> np.ndarray:
+    "Create a black RGB TGA, as PIL would save it, mapped to a writable array of its pixels: top row first, in RGB order"
+    header = _TGAHeader(width, height, 3)
+    size = len(header) + width * height * 3
+    with open(path, 'wb') as fp:
+        fp.write(header)
+        fp.truncate(size)
+        fp.seek(size)
+        fp.write(_TGA_FOOTER)
+    # stored bottom-up, in BGR order
+    return np.memmap(path, np.uint8, 'r+', len(header), (height, width, 3))[::-1, :, ::-1]
+
+def createMask(ctx: MaterialContext, image_path, copySub = '_mask', channel = 'A', invert = False, queue = True) -> str:
 
     if not (image_path:=fixVmtTextureDir(image_path)):
         return default(copySub)
@@ -491,36 +715,36 @@ def createMask(image_path, copySub = '_mask', channel = 'A', invert = False, que
     if newMaskPath.exists():
         return newMaskPath.local.as_posix()
 
+    if not queue:
+        try:
+            return writeMask(image_path, newMaskPath, copySub, channel, invert)
+        except TextureJobFailed as failed:
+            ctx.failures.add(failed.error, f'{ctx.vmt.path.local} - {failed.file}')
+            return failed.result
+
+    # The vmat gets the path the mask will have. Masks of one image are made together, so it is decoded once.
+    # The image may be one that a texture job makes (animated sheets, viewmodel AO), so it is looked for then.
+    key = ctx.textures.add(TEXTURE_READ, newMaskPath, writeMask, image_path, newMaskPath, copySub, channel, invert, group=image_path)
+    ctx.masks.append((newMaskPath.local.as_posix(), key))
+    return newMaskPath.local.as_posix()
+
+def writeMask(image_path: Path, newMaskPath: Path, copySub, channel, invert) -> str:
+    "Extract a mask from `image_path`. Returns what the vmat should use: the mask, a default or a constant color"
     if not image_path.is_file():
         sh.msg("Couldn't find image", image_path)
-        failureList.add(f"createMask not found", f'{vmt.path.local} - {image_path.local}')
         print(f"~ ERROR: Couldn't find requested image ({image_path.local}).\nPlease make sure all textures have been pre-exported.")
-        return default(copySub)
+        raise TextureJobFailed("createMask not found", image_path.local.as_posix(), default(copySub))
 
-    image = Image.open(image_path).convert('RGBA')
+    mask = extractMask(g_ImageCache.Load(image_path), channel, invert)
 
-    if channel == 'L':
-        imgChannel = image.convert('L')
-    else:
-        imgChannel = image.getchannel(str(channel))
-
-    if invert:
-        imgChannel = ImageOps.invert(imgChannel)
-
-    colors = imgChannel.getcolors()
-    if len(colors) == 1:  # mask with single color
+    if np.ptp(mask) == 0:  # mask with single color
+        color = int(mask.flat[0])
         if (copySub == ("_gloss" if STEAMVR else "_rough")
-        and colors[0][1] == (255 if STEAMVR else 0)):  # fix some very dumb .convert('RGBA') with 255 255 255 alpha
+        and color == (255 if STEAMVR else 0)):  # fix some very dumb .convert('RGBA') with 255 255 255 alpha
             return default(copySub)  # TODO: should this apply to other types of masks as well?
-        return fixVector(f"{{{colors[0][1]} {colors[0][1]} {colors[0][1]}}}", True)
-
-    bg = Image.new("L", image.size)
+        return fixVector(f"{{{color} {color} {color}}}", True)
 
-    # Copy the specified channel to the new image using itself as the mask
-    bg.paste(imgChannel)
-
-    bg.convert('L').save(newMaskPath, optimize=True)  #.convert('P', palette=Image.ADAPTIVE, colors=8)
-    bg.close()
+    saveMask(newMaskPath, mask)
     print("+ Saved mask to", newMaskPath.local)
 
     return newMaskPath.local.as_posix()
@@ -531,6 +755,48 @@ def createMask(image_path, copySub = '_mask', channel = 'A', invert = False, que
 # https://developer.valvesoftware.com/wiki/File:Skybox_Template.jpg
 # https://learnopengl.com/img/advanced/cubemaps_skybox.png
 # ----------------------------------------------------------------------
+def ResetPeakRSS():
+    "Start measuring the peak memory use of this process anew, where the OS allows it (Linux)"
+    try:
+        with open("/proc/self/clear_refs", "w") as fp:
+            fp.write("5")
+    except OSError:
+        pass
+
+def PeakRSS() -> int:
+    "Peak memory use (resident set size) of this process in bytes, since the last `ResetPeakRSS` if supported"
+    try:
+        import resource
+    except ImportError:  # windows
+        import ctypes
+        from ctypes import wintypes
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [(name, ctypes.c_size_t) for name in (
+                "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage",
+                "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")]
+        counters = PROCESS_MEMORY_COUNTERS(cb=ctypes.sizeof(PROCESS_MEMORY_COUNTERS))
+        kernel32 = ctypes.windll.kernel32
+        if not kernel32.K32GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return 0
+        return counters.PeakWorkingSetSize
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024  # bytes on macOS, KiB elsewhere
+
+def _paste(cube: np.ndarray, face: np.ndarray, x: int, y: int, decode: Callable[[np.ndarray, np.ndarray], Any] = np.copyto):
+    "Write `face` into `cube` at `x`, `y` with ``decode(region, face)``, cut to fit like PIL's paste"
+    height = min(face.shape[0], cube.shape[0] - y)
+    width = min(face.shape[1], cube.shape[1] - x)
+    decode(cube[y:y+height, x:x+width], face[:height, :width])
+
+def uncompressHDR(out: np.ndarray, rgba: np.ndarray):
+    "Decode compressed HDR (RGBA) pixels into `out`, in float32 and in place"
+    # https://developer.valvesoftware.com/wiki/Valve_Texture_Format#:~:text=RGB%20%3D%20(RGB%20*%20(A%20*%2016))%20/%20262144
+    scale = rgba[:, :, 3:].astype(np.float32)
+    scale *= 16 * HDRCOMPRESS_FIX_MUL / 262144
+    np.copyto(out, rgba[:, :, :3])
+    out *= scale
+    np.power(out, HDRCOMPRESS_FIX_EXP, out=out)
+
 def createSkyCubemap(json_collection: Path, maxFaceRes: int = 0):
 
     cube_name = None
@@ -556,9 +822,10 @@ def createSkyCubemap(json_collection: Path, maxFaceRes: int = 0):
         if isinstance(faceP[face], dict):
             faceParams[face].update(faceP[face])
         if (hdrType == 'uncompressed'):
-            size = PFM.read_pfm(facePath)[2]
+            size = PFM.read_pfm_size(facePath)
         else:
-            size = Image.open(facePath).size
+            with Image.open(facePath) as image:
+                size = image.size
         faceParams[face]['size'] = size
         maxFaceRes = max(maxFaceRes, max(size[0], size[1]))  # the largest face determines the resolution of the full image
         if cube_name is None:  # Derive _cube name from face name. Dont get duplicates alla nukeblank_cube, dustblank_cube
@@ -593,18 +860,24 @@ def createSkyCubemap(json_collection: Path, maxFaceRes: int = 0):
             faceRotate += 90
         return pasteCoord, faceRotate
 
-    if hdrType != 'uncompressed':
-        image_mode = 'RGBA' if (hdrType == 'compressed') else 'RGB'
-        SkyCubemapImage = Image.new(image_mode, (cube_w, cube_h), color = (0, 0, 0))
+    # The cross goes straight into the output file, one face at a time, so only a face is ever in memory.
+    # Faces are used once, so they skip the image cache.
+    ResetPeakRSS()
+    image_mode = 'RGBA' if (hdrType == 'compressed') else 'RGB'
+    if hdrType:
+        SkyCubemapImage = PFM.create_pfm(sky_cubemap_path, cube_w, cube_h)
+    elif sky_cubemap_path.suffix == '.tga':
+        SkyCubemapImage = mapTGA(sky_cubemap_path, cube_w, cube_h)
     else:
-        SkyCubemapImage = np.zeros((cube_h, cube_w, 3), dtype='float32')
+        SkyCubemapImage = np.zeros((cube_h, cube_w, 3), dtype=np.uint8)
 
     for face, facePath in faceList.items():
         #faceScale = faceParams[face].get('scale')
         if hdrType != 'uncompressed':
-            if not (faceImage := Image.open(facePath).convert(image_mode)): continue
+            with Image.open(facePath) as image:
+                faceImage = image.convert(image_mode)
         else:
-            try: faceImage, scale, _ = PFM.read_pfm(facePath)
+            try: faceImage = PFM.map_pfm(facePath)
             except Exception: continue
 
         pasteCoord, faceRotate = get_transform(face, int(faceParams[face].get('rotate') or 0))
@@ -622,54 +895,56 @@ def createSkyCubemap(json_collection: Path, maxFaceRes: int = 0):
             if faceRotate:
                 faceImage = faceImage.rotate(faceRotate)
 
-            SkyCubemapImage.paste(faceImage, pasteCoord)
+            faceImage = np.asarray(faceImage)
+            if hdrType == 'compressed':
+                _paste(SkyCubemapImage, faceImage, *pasteCoord, uncompressHDR)
+            else:
+                _paste(SkyCubemapImage, faceImage, *pasteCoord)
         else:
             if faceRotate:
                 faceImage = np.rot90(faceImage, -1)
 
-            SkyCubemapImage[pasteCoord[1]:pasteCoord[1]+faceImage.shape[0],
-                            pasteCoord[0]:pasteCoord[0]+faceImage.shape[1]] = np.flipud(faceImage)
+            _paste(SkyCubemapImage, np.flipud(faceImage), *pasteCoord)
+        del faceImage
 
-    if hdrType is None:
-        SkyCubemapImage.save(sky_cubemap_path)
-    elif hdrType == 'uncompressed':
-        PFM.write_pfm(sky_cubemap_path, SkyCubemapImage)
+    if isinstance(SkyCubemapImage, np.memmap):
+        SkyCubemapImage.flush()
     else:
-        # https://developer.valvesoftware.com/wiki/Valve_Texture_Format#:~:text=RGB%20%3D%20(RGB%20*%20(A%20*%2016))%20/%20262144
-        compressed_array = np.asarray( SkyCubemapImage, dtype='uint32')
-        RGB = compressed_array[:,:,:3]
-        A = compressed_array[:,:,[-1]]
-        uncompress = (((RGB * (A * 16) / 262144) * HDRCOMPRESS_FIX_MUL) ** HDRCOMPRESS_FIX_EXP).astype(np.float32)
-        # one between source2 and GIMP is reading the PFM flipped upside down. uncomment to display correctly on GIMP
-        #uncompress = np.flipud(uncompress)
-        PFM.write_pfm(sky_cubemap_path, uncompress)
+        Image.fromarray(SkyCubemapImage).save(sky_cubemap_path)
+    del SkyCubemapImage
 
+    print(f"+ Saved sky cubemap {sky_cubemap_path.local.as_posix()} ({cube_w}x{cube_h}), peak RSS {PeakRSS() / (1024 * 1024):.0f} MiB")
     return sky_cubemap_path
 
-def TextureFramesToSheet(frames: list[Path]):
+def SheetLayout(frames: list[Path]):
+    "Grid rows, grid columns and path of the animation sheet of `frames`"
     # find closest power of two number
     grid_max_power = math.ceil(math.log2(len(frames)))
     # keep the grid squarish
     grid_rows = 2 ** math.ceil(grid_max_power/2)
     grid_columns = 2 ** math.floor(grid_max_power/2)
 
+    return grid_rows, grid_columns, sh.output(frames[0].with_stem(frames[0].stem[:-3]))
+
+def TextureFramesToSheet(frames: list[Path]):
+    grid_rows, grid_columns, sheet_path = SheetLayout(frames)
+
     if sh.MOCK:
-        sheet_path = sh.output(frames[0].with_stem(frames[0].stem[:-3]))
         sheet_path.open('a').close()
     else:
-        sheet_path = save_atlas(frames, grid_rows, grid_columns)
+        save_atlas(frames, grid_rows, grid_columns)
     print("+ Saved animated texture", sheet_path.local.as_posix())
     sheet_path.with_name(sheet_path.stem + '.sheet.json').write_text(
         f'{{"g_nNumAnimationCells":{len(frames)},"g_vAnimationGrid":"[{grid_rows} {grid_columns}]"}}'
     )
 
-    return grid_rows, grid_columns, sheet_path
+    return sheet_path
 
 def save_atlas(frames, grid_rows, grid_columns):
     sheet_image: Image = None
     sheet_path: Path = None
     for frame_no, frame in enumerate(frames):
-        frame_image = Image.open(frame)
+        frame_image = Image.fromarray(g_ImageCache.Load(frame))
         if sheet_image is None:
             sheet_width = frame_image.width*grid_rows
             sheet_height = frame_image.height*grid_columns
@@ -705,45 +980,23 @@ def flipNormalMap(localPath):
     image_path = sh.output(localPath)
     if not image_path.exists():
         return
-    # Open the image and convert it to RGBA, just in case it was indexed
-    image = Image.open(image_path).convert('RGBA')
-
-    r,g,b,a = image.split()
-    g = ImageOps.invert(g)
-    final_transparent_image = Image.merge('RGBA', (r,g,b,a))
-    final_transparent_image.save(image_path)
+    # RGBA, just in case it was indexed
+    image = g_ImageCache.Load(image_path).copy()
+    image[:, :, 1] = 255 - image[:, :, 1]
+    g_ImageCache.Forget(image_path)
+    Image.fromarray(image).save(image_path)
 
 def fixVector(s, addAlpha = 1, returnList = False):
-    s = str(s)
-    likelyColorInt = False
-    if('{' in s or '}' in s):
-        likelyColorInt = True
-
-    s = s.strip()  # TODO: remove letters
-    s = s.replace('"', '').replace("'", "")
-    s = s.strip().replace(",", "").strip('][}{').strip(')(')
-
-    try:
-        originalValueList = [str(float(i)) for i in s.split(' ') if i != '']
-    except ValueError:
+    values = ParseVector(str(s))
+    if values is None:
         return None
 
-    dimension = len(originalValueList)
-    if dimension == 0:
-        return None
-    elif dimension < 3:
-        likelyColorInt = False
-
-    for strvalue in originalValueList:
-        flvalue = float(strvalue)
-        if likelyColorInt: flvalue /= 255
-
-        originalValueList[originalValueList.index(strvalue)] = "{:.6f}".format(flvalue)
+    originalValueList = ["{:.6f}".format(value) for value in values]
 
     # todo $detailscale "[8 8 8]" ---> g_vDetailTexCoordScale [8.000000 8.000000 8.000000]
-    if(dimension <= 1):
+    if(len(values) <= 1):
         originalValueList.append(originalValueList[0])  # duplicate for 2D
-    elif(addAlpha and (dimension == 3)):
+    elif(addAlpha and (len(values) == 3)):
         originalValueList.append("{:.6f}".format(1))    # add alpha
 
     if returnList:  return originalValueList
@@ -752,7 +1005,8 @@ def fixVector(s, addAlpha = 1, returnList = False):
 def presence(_, rv=1):
     return rv
 
-def fix_envmap(vmtVal):
+def fix_envmap(ctx: MaterialContext, vmtVal):
+    vmt, vmat = ctx.vmt, ctx.vmat
     if 'environment maps/metal' in vmtVal:
         if vmtVal == 'environment maps/metal_generic_003':
             vmt.KeyValues['$metalness'] = 0.55
@@ -785,7 +1039,7 @@ def float_val(v: str):
 def uniform_vec2(v: str):
     return "[{:.6f} {:.6f}]".format(float(v), float(v))
 
-def vmat_layered_param(vmatKey, layer = 'A', force = False):
+def vmat_layered_param(vmat: VMAT, vmatKey, layer = 'A', force = False):
     if vmat.shader in BLENDABLES or force:
         return vmatKey + layer
     return vmatKey
@@ -803,25 +1057,8 @@ class TexTransform:
             self._readLegacyMatrix(legacyMatrix)
 
     def _readLegacyMatrix(self, s):
-        #  scale %f %f translate %f %f rotate %f (count 5, assumed center syntax)
-        #  center %f %f scale %f %f rotate %f translate %f %f (count 7)
-        s = s.strip('"')
-        mxTerms = [i.strip("'") for i in s.split(' ')]
-
-        for i, term in enumerate(mxTerms):
-
-            try: nextTerm = float(mxTerms[i+1])
-            except (IndexError, ValueError): continue
-
-            if term == 'rotate':
-                self.rotate = nextTerm
-                continue
-
-            try: nextnextTerm =  float(mxTerms[i+2])
-            except (IndexError, ValueError): continue
-
-            if term in ('center', 'scale', 'translate'):
-                setattr(self, term, (nextTerm, nextnextTerm))
+        for term, value in ParseTexTransform(s):
+            setattr(self, term, value)
 
 def is_convertible_to_float(value):
     try: float(value)
@@ -867,7 +1104,7 @@ class vmat_translation:
     @property
     def channel_to_extract(self): return self._innertuple[2]
 
-    def translate(self, vmtKey: str, vmtVal: str) -> str | None:
+    def translate(self, ctx: MaterialContext, vmtKey: str, vmtVal: str) -> str | None:
         func_ = self.translfunc[0]
         args_ = []
         args_.insert(0, vmtVal)
@@ -876,11 +1113,13 @@ class vmat_translation:
             args_.insert(1, self.texture_suffix)
 
         sh.msg(vmtKey, "->\t" + func_.__name__, args_, end=" -> ")
+        if func_ in (formatNewTexturePath, createMask, fix_envmap):
+            args_.insert(0, ctx)
         try:
             return func_(*args_)
         except ValueError as errrrr:
             print("Got ValueError:", errrrr, "on", f'{vmtKey}: {vmtVal} with {func_.__name__}')
-            failureList.add(f'ValueError on {func_.__name__}', f'{vmt.path.local} @ "{vmtKey}": "{vmtVal}"')
+            ctx.failures.add(f'ValueError on {func_.__name__}', f'{ctx.vmt.path.local} @ "{vmtKey}": "{vmtVal}"')
 
 # callable - to evaluate conditionals at runtime
 vmt_to_vmat_pre: Callable[[], dict[ str, dict[str, tuple | None] ]] = lambda: {
@@ -1155,7 +1394,8 @@ vmt_to_vmat = vmt_to_vmat_pre()
 KNOWN = {}
 """for proxies; when $color is known as g_vTintColor, proxies yielding to $color can be translated"""
 
-def convertVmtToVmat():
+def convertVmtToVmat(ctx: MaterialContext):
+    vmt, vmat = ctx.vmt, ctx.vmat
     # For each key-value in the vmt file...
     for vmtKey, vmtVal in vmt.KeyValues.iteritems():
         outKey = outVal = ''
@@ -1185,7 +1425,7 @@ def convertVmtToVmat():
                     outVal = vmtVal
 
                 if vmatTranslation.translfunc is not None:
-                    if ((rv:=vmatTranslation.translate(vmtKey, vmtVal)) is not None):
+                    if ((rv:=vmatTranslation.translate(ctx, vmtKey, vmtVal)) is not None):
                         outVal = rv
                         sh.msg(outKey, outVal)
 
@@ -1206,11 +1446,11 @@ def convertVmtToVmat():
             elif(keyType == 'textures'):
                 # Layer A
                 if vmtKey in ('$basetexture', '$hdrbasetexture', '$hdrcompressedtexture', '$normalmap'):
-                    outKey = vmat_layered_param(vmatTranslation.replacement)
+                    outKey = vmat_layered_param(vmat, vmatTranslation.replacement)
 
                 if vmtKey.startswith('$basetexture'):
                     if (sh.destmod >= sh.eS2Game.adj) and outVal != default("_color"):
-                        set_texture_settings(outVal, mip_algorithm="Nice", brightness=1.2)
+                        ctx.textures.add(TEXTURE_EDIT, sh.output(Path(outVal)), set_texture_settings, outVal, mip_algorithm="Nice", brightness=1.2)
 
                 if vmtKey in ('$normalmap', '$bumpmap2', '$normalmap2'):
                     if vmtVal == 'dev/flat_normal':
@@ -1220,7 +1460,7 @@ def convertVmtToVmat():
                     if outVal != default("_normal"):
                         # don't flip ssbump
                         if not vmt.KeyValues["$ssbump"]:
-                            flipNormalMap(Path(outVal))
+                            ctx.textures.add(TEXTURE_EDIT, sh.output(Path(outVal)), flipNormalMap, Path(outVal))
 
             elif(keyType == 'transform'):  # here one key can add multiple keys
                 if not vmatTranslation.replacement:
@@ -1282,7 +1522,7 @@ def convertVmtToVmat():
                 # both versions are provided just in case for 'non models'
                 #if not str(vmt.KeyValues['$model']).strip('"') != '0': invert
 
-                outVal =  createMask(vmt.KeyValues[sourceTexture], sourceSubString, sourceChannel, shouldInvert)
+                outVal =  createMask(ctx, vmt.KeyValues[sourceTexture], sourceSubString, sourceChannel, shouldInvert)
 
             elif keyType == 'SystemAttributes':
                 vmat.KeyValues.setdefault('SystemAttributes', {})[outKey] = outVal
@@ -1333,7 +1573,8 @@ def convertVmtToVmat():
         else:
             vmat.KeyValues.setdefault("TextureRoughness", default("_rough_s1import"))
 
-def convertSpecials():
+def convertSpecials(ctx: MaterialContext):
+    vmt, vmat = ctx.vmt, ctx.vmat
 
     # fix phongmask logic
     if vmt.KeyValues["$phong"] == 1 and not vmt.KeyValues["$phongmask"]:
@@ -1400,15 +1641,11 @@ def convertSpecials():
             vm_customization = viewmodels.parent / "customization"
             ao_path = sh.output(vm_customization/wpn_name/ (str(wpn_name) + "_ao"+ TEXTURE_FILEEXT))
             if ao_path.is_file():
-                ao_path_new = sh.output(materials/viewmodels/wpn_name/ao_path.name)
-                try:
-                    if not ao_path_new.is_file() and ao_path_new.parent.exists():
-                        copyfile(ao_path, ao_path_new)
-                        print("+ Succesfully moved AO texture for weapon material:", wpn_name)
-                    vmt.KeyValues["$aotexture"] = str(ao_path_new.local.relative_to(materials))
-                    print("+ Using ao:", ao_path.name)
-                except FileNotFoundError:
-                    failureList.add("AOfix FileNotFoundError", f"{ao_path_new.name}, {ao_path.local}")
+                ao_path_new = sh.output(viewmodels/wpn_name/ao_path.name)
+                if not ao_path_new.is_file() and ao_path_new.parent.exists():
+                    ctx.textures.add(TEXTURE_CREATE, ao_path_new, copyAO, ao_path, ao_path_new, wpn_name)
+                vmt.KeyValues["$aotexture"] = str(ao_path_new.local.relative_to(materials))
+                print("+ Using ao:", ao_path.name)
 
         #vmt.KeyValues.setdefault("$envmap", "0")  # specular looks ugly on viewmodels so disable it. does not affect scope lens
         if vmt.KeyValues["$envmap"]: del vmt.KeyValues["$envmap"]
@@ -1416,14 +1653,23 @@ def convertSpecials():
         #"$envmaplightscale"       "1"
         #"$envmaplightscaleminmax" "[0 .3]"     metalness modifier?
 
+def copyAO(ao_path: Path, ao_path_new: Path, wpn_name: str):
+    copyfile(ao_path, ao_path_new)
+    print("+ Succesfully moved AO texture for weapon material:", wpn_name)
+
+def skyFaceTextures(vmt: VMT):
+    "ldr, hdr, hdr compressed"
+    return vmt.KeyValues.get('$basetexture'), vmt.KeyValues.get('$hdrbasetexture'), vmt.KeyValues.get('$hdrcompressedtexture')
+
+def skyFacesJson(name: str) -> Path:
+    return sh.output(legacy_skyfaces/name).with_suffix(".json")
+
 def collectSkybox(name:str, face: str, vmt: VMT):
 
-    ldr_tex = vmt.KeyValues.get('$basetexture')
-    hdr_tex = vmt.KeyValues.get('$hdrbasetexture')
-    hdr_compressed_tex = vmt.KeyValues.get('$hdrcompressedtexture')
+    ldr_tex, hdr_tex, hdr_compressed_tex = skyFaceTextures(vmt)
 
     if (texture:= hdr_tex or hdr_compressed_tex or ldr_tex) is not None:
-        face_collect_path = sh.output(legacy_skyfaces/name).with_suffix(".json")
+        face_collect_path = skyFacesJson(name)
         Collect = sh.GetJson(face_collect_path, bCreate = True)
 
         # First vmt to have $hdr decides hdr-ness
@@ -1469,18 +1715,17 @@ def collectSkybox(name:str, face: str, vmt: VMT):
 
         return face_collect_path
 
-def _ImportVMTtoExtraVMAT(vmt_path: Path, shader = None, path = None):
-    global vmat, import_extra
-    old_vmat = vmat
+def _ImportVMTtoExtraVMAT(ctx: MaterialContext, vmt_path: Path, shader = None, path = None):
+    old_vmat = ctx.vmat
 
     assert path != old_vmat.path
 
-    vmat = VMAT()
+    vmat = ctx.vmat = VMAT()
     vmat.shader = shader if shader else old_vmat.shader
     vmat.path = path if path else old_vmat.path
-    rv = ImportVMTtoVMAT(vmt_path, preset_vmat = True)
+    rv = ImportVMTtoVMAT(ctx, vmt_path, preset_vmat = True)
     if rv:
-        import_extra+=1
+        ctx.extra+=1
     return rv
 
 def ImportSkyJSONtoVMAT(json_collection: Path):
@@ -1502,16 +1747,26 @@ def ImportSkyJSONtoVMAT(json_collection: Path):
 
     return vmat_path
 
-def ImportVMTtoVMAT(vmt_path: Path, preset_vmat = False):
+def _write_vmat(path: Path, text: str, masks: tuple[tuple[str, tuple[str, str]], ...] = ()):
+    # masks that turned out a single color are not where the vmat expects them
+    for predicted, key in masks:
+        if (value := g_TextureJobs.results.get(key, predicted)) != predicted:
+            text = text.replace(f'"{predicted}"', f'"{value}"')
+    with open(path, 'w') as fp:
+        fp.write(text)
+
+def ImportVMTtoVMAT(ctx: MaterialContext, vmt_path: Path, preset_vmat = False):
 
-    global vmt, vmat
     validMaterial = False
 
     try: 
-        vmt = VMT(KV.FromFile(vmt_path))  # Its actually a collection - needs CollectionFromFile
+        kv = KV.FromFile(vmt_path)  # Its actually a collection - needs CollectionFromFile
+        ctx.failures.add_kv_errors(kv)
+        vmt = ctx.vmt = VMT(kv)
         vmt.path = vmt_path
     except Exception as e:
         print("~ Failed to read VMT:", vmt_path, e)
+        return
 
     if any(wd in vmt.shader for wd in shaderDict):
         validMaterial = True
@@ -1525,11 +1780,13 @@ def ImportVMTtoVMAT(vmt_path: Path, preset_vmat = False):
             vmt.KeyValues.clear()
             print("+ Retrieving material properties from include:", includePath, end=' ... ')
             try:
-                vmt = VMT(KV.FromFile(includePath))
+                kv = KV.FromFileCached(includePath)
+                ctx.failures.add_kv_errors(kv)
+                vmt = ctx.vmt = VMT(kv)
                 vmt.path = vmt_path
             except FileNotFoundError:
                 print("Did not find.")
-                failureList.add("Include not found", f'{vmt.path.local} -- {includePath}' )
+                ctx.failures.add("Include not found", f'{vmt.path.local} -- {includePath}' )
                 return
             if not any(wd in vmt.shader for wd in shaderDict):
                 vmt.KeyValues.clear()
@@ -1547,14 +1804,20 @@ def ImportVMTtoVMAT(vmt_path: Path, preset_vmat = False):
     if vmt.path.local.is_relative_to(skyboxmaterials):
         name, face = vmt.path.stem[:-2], vmt.path.stem[-2:]
         if face in SKY_FACES:
-            return collectSkybox(name, face, vmt)
+            # the faces of a sky are collected into one json, so that is left to the main process
+            ctx.defer(collectSkybox, name, face, vmt)
+            if any(texture is not None for texture in skyFaceTextures(vmt)):
+                return skyFacesJson(name)
+            return
 
     if not validMaterial:
         return
 
-    if not preset_vmat:
-        vmat = VMAT()
-        vmat.shader = chooseShader()
+    if preset_vmat:
+        vmat = ctx.vmat
+    else:
+        vmat = ctx.vmat = VMAT()
+        vmat.shader = chooseShader(ctx)
         if SBOX:
             vmat.shader = vmat.shader.replace("vfx", "shader")
         vmat.path = OutName(vmt.path)
@@ -1567,8 +1830,8 @@ def ImportVMTtoVMAT(vmt_path: Path, preset_vmat = False):
     else:
         vmat.path.parent.MakeDir()
 
-    convertSpecials()
-    convertVmtToVmat()
+    convertSpecials(ctx)
+    convertVmtToVmat(ctx)
 
     if (not IGNORE_PROXIES) and (proxies:= vmt.KeyValues["proxies"]):
         kvalues, vmat.KeyValues['DynamicParams'] = ProxiesToDynamicParams(proxies, KNOWN, vmt.KeyValues)
@@ -1602,16 +1865,133 @@ def ImportVMTtoVMAT(vmt_path: Path, preset_vmat = False):
             vmat.KeyValues['F_FULLBRIGHT'] = 1
 
     sh.msg(vmt.shader + " => " + vmat.shader, "\n")
-    vmat.path.write_text(vmat.KeyValues.ToString())
+    ctx.defer(_write_vmat, vmat.path, vmat.KeyValues.ToString(), tuple(ctx.masks))
 
     print("+ Saved", vmat.path if sh.DEBUG else vmat.path.local.as_posix())
 
     #if vmat.shader == vr.projected_decals():
-    #    _ImportVMTtoExtraVMAT(vmt_path, shader=vr.static_overlay(),
+    #    _ImportVMTtoExtraVMAT(ctx, vmt_path, shader=vr.static_overlay(),
     #        path=(vmat.path.parent / (vmat.path.stem + '-static' + vmat.path.suffix)))
 
     return vmat.path
 
+def ConvertVMT(vmt_path: Path) -> MaterialContext:
+    ctx = MaterialContext(vmt_path)
+    ctx.result = ImportVMTtoVMAT(ctx, vmt_path)
+    return ctx
+
+def FinishVMT(ctx: MaterialContext):
+    "Main process side of a converted material: print its log, queue its textures and jobs and add up its stats"
+    global import_extra
+    if ctx.log:
+        print(ctx.log, end='')
+    g_TextureJobs.merge(ctx.textures)
+    deferredJobs.extend(ctx.jobs)
+    failureList.merge(ctx.failures)
+    import_extra += ctx.extra
+    _AddCacheCounters(ctx.cache_counters)
+    return ctx.result
+
+def WorkerPool():
+    "Processes to convert materials and write textures in, or None to do it all in this one"
+    if MAX_WORKERS <= 1:
+        return nullcontext()
+    return ProcessPoolExecutor(MAX_WORKERS, initializer=_InitWorker, initargs=(_WorkerState(),))
+
+def ConvertVMTs(vmt_paths, pool: ProcessPoolExecutor = None) -> Iterator[MaterialContext]:
+    "Converted materials in the order of `vmt_paths`, converted in `pool`"
+    if pool is None:
+        return map(ConvertVMT, vmt_paths)
+    return pool.map(_ConvertVMTInWorker, vmt_paths, chunksize=8)
+
+def RunTextureJobs(jobs: list[tuple]) -> tuple[list[tuple], Failures]:
+    "Run the jobs of one group in order. Returns their (key, result) and what failed"
+    results, failures = [], Failures()
+    for key, func, args, kwargs in jobs:
+        try:
+            results.append((key, func(*args, **kwargs)))
+        except TextureJobFailed as failed:
+            results.append((key, failed.result))
+            failures.add(failed.error, failed.file)
+        except OSError as error:
+            print(f"~ ERROR: {func.__name__} couldn't write {key[0]}: {error}")
+            failures.add(f"{func.__name__} {type(error).__name__}", key[0])
+    return results, failures
+
+def WriteTextures(pool: ProcessPoolExecutor = None):
+    "Run the queued texture jobs in `pool`, stage by stage, and keep their results"
+    for groups in g_TextureJobs.stages():
+        if pool is None:
+            done = ((*RunTextureJobs(jobs), None, None) for jobs in groups)
+        else:
+            done = pool.map(_RunTextureJobsInWorker, groups, chunksize=4)
+        for results, failures, log, cache_counters in done:
+            if log:
+                print(log, end='')
+            g_TextureJobs.results.update(results)
+            failureList.merge(failures)
+            _AddCacheCounters(cache_counters)
+
+# cache counters that workers report back, to show in the summary of the main process
+_CACHE_COUNTERS = (
+    (g_KVFileCache, ("hits", "misses", "evictions")),
+    (g_KVDiskCache, ("hits", "misses", "writes", "bytes_saved", "time_saved")),
+    (g_ImageCache, ("hits", "misses", "evictions", "time_saved")),
+)
+
+def _WorkerState() -> dict:
+    "What a worker needs to convert materials like the main process would"
+    return {
+        'src': sh.IMPORT_GAME,
+        'game': sh.EXPORT_GAME,
+        'destmod': sh.destmod,
+        'import_context': dict(sh.import_context),
+        'kvcache': g_KVDiskCache.m_Path,
+        'DEBUG': sh.DEBUG,
+        'MOCK': sh.MOCK,
+        'options': {k: v for k, v in globals().items() if k.isupper() and isinstance(v, (bool, int, float, str, Path))},
+    }
+
+def _InitWorker(state: dict):
+    # Spawned workers start from a fresh import of this module, so set up the paths and options again.
+    sh.args_known.src1gameinfodir = str(state['src'])
+    sh.args_known.kvcache = "bypass"  # the main process has cleared it already if asked to
+    sh.parse_in_path()
+    sh.parse_out_path(state['game'])
+    sh.update_destmod(state['destmod'])
+    sh.import_context.update(state['import_context'])
+    g_KVDiskCache.SetDirectory(state['kvcache'])
+    sh.importing = materials
+    sh.DEBUG, sh.MOCK = state['DEBUG'], state['MOCK']
+    globals().update(state['options'])
+    update_conditionals()
+    g_ImageCache.max_bytes = IMAGE_CACHE_MIB * 1024 * 1024
+
+def _AddCacheCounters(cache_counters: list | None):
+    if not cache_counters:
+        return
+    for (cache, names), counts in zip(_CACHE_COUNTERS, cache_counters):
+        for name, count in zip(names, counts):
+            setattr(cache, name, getattr(cache, name) + count)
+
+def _InWorker(func: Callable, *args):
+    "``func(*args)``, with what it printed and how it changed the cache counters of this worker"
+    counters = lambda: [[getattr(cache, name) for name in names] for cache, names in _CACHE_COUNTERS]
+    before = counters()
+    with redirect_stdout(io.StringIO()) as log:
+        result = func(*args)
+    return result, log.getvalue(), [[b - a for a, b in zip(*pair)] for pair in zip(before, counters())]
+
+def _ConvertVMTInWorker(vmt_path: Path) -> MaterialContext:
+    ctx, ctx.log, ctx.cache_counters = _InWorker(ConvertVMT, vmt_path)
+    # the results are what goes back to the main process
+    ctx.vmt = ctx.vmat = None
+    return ctx
+
+def _RunTextureJobsInWorker(jobs: list[tuple]):
+    (results, failures), log, cache_counters = _InWorker(RunTextureJobs, jobs)
+    return results, failures, log, cache_counters
+
 if __name__ == "__main__":
-    sh.parse_argv()
+    sh.parse_argv(globals())
     main()
@@ -97,7 +97,7 @@ def ImportMDLtoVMDL(mdl_path: Path):
     vmdl = KV3File(
         m_sMDLFilename = ("../"*SAMPBOX) + mdl_path.local.as_posix()
     )
-    vmdl_path.write_text(vmdl.ToString())
+    vmdl.save(vmdl_path)
     print('+ Generated', vmdl_path.local)
     return vmdl_path
 
@@ -615,13 +615,13 @@ def ImportQCtoVMDL(qc_path: Path):
             )
             vmdl_prefab.add_to_appropriate_list(animfile)
 
-        out_vmdl_prefab_path.write_text(vmdl_prefab.ToString())
+        vmdl_prefab.save(out_vmdl_prefab_path)
         print('+ Saved prefab', out_vmdl_prefab_path.local)
 
     if len(skeleton.children):
         vmdl.root.add_nodes(skeleton)
         
-    out_vmdl_path.write_text(vmdl.ToString())
+    vmdl.save(out_vmdl_path)
     print('+ Saved', out_vmdl_path.local)
 
 
@@ -640,6 +640,10 @@ class ModelDocVMDL(KV3File):
         self["rootNode"] = asdict(self.root)
         return super().__str__()
 
+    def write(self, fp, compact: bool = False):
+        self["rootNode"] = asdict(self.root)
+        super().write(fp, compact)
+
     def add_to_appropriate_list(self, node: _Node):
         """
         Adds bodygroup to bodygrouplist, animfile to animationlist, etc. Only makes one list.
@@ -1,8 +1,11 @@
 import shared.base_utils2 as sh
 import shared.datamodel as dmx
 import shared.keyvalues3 as kv3
+from shared.keyvalues1 import KV, VDFDict, KeyValuesError, g_KVFileCache, g_KVDiskCache
 from dataclasses import dataclass
 from pathlib import Path
+from os import replace, getpid, stat
+import json
 
 # https://developer.valvesoftware.com/wiki/Particle_System_Overview
 # https://developer.valvesoftware.com/wiki/Animated_Particles
@@ -17,12 +20,23 @@ BEHAVIOR_VERSION = 8
 
 def main():
     print("Importing Particles!")
+    if g_KVDiskCache.m_Path is not None:
+        pcf_catalog.open(g_KVDiskCache.m_Path / "pcf_catalog.json")
     for pcf_path in sh.globsort((sh.IMPORT_GAME/particles).glob('**/*.pcf')):
         ImportPCFtoVPCF(pcf_path, OVERWRITE_PARTICLES)
+    pcf_catalog.save()
+    sh.RemapTable.save()
+    print("PCF catalog:", pcf_catalog)
 
     for psf_path in sh.collect(particles, '.pcf', '.vsnap', OVERWRITE_VSNAPS):
         ImportParticleSnapshotFile(psf_path)
 
+    if kv_errors:
+        print("\nKeyValues errors in materials:")
+        for error in sorted(kv_errors):
+            print('\t' + error.Where(), error.message.strip())
+    print("VMT cache:", g_KVFileCache)
+    print("Disk cache:", g_KVDiskCache)
     print("Looks like we are done!")
 
 class dynamicparam(str): pass
@@ -1660,6 +1674,19 @@ for key, value in (alternate_names2:= {
         if cls == value:
             pcf_to_vpcf['initializers'][1].setdefault(key, (value, sub))
 
+def _ci_table(table: dict) -> VDFDict:
+    "class and key tables as VDFDict, for `get_for_case_insensitive_key`"
+    rv = VDFDict()
+    for key, value in table.items():
+        if type(value) is tuple and len(value) == 2 and isinstance(value[1], dict):
+            value = value[0], _ci_table(value[1])
+        rv.add(key, value)
+    return rv
+
+for key, value in pcf_to_vpcf.items():
+    if isinstance(value, tuple) and isinstance(value[1], dict):
+        pcf_to_vpcf[key] = value[0], _ci_table(value[1])
+
 # out of scale textures on fountain rings...
 # is this same as hammer texture scale issue
 # vtf scaling -> m_flConstantRadius
@@ -1785,12 +1812,9 @@ def is_valid_pcf(x: dmx.DataModel):
     return ('particleSystemDefinitions' in x.elements[0].keys() and
             'DmeParticleSystemDefinition' == x.elements[1].type)
 
-def get_for_case_insensitive_key(oldkey, oldval, table):
-    oldkey = oldkey.lower()
-    for k, vpcf_k in table.items():
-        k = k.lower()
-        if k == oldkey:
-            return vpcf_k, oldval
+def get_for_case_insensitive_key(oldkey, oldval, table: VDFDict):
+    if table.contains_ci(oldkey):
+        return table.get_ci(oldkey), oldval
     return None
 
 def guess_key_name(key, value):
@@ -1821,6 +1845,7 @@ def guess_class_name(cls: str, _type):
     return guess
 
 materials = set()
+kv_errors: set[KeyValuesError] = set()
 children = []
 vsnaps = {}
 fallbacks = []
@@ -1833,7 +1858,9 @@ def process_material(value: str):
     vmat_path = vmt_path.local.with_suffix('.vmat')
     vpcf._base_t['m_Renderers']['m_hMaterial'] = kv3.resource(vmat_path)
     try:
-        vmt = VMT(KV.FromFile(vmt_path))
+        kv = KV.FromFileCached(vmt_path)
+        kv_errors.update(kv.parseErrors)
+        vmt = VMT(kv)
     except FileNotFoundError:
         materials.add(value)
     else:
@@ -1883,7 +1910,6 @@ def process_material(value: str):
 
 
 from materials_import import VMT
-from shared.keyvalues1 import KV
 def pcfkv_convert(key, value):
 
     vpcf_translation = pcf_to_vpcf.get(key)
@@ -2100,18 +2126,92 @@ def ImportPSD(ParticleSystemDefinition: dmx.Element, out_root: Path, bOverwrite
         vpcf.setdefault('m_PreEmissionOperators', list())
         vpcf['m_PreEmissionOperators'].append(operator)
 
-    vpcf.path.write_text(vpcf.ToString())
+    vpcf.save(vpcf.path)
 
     print("+ Saved", vpcf.path.local.as_posix())
 
     return vpcf.path
 
+class PCFCatalog:
+    """
+    The particle systems each `.pcf` held when it was last imported, and the `.vpcf` files they went to.
+    Kept on disk between runs, so a pack whose size and mtime are unchanged and whose outputs all exist
+    is skipped without being loaded. Off until `open`.
+    """
+    VERSION = 1
+
+    def __init__(self):
+        self.path: Path = None
+        self.entries: dict[str, dict] = {}
+        self.hits = self.misses = 0
+        self.dirty = False
+
+    def open(self, path: Path):
+        self.path = path
+        self.entries = {}
+        stored = sh.GetJson(path)
+        if stored.get('version') == self.VERSION:
+            self.entries = stored.get('pcfs', {})
+
+    @staticmethod
+    def signature(pcf_path: Path) -> list:
+        st = stat(pcf_path)
+        return [st.st_size, st.st_mtime_ns]
+
+    def lookup(self, pcf_path: Path):
+        "[(system name, vpcf path)] if the pack is unchanged and every vpcf exists, else None"
+        if self.path is None:
+            return None
+        entry = self.entries.get(str(pcf_path.resolve()))
+        if entry is not None and entry['signature'] == self.signature(pcf_path):
+            systems = [(name, Path(vpcf_path)) for name, vpcf_path in entry['systems']]
+            if all(vpcf_path.is_file() for _, vpcf_path in systems):
+                self.hits += 1
+                return systems
+        self.misses += 1
+        return None
+
+    def store(self, pcf_path: Path, systems: list):
+        if self.path is None:
+            return
+        self.entries[str(pcf_path.resolve())] = {
+            'signature': self.signature(pcf_path),
+            'systems': [(name, str(vpcf_path)) for name, vpcf_path in systems],
+        }
+        self.dirty = True
+
+    def save(self):
+        if self.path is None or not self.dirty:
+            return
+        # through a temp file, so that an interrupted run leaves the old catalog
+        self.path.parent.MakeDir()
+        tmp_path = self.path.with_name(f"{self.path.name}.{getpid()}.tmp")
+        with open(tmp_path, 'w') as fp:
+            json.dump({'version': self.VERSION, 'pcfs': self.entries}, fp)
+        replace(tmp_path, self.path)
+        self.dirty = False
+
+    def __str__(self):
+        if self.path is None:
+            return "off"
+        return f"{self.hits} packs skipped | {self.misses} loaded | {len(self.entries)} known"
+
+pcf_catalog = PCFCatalog()
+
 def ImportPCFtoVPCF(pcf_path: Path, bOverwrite=True):
     "Import `.PCF` particle package into a folder w/ multiple separated `.VPCF` particles"
 
+    if not bOverwrite and (systems := pcf_catalog.lookup(pcf_path)) is not None:
+        for name, vpcf_path in systems:
+            sh.RemapTable.remap('vpcf', name, vpcf_path.local.as_posix())
+            imports.append(vpcf_path.local.as_posix())
+        sh.skip('already-exist', pcf_path)
+        return set(vpcf_path for _, vpcf_path in systems)
+
     sh.status(f'- Reading from pack {pcf_path.local}')
     try:
-        pcf = dmx.load(pcf_path)
+        # only the definitions and what they reference; the root is decoded for is_valid_pcf
+        pcf = dmx.load(pcf_path, element_types=['DmeParticleSystemDefinition'])
     except Exception as e:
         print("Couldn't open PCF.", e)
         return
@@ -2122,17 +2222,19 @@ def ImportPCFtoVPCF(pcf_path: Path, bOverwrite=True):
 
     out_root = sh.output(pcf_path.with_suffix(""))
     out_root.MakeDir()
-    rv =  set((
+    systems = [(
+            ParticleSystemDefinition.name,
             ImportPSD(
                 ParticleSystemDefinition,
                 out_root,
                 bOverwrite
-            )
+            ))
         for ParticleSystemDefinition in pcf.find_elements(elemtype='DmeParticleSystemDefinition')
-    ))
+    ]
+    pcf_catalog.store(pcf_path, systems)
     
     sh.RemapTable.save()  # RebuildParticleNameRemapTable
-    return rv
+    return set(vpcf_path for _, vpcf_path in systems)
 
 if __name__ == '__main__':
     sh.parse_argv()
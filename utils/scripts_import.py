@@ -1,7 +1,7 @@
 import shared.base_utils2 as sh
 from shutil import copyfile
 from pathlib import Path
-from shared.keyvalues1 import KV, VDFDict
+from shared.keyvalues1 import KV, VDFDict, g_KVDiskCache
 from shared.keyvalues3 import KV3File
 import itertools
 
@@ -104,6 +104,7 @@ def main():
 
 
 
+    print("Disk cache:", g_KVDiskCache)
     print("Looks like we are done!")
 
 def fix_wave_resource(old_value):
@@ -130,17 +131,16 @@ class SoundscapeImporter:
 
     @staticmethod
     def ImportSoundscapes(file: Path):
-        new_soundscapes = ''
-        for name, properties in SoundscapeImporter.FixedUp(file).items():
-            if isinstance(properties, VDFDict):
-                new_soundscapes += f"{name}{properties.ToString()}"
-            else:
-                new_soundscapes += f'{name}\t"{properties}"\n'
-            continue
-
+        soundscapes = SoundscapeImporter.FixedUp(file)
         newsc_path = sh.output(file, '.txt')
         newsc_path.parent.MakeDir()
-        newsc_path.write_text(new_soundscapes)
+        with open(newsc_path, 'w') as fp:
+            for name, properties in soundscapes.iteritems():
+                if isinstance(properties, VDFDict):
+                    fp.write(f"{name}\n")
+                    fp.writelines(properties.iter_lines())
+                else:
+                    fp.write(f'{name}\t"{properties}"\n')
         print("+ Saved", newsc_path.local)
         return newsc_path
         #soundscapes_manifest.add("file", f'scripts/{newsc_path.name}')
@@ -379,7 +379,7 @@ def ImportGameSounds(asset_path: Path):
             out_kv[out_k] = out_v
 
         if sh.SBOX:
-            sound_file.write_text(KV3File(data=sound_data).ToString())
+            KV3File(data=sound_data).save(sound_file)
             print("+ Saved", sound_file.local)
         else:
             if out_kv == dict(type='src1_3d'):  # empty
@@ -396,7 +396,7 @@ def ImportGameSounds(asset_path: Path):
     if sh.SBOX:
         return out_sound_folder
     else:
-        vsndevts_file.write_text(kv3.ToString())
+        kv3.save(vsndevts_file)
 
         print("+ Saved", vsndevts_file.local)
         return vsndevts_file
@@ -408,13 +408,6 @@ vsurf_base_params = {
     'audioparams': ('audioreflectivity','audiohardnessfactor','audioroughnessfactor','scrapeRoughThreshold','impactHardThreshold',),
 }
 
-class CaseInsensitiveKey(str):
-    def __hash__(self): return hash(self.lower())
-    def __eq__(self, other: str): return self.lower() == other.lower()
-class CaseInsensitiveDict(dict):
-    def __setitem__(self, key, value): super().__setitem__(CaseInsensitiveKey(key), value)
-    def __getitem__(self, key): return super().__getitem__(CaseInsensitiveKey(key))
-
 def ImportSurfaceProperties(asset_path: Path):
     """
     VALVE: scripts/surfaceproperties*.txt -> surfaceproperties/surfaceproperties*.vsurf
@@ -442,30 +435,32 @@ def ImportSurfaceProperties(asset_path: Path):
             sh.status(f"Skipping {surface_file.local} [already-exist]")
             continue
         # Sbox
-        surface_data = CaseInsensitiveDict({
-            CaseInsensitiveKey("Friction"): 0.5,
-            CaseInsensitiveKey("Elasticity"): 0.5,
-            CaseInsensitiveKey("Density"): 0.5,
-            CaseInsensitiveKey("Thickness"): 0.5,
-            CaseInsensitiveKey("Dampening"): 0.0,
-            CaseInsensitiveKey("BounceThreshold"): 0.0,
-            CaseInsensitiveKey("ImpactEffects"): CaseInsensitiveDict({
-                CaseInsensitiveKey("Bullet"): [],
-                CaseInsensitiveKey("BulletDecal"): [],
-                CaseInsensitiveKey("Regular"): [],
-            }),
-            CaseInsensitiveKey("Sounds"): CaseInsensitiveDict({
-                CaseInsensitiveKey("ImpactSoft"): "",
-                CaseInsensitiveKey("ImpactHard"): "",
-                CaseInsensitiveKey("RoughScrape"): "",
-                CaseInsensitiveKey("FootLeft"): "",
-                CaseInsensitiveKey("FootRight"): "",
-                CaseInsensitiveKey("FootLaunch"): "",
-                CaseInsensitiveKey("FootLand"): "",
-        }),
-            CaseInsensitiveKey("basesurface"): "surfaces/default.surface",
-            CaseInsensitiveKey("description"): "",
+        surface_data = VDFDict({
+            "Friction": 0.5,
+            "Elasticity": 0.5,
+            "Density": 0.5,
+            "Thickness": 0.5,
+            "Dampening": 0.0,
+            "BounceThreshold": 0.0,
+            "ImpactEffects": None,
+            "Sounds": {
+                "ImpactSoft": "",
+                "ImpactHard": "",
+                "RoughScrape": "",
+                "FootLeft": "",
+                "FootRight": "",
+                "FootLaunch": "",
+                "FootLand": "",
+            },
+            "basesurface": "surfaces/default.surface",
+            "description": "",
         })
+        # set, not added, so the empty lists don't become VDFDicts
+        surface_data["ImpactEffects"] = {
+            "Bullet": [],
+            "BulletDecal": [],
+            "Regular": [],
+        }
         for key, value in properties.items():
             # Valve
             context = next((ctx for ctx, group in vsurf_base_params.items() if key in group), None)
@@ -478,12 +473,12 @@ def ImportSurfaceProperties(asset_path: Path):
 
             # SBOX
             key = {'stepleft':'footleft','stepright':'footright','base':'basesurface'}.get(key, key)
-            if key in surface_data: # needs to be a counterpart
+            if surface_data.contains_ci(key): # needs to be a counterpart
                 if key == "basesurface":
                     value = f"{surface_folder.relative_to(sh.EXPORT_CONTENT).as_posix()}/{value}.surface"
-                surface_data[key] = value
-            elif key in surface_data["Sounds"]:
-                surface_data["Sounds"][key] = value
+                surface_data.set_ci(key, value)
+            elif surface_data["Sounds"].contains_ci(key):
+                surface_data["Sounds"].set_ci(key, value)
 
         if sh.SBOX:
             surface_file.write_text(KV3File(data=surface_data).ToString())
@@ -2,14 +2,11 @@
 
 import sys, re, numpy as np
 
-def read_pfm(file):
+def _read_header(file):
     '''
-    Read a PFM file into a Numpy array. Note that it will have
-    a shape of H x W, not W x H. Returns a tuple containing the
-    loaded image and the scale factor from the file.
+    Read the header of an open PFM file, leaving it at the start of the data.
+    Returns whether it has color, (width, height), the scale factor and the byte order of the data.
     '''
-    file = open(file, 'rb')
-
     color = None
     width = None
     height = None
@@ -37,10 +34,52 @@ def read_pfm(file):
     else:
         endian = '>'  # big-endian
 
+    return color, (width, height), scale, endian
+
+def read_pfm(file):
+    '''
+    Read a PFM file into a Numpy array. Note that it will have
+    a shape of H x W, not W x H. Returns a tuple containing the
+    loaded image and the scale factor from the file.
+    '''
+    file = open(file, 'rb')
+
+    color, (width, height), scale, endian = _read_header(file)
+
     data = np.fromfile(file, endian + 'f')
     shape = (height, width, 3) if color else (height, width)
     return np.reshape(data, shape), scale, (width, height)
 
+def read_pfm_size(file):
+    '''
+    Read only the header of a PFM file. Returns (width, height).
+    '''
+    with open(file, 'rb') as f:
+        return _read_header(f)[1]
+
+def map_pfm(file):
+    '''
+    Map a PFM file to a read-only Numpy array of H x W (x 3),
+    so that only the parts that are used get read.
+    '''
+    with open(file, 'rb') as f:
+        color, (width, height), _, endian = _read_header(f)
+        offset = f.tell()
+    shape = (height, width, 3) if color else (height, width)
+    return np.memmap(file, endian + 'f', 'r', offset, shape)
+
+def create_pfm(file, width, height, color=True):
+    '''
+    Create a PFM file of zeros and map it to a writable little-endian float32 Numpy array of H x W (x 3),
+    to fill in part by part without holding the whole image in memory.
+    '''
+    header = b'%s\n%d %d\n%f\n' % (b'PF' if color else b'Pf', width, height, -1.0)
+    shape = (height, width, 3) if color else (height, width)
+    with open(file, 'wb') as f:
+        f.write(header)
+        f.truncate(len(header) + 4 * int(np.prod(shape)))
+    return np.memmap(file, '<f4', 'r+', len(header), shape)
+
 def write_pfm(file, image, scale=1):
     '''
     Write a Numpy array to a PFM file.
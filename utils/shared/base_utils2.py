@@ -7,9 +7,9 @@ import subprocess
 from types import GeneratorType
 from typing import Any, Callable, Iterable, Optional
 try:
-    from keyvalues1 import KV
+    from keyvalues1 import KV, g_KVDiskCache
 except ImportError:
-    from shared.keyvalues1 import KV
+    from shared.keyvalues1 import KV, g_KVDiskCache
 
 import argparse
 arg_parser = argparse.ArgumentParser(usage = "-i <s1gameinfodir> -e <s2 mod>")
@@ -17,6 +17,8 @@ arg_parser.add_argument("-i", "--src1gameinfodir", "-src1gameinfodir", help="An
 arg_parser.add_argument("-e", "-o", "--game", "-game", help="Name or full path to the S2 mod/addon to import into (ie. left4dead2_source2 or C:/../ep2).")
 arg_parser.add_argument("-b", "--branch", type=str, help="The engine branch belonging to this mod/addon (ie. hlvr or steamvr).")
 arg_parser.add_argument("--filter", help="Apply a substring filter to the import filelist")
+arg_parser.add_argument("--kvcache", choices=("use", "bypass", "clear"), default="use",
+    help="Parsed KeyValues files are cached in <s2 mod content>/.source1import_cache. 'bypass' ignores the cache, 'clear' empties it first.")
 
 args_known, args_unknown = arg_parser.parse_known_args()
 
@@ -261,6 +263,11 @@ def parse_out_path(source2_mod: Path):
     }
     RemapTable = KVUtilFile.RemapTable()
 
+    if args_known.kvcache != "bypass":
+        g_KVDiskCache.SetDirectory(EXPORT_CONTENT / ".source1import_cache")
+        if args_known.kvcache == "clear":
+            g_KVDiskCache.Clear()
+
     _mod = lambda: import_context['mod']
     _recurse = lambda: import_context['recurse']
     _dest = lambda: import_context['dest']
@@ -2,60 +2,90 @@
 # A keyvalues.cpp python rewrite
 
 import collections
+import re
+from typing import NamedTuple, Optional
 
 #from ctypes import *
 NULL = 0
 
 MAX_ERROR_STACK = 64
+MAX_ERROR_RECORDS = 64
 INVALID_KEY_SYMBOL = -1
+
+class KeyValuesError(NamedTuple):
+    "An error reported while parsing, with where it happened"
+    file: Optional[str]
+    line: int
+    column: int
+    keyPath: tuple  # names of the blocks the error is in, outermost first
+    message: str
+
+    def Where(self) -> str:
+        return f"{self.file}:{self.line}:{self.column}" + (f" ({'/'.join(self.keyPath)})" if self.keyPath else "")
+
+    def __str__(self):
+        return f"KeyValues Error: {self.message.strip()} in file {self.Where()}"
+
 class CKeyValuesErrorStack():
-    errorStack = []
-    FileName = "NULL"
-    errorIndex = 0
-    maxErrorIndex = 0
-    EncounteredErrors = False
+    """
+    Error context of a single parse, owned by its token reader.
+    The key stack has a fixed size, keys nested deeper than MAX_ERROR_STACK are counted but not kept.
+    At most MAX_ERROR_RECORDS errors are kept, the rest are only counted.
+    """
+    def __init__(self, filename = None, bPrint = True):
+        self.FileName = filename
+        self.errorStack = [INVALID_KEY_SYMBOL] * MAX_ERROR_STACK
+        self.errorIndex = 0
+        self.maxErrorIndex = 0
+        self.errors: list[KeyValuesError] = []
+        self.nDroppedErrors = 0
+        self.bPrint = bPrint
 
-    stackLevel = 0
+    @property
+    def EncounteredErrors(self) -> bool:
+        return bool(self.errors)
 
     def SetFilename(self, filename):
-        self.FileName = filename
+        self.FileName = None if filename is None else str(filename)
         self.maxErrorIndex = 0
 
     def Push(self, symName):
         if self.errorIndex < MAX_ERROR_STACK:
-            self.errorStack.insert(self.errorIndex, symName)
+            self.errorStack[self.errorIndex] = symName
         self.errorIndex += 1
         self.maxErrorIndex = max(self.maxErrorIndex, self.errorIndex-1)
         return self.errorIndex-1
     def Pop(self):
         self.errorIndex -=1
         assert self.errorIndex >= 0
-    def Reset(self, symName: int):
-        assert self.stackLevel >= 0 and self.stackLevel < self.errorIndex
-        if self.stackLevel < MAX_ERROR_STACK:
-            self.errorStack[self.stackLevel] = symName
+    def Reset(self, stackLevel: int, symName):
+        assert stackLevel >= 0 and stackLevel < self.errorIndex
+        if stackLevel < MAX_ERROR_STACK:
+            self.errorStack[stackLevel] = symName
+
+    def KeyPath(self) -> tuple:
+        return tuple(self.errorStack[:min(self.errorIndex, MAX_ERROR_STACK)])
+
     # Hit an error, report it and the parsing stack for context
-    def ReportError(self, Error):
-        pv = "KeyValues Error: %s in file %s\n" % (Error, self.FileName)
-        for i in range(self.maxErrorIndex):
-            if ( i < MAX_ERROR_STACK and self.errorStack[i] != INVALID_KEY_SYMBOL ):
-                if ( i < self.errorIndex ):
-                    pv += "%s, "
-                else:
-                    pv += "(*%s*), "
-        pv += "\n"
-        print(pv, end='')
-        self.EncounteredErrors = True
-g_KeyValuesErrorStack = CKeyValuesErrorStack()
+    def ReportError(self, Error, line = 0, column = 0):
+        if len(self.errors) >= MAX_ERROR_RECORDS:
+            self.nDroppedErrors += 1
+            return
+        error = KeyValuesError(self.FileName, line, column, self.KeyPath(), Error)
+        self.errors.append(error)
+        if self.bPrint:
+            print(error)
 
 class CKeyErrorContext:
     stackLevel = 0
-    def __init__(self, symName: int):
-        self.stackLevel = g_KeyValuesErrorStack.Push(symName)
-    def Reset(self, symName: int):
-        g_KeyValuesErrorStack.Reset(self.stackLevel, symName)
+    def __init__(self, errorStack: CKeyValuesErrorStack, symName):
+        self.errorStack = errorStack
+        self.stackLevel = errorStack.Push(symName)
+    def Reset(self, symName):
+        self.errorStack.Reset(self.stackLevel, symName)
     def GetStackLevel(self):
         return self.stackLevel
+
 class Conv:
     def GetDelimiter(self):
         return '"'
@@ -133,12 +163,22 @@ class NullToken(NullObj): # str
         self.wasConditional = wasConditional
 
 class CKeyValuesTokenReader:
-    def __init__(self, buf: CUtlBuffer) -> None:
+    def __init__(self, buf: CUtlBuffer, errorStack: CKeyValuesErrorStack = None) -> None:
         self.m_Buffer: CUtlBuffer = buf
+        self.m_sOriginal: str = str(buf) if buf else ""
         self.m_nTokensRead: int = 0
+        self.m_ErrorStack = CKeyValuesErrorStack() if errorStack is None else errorStack
 
         self.lastToken = Token()
 
+    def GetLocation(self) -> "tuple[int, int]":
+        "1-based line and column of the read position"
+        pos = len(self.m_sOriginal) - (len(self.m_Buffer) if self.m_Buffer else 0)
+        return self.m_sOriginal.count('\n', 0, pos) + 1, pos - self.m_sOriginal.rfind('\n', 0, pos)
+
+    def ReportError(self, Error):
+        self.m_ErrorStack.ReportError(Error, *self.GetLocation())
+
     def ReadToken(self):
         nullToken = NullToken(self.lastToken.wasQuoted, self.lastToken.wasConditional) #
         token = Token()
@@ -196,7 +236,7 @@ class CKeyValuesTokenReader:
                 nCount+=1
             elif(not bReportedError):
                 bReportedError = True
-                g_KeyValuesErrorStack.ReportError(" ReadToken overflow")
+                self.ReportError(" ReadToken overflow")
 
         if not token.data:
             token.data = 0
@@ -208,6 +248,89 @@ class CKeyValuesTokenReader:
     def SeekBackOneToken(self): # and return it
         return self.lastToken
 
+    def IsValid(self) -> bool:
+        return self.m_Buffer.IsValid()
+
+# whitespace and // comments, an unterminated comment runs until EOF
+_re_skip = re.compile(r'(?:\s+|//[^\n]*\n?)*')
+_re_quoted = re.compile(r'"([^"]*)"?')
+# break on whitespace or a control character. whitespace is allowed inside [$conditional] brackets
+_re_unquoted = re.compile(r'(?:[^\s"{}=\[]|\[[^"{}=\]]*\]?)+')
+
+class CKeyValuesTokenCursor:
+    """
+    Linear time drop-in for `CKeyValuesTokenReader`.
+    Keeps an offset into one immutable string instead of cutting the buffer on every token.
+    """
+    def __init__(self, buf: str, errorStack: CKeyValuesErrorStack = None) -> None:
+        self.m_Buffer: str = str(buf)
+        self.m_nPos: int = 0
+        self.m_nTokensRead: int = 0
+        self.wasConditional = False
+        self.m_ErrorStack = CKeyValuesErrorStack() if errorStack is None else errorStack
+
+        self.lastToken = Token()
+
+    def GetLocation(self) -> "tuple[int, int]":
+        "1-based line and column of the read position"
+        buf, pos = self.m_Buffer, self.m_nPos
+        return buf.count('\n', 0, pos) + 1, pos - buf.rfind('\n', 0, pos)
+
+    def ReportError(self, Error):
+        self.m_ErrorStack.ReportError(Error, *self.GetLocation())
+
+    def ReadToken(self):
+        nullToken = NullToken(self.lastToken.wasQuoted, self.lastToken.wasConditional)
+        data, wasQuoted = self.NextToken()
+        if data is None:
+            self.lastToken = Token()
+            return nullToken
+
+        token = Token(data)
+        token.wasQuoted = wasQuoted
+        self.lastToken = token
+        return token
+
+    def NextToken(self) -> "tuple[Optional[str], bool]":
+        "Like `ReadToken` but returns a plain `(str, wasQuoted)` tuple. `(None, False)` on EOF"
+        buf = self.m_Buffer
+        pos = self.m_nPos = _re_skip.match(buf, self.m_nPos).end()
+        if pos >= len(buf):
+            return None, False
+
+        c = buf[pos]
+
+        # read quoted strings specially
+        if c == '"':
+            m = _re_quoted.match(buf, pos)
+            self.m_nTokensRead += 1
+            self.m_nPos = m.end()
+            return m.group(1)[:KEYVALUES_TOKEN_SIZE], True
+
+        if c == '{' or c == '}' or c == '=':
+            self.m_nTokensRead += 1
+            self.m_nPos = pos + 1
+            return c, False
+
+        # read in the token until we hit a whitespace or a control character
+        m = _re_unquoted.match(buf, pos)
+        data = m.group()
+        if '[' in data and ']' in data[data.index('['):]:
+            self.wasConditional = True
+        if len(data) > (KEYVALUES_TOKEN_SIZE-1):
+            self.ReportError(" ReadToken overflow")
+            data = data[:KEYVALUES_TOKEN_SIZE-1]
+
+        self.m_nTokensRead += 1
+        self.m_nPos = m.end()
+        return data, False
+
+    def SeekBackOneToken(self): # and return it
+        return self.lastToken
+
+    def IsValid(self) -> bool:
+        return self.m_nPos < len(self.m_Buffer)
+
 from enum import IntEnum, Enum
 from typing import Generator, Optional, Sequence, Union, Iterable, TypedDict
 try:
@@ -423,21 +546,22 @@ class KeyValues:
          with open(resourceName, 'r') as f:
             self.RecursiveLoadFromBuffer(resourceName, CKeyValuesTokenReader(CUtlBuffer(f.read())), True)
 
-    def LoadFromBuffer(self, resourceName, buf: CUtlBuffer, **params) -> bool:
+    def LoadFromBuffer(self, resourceName, buf: CUtlBuffer, tokenReader = None, **params) -> bool:
         previousKey: KeyValues = None
         currentKey: KeyValues = self
         includedKeys: "list[KeyValues]" = []
         baseKeys: "list[KeyValues]" = []
         #wasQuoted: bool
         #wasConditional: bool
-        tokenReader = CKeyValuesTokenReader(buf) # (self, buf)
+        if tokenReader is None:
+            tokenReader = CKeyValuesTokenReader(buf) # (self, buf)
         #print(tokenReader, tokenReader.__dict__)
 
-        g_KeyValuesErrorStack.SetFilename( resourceName )
+        tokenReader.m_ErrorStack.SetFilename( resourceName )
         while True: # do while
             # the first thing must be a key
             s = tokenReader.ReadToken()
-            if not buf.IsValid() or s == 0:
+            if not tokenReader.IsValid() or s == 0:
                 break
 
             if not s.wasQuoted and not s:
@@ -451,7 +575,7 @@ class KeyValues:
                 # Name of subfile to load is now in s
 
                 if not s:
-                    g_KeyValuesErrorStack.ReportError(f"{macro} is NULL.")
+                    tokenReader.ReportError(f"{macro} is NULL.")
                 else:
                     ...
                     #ParseIncludedKeys(resourceName, s, "baseKeys if #base else includedKeys") #TODO
@@ -477,27 +601,29 @@ class KeyValues:
                 # header is valid so load the file
                 currentKey.RecursiveLoadFromBuffer(resourceName, tokenReader)
             else:
-                g_KeyValuesErrorStack.ReportError("LoadFromBuffer: missing {")
+                tokenReader.ReportError("LoadFromBuffer: missing {")
 
             if False:
                 if previousKey:
                     previousKey.SetNextKey(None)
 
-            if not buf.IsValid():
+            if not tokenReader.IsValid():
                 break
 
     def RecursiveLoadFromBuffer(self, resourceName, tokenReader: CKeyValuesTokenReader, loadingCollectionFile = False):
         self.Sub = [] # change value type to collection so you can append other KVs - aka sub-keyvalues
+        errorStack = tokenReader.m_ErrorStack
+        errorStack.Push(self.keyName)
         while True:
             bAccepted = True
             # get the key name
             name = tokenReader.ReadToken()
             if name == 0: # EOF stop reading
                 if not loadingCollectionFile:
-                    g_KeyValuesErrorStack.ReportError("RecursiveLoadFromBuffer:  got EOF instead of keyname")
+                    tokenReader.ReportError("RecursiveLoadFromBuffer:  got EOF instead of keyname")
                 break
             if name == "": # empty token, maybe "" or EOF BUG this doesnt make sense for empty keys?
-                g_KeyValuesErrorStack.ReportError("RecursiveLoadFromBuffer:  got empty keyname")
+                tokenReader.ReportError("RecursiveLoadFromBuffer:  got empty keyname")
                 break
             if name[0] == '}' and not name.wasQuoted: # top level closed, stop reading
                 break
@@ -514,7 +640,7 @@ class KeyValues:
                 bAccepted = self.EvaluateConditional(peek, pfnEvaluateSymbolProc)
                 value = tokenReader.ReadToken()
             if value == 0:
-                g_KeyValuesErrorStack.ReportError("RecursiveLoadFromBuffer:  got NULL key")
+                tokenReader.ReportError("RecursiveLoadFromBuffer:  got NULL key")
                 del self.value[-1]
                 break
 
@@ -531,11 +657,11 @@ class KeyValues:
                     # if there is a conditional key see if we already have the key defined and blow it away, last one in the list wins
                     ...
             if value == 0:
-                g_KeyValuesErrorStack.ReportError("RecursiveLoadFromBuffer:  got NULL key" )
+                tokenReader.ReportError("RecursiveLoadFromBuffer:  got NULL key" )
                 del self.value[-1]
                 break
             if vne and value[0] == '}' and not value.wasQuoted:
-                g_KeyValuesErrorStack.ReportError("RecursiveLoadFromBuffer:  got } in key")
+                tokenReader.ReportError("RecursiveLoadFromBuffer:  got } in key")
                 del self.value[-1]
                 break
             if vne and value[0] == '{' and not value.wasQuoted:
@@ -543,7 +669,7 @@ class KeyValues:
                 dat.RecursiveLoadFromBuffer(resourceName, tokenReader)
             else:
                 if value.wasConditional:
-                    g_KeyValuesErrorStack.ReportError("RecursiveLoadFromBuffer:  got conditional between key and value" )
+                    tokenReader.ReportError("RecursiveLoadFromBuffer:  got conditional between key and value" )
                     break
                 if dat.m_sValue:
                     del dat.m_sValue # dont need
@@ -592,6 +718,7 @@ class KeyValues:
                 #    # remove key from list
                 #    del self.value[dat]
                 #    del dat
+        errorStack.Pop()
 
     def EvaluateConditional(self, **args):
         return True
@@ -646,6 +773,30 @@ if __name__ == "__main__":
             kv.LoadFromBuffer("NULL_test", CUtlBuffer(text))
             self.assertEqual(kv.ToString(), text_expected)
 
+        def test_cursor(self):
+            text = "//asdasd\nvalue {\"key\"  \"key\"  \"\"value }"
+            text_expected = '"value"\n{\n\t"key"\t"key"\n}\n'
+            kv = KeyValues()
+            kv.LoadFromBuffer("NULL_test", None, tokenReader=CKeyValuesTokenCursor(text))
+            self.assertEqual(kv.ToString(), text_expected)
+
+        def test_cursor_same_tokens(self):
+            text = (
+                '"VertexLitGeneric"\n{\n\t$basetexture "a/b c" // comment\n'
+                '\t"$color" "{255 128 0}" [$WIN32 && !$X360]\n\tkey=value\n'
+                '\t"" ""\n\tproxies\n\t{\n\t}\n}\n// trailing\n'
+            )
+            reader = CKeyValuesTokenReader(CUtlBuffer(text))
+            cursor = CKeyValuesTokenCursor(text)
+            while True:
+                a, b = reader.ReadToken(), cursor.ReadToken()
+                if a == 0:
+                    self.assertTrue(b == 0)
+                    break
+                self.assertEqual((str(a), a.wasQuoted), (str(b), b.wasQuoted))
+            self.assertEqual(reader.wasConditional, cursor.wasConditional)
+            self.assertEqual(reader.m_nTokensRead, cursor.m_nTokensRead)
+
     for i, file in enumerate(Path(r".\test\keyvalues\data").glob("*")):
         def test_filen(self):
             with (file.parents[1] / "ndata" / file.name).open() as e:
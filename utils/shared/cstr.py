@@ -5,10 +5,11 @@ import re
 __version__ = '2019.06.06'
 
 re_base_zero = re.compile(r"(?i)\s*[\+\-]?0(x)?")
+re_strtod = re.compile(r'[+-]?\d*[.]?\d*(?:[eE][+-]?\d+)?')
 
 class strtod:
     def __init__(self, s, pos: int = 0) -> None:
-        m = re.match(r'[+-]?\d*[.]?\d*(?:[eE][+-]?\d+)?', s[pos:])
+        m = re_strtod.match(s, pos)
         #if m.group(0) == '':
         #    raise ValueError('bad float: %s' % s[pos:])
         #self.value = float(m.group(0))
@@ -19,7 +20,7 @@ class strtod:
                 self.value = float(m.group(0))
             except ValueError:
                 self.value = None
-            self.endpos = pos + m.end()
+            self.endpos = m.end()
         else:
             raise ValueError('Cannot convert to float')
 
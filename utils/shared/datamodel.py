@@ -22,7 +22,8 @@
 
 from math import isclose
 from pathlib import Path
-import struct, array, io, binascii, collections, uuid
+import struct, array, io, binascii, collections, uuid, mmap, sys, re, os
+from itertools import chain
 from typing import Iterable, Optional
 from struct import unpack,calcsize
 
@@ -49,15 +50,14 @@ def check_support(encoding,encoding_ver):
 def _encode_binary_string(string):
 	return bytes(string,'utf-8') + bytes(1)
 
+_struct_int = struct.Struct("<i")
+_struct_short = struct.Struct("<H")
 
-global _kv2_indent
-_kv2_indent = ""
-def _add_kv2_indent():
-	global _kv2_indent
-	_kv2_indent += "\t"
-def _sub_kv2_indent():
-	global _kv2_indent
-	_kv2_indent = _kv2_indent[:-1]
+def _pack_values(typecode,values):
+	'''Little-endian bytes of a flat iterable of numbers, packed in one go.'''
+	packed = array.array(typecode,values)
+	if sys.byteorder != 'little': packed.byteswap()
+	return packed.tobytes()
 
 def _validate_array_list(iterable,array_type):
 	if not iterable: return None
@@ -114,8 +114,9 @@ def _get_kv2_repr(var):
 		return str(var)
 
 class NullElement(str):
-	pass
+	__slots__ = ()
 class uint64(int):
+	__slots__ = ()
 	def __repr__(self):
 		return hex(self)
 
@@ -129,19 +130,15 @@ class _Array(list):
 		else:
 			return super().__init__()
 		
-	def to_kv2(self):
+	def to_kv2(self,indent = ""):
 		if len(self) == 0:
 			return "[ ]"
 		if self.type == Element:
-
-			out = "\n{}[\n".format(_kv2_indent)
-			_add_kv2_indent()
-			out += _kv2_indent
-
-			out += ",\n{}".format(_kv2_indent).join([item.get_kv2() if item and item._users == 1 else "\"element\" {}".format(_quote(item.id if item else "")) for item in self])
-
-			_sub_kv2_indent()
-			return "{}\n{}]".format(out,_kv2_indent)
+			out = []
+			writer = _KV2Writer(out.append)
+			writer.write_element_array(self,indent)
+			writer.flush()
+			return "".join(out)
 		else:
 			return "[{}]".format(", ".join([_quote(_get_kv2_repr(item)) for item in self]))
 		
@@ -162,6 +159,8 @@ class _StrArray(_Array):
 	type = str
 
 class _Vector(list):
+	'''No instance dictionary: models hold a great many of these'''
+	__slots__ = ()
 	type = None
 	type_str = ""
 	def __init__(self,l):
@@ -200,21 +199,24 @@ class _Vector(list):
 		return struct.pack(self.type_str,*self)
 		
 class Vector2(_Vector):
+	__slots__ = ()
 	type = float
 	type_str = "ff"
 class Vector3(_Vector):
+	__slots__ = ()
 	type = float
 	type_str = "fff"
 class Vector4(_Vector):
+	__slots__ = ()
 	type = float
 	type_str = "ffff"
 class Quaternion(Vector4):
 	'''XYZW'''
-	pass
+	__slots__ = ()
 class Angle(Vector3):
-	pass
+	__slots__ = ()
 class QAngle(Vector3):
-	pass
+	__slots__ = ()
 class _VectorArray(_Array):
 	type = list
 	def __init__(self,l=None):
@@ -233,6 +235,7 @@ class _AngleArray(_Vector3Array):
 class _QAngleArray(_Vector3Array):
 	type = QAngle
 class Matrix(list):
+	__slots__ = ()
 	type = list
 	def __init__(self,matrix=None):
 		if matrix:
@@ -259,23 +262,22 @@ class _MatrixArray(_Array):
 	type = Matrix
 
 class Binary(bytes):
-	pass
+	__slots__ = ()
 class _BinaryArray(_Array):
 	type = Binary
 	type_str = "b"
 
 class Color(Vector4):
+	__slots__ = ()
 	type = int
 	type_str = "iiii"
 	def tobytes(self):
-		out = bytes()
-		for i in self:
-			out += bytes(int(self[i]))
-		return out
+		return struct.pack("4B",*self)
 class _ColorArray(_Vector4Array):
-	pass
+	type = Color
 	
 class Time(float):
+	__slots__ = ()
 	@classmethod
 	def from_int(cls,int_value):
 		return Time(int_value / 10000)
@@ -300,30 +302,50 @@ class IDCollisionError(Exception):
 	pass
 
 _array_types = [list,set,tuple,array.array]
-class Element(collections.OrderedDict):
+
+def _decode_first(method):
+	'''Wraps a dict method so that the attributes of a lazily loaded Element are decoded before it runs.'''
+	def wrapper(self,*args):
+		if self._lazy: self._load()
+		return method(self,*args)
+	wrapper.__name__ = method.__name__
+	return wrapper
+
+class Element(dict):
 	'''Effectively a dictionary, but keys must be str. Also contains a name (str), type (str) and ID (uuid.UUID, can be generated from str).'''
-	_datamodels = None
-	_users = 0
+	# dicts keep insertion order; slots keep large models small
+	# _lazy is (reader, offset) until the attributes of a lazily loaded element are decoded
+	__slots__ = ("_name","_type","_id","_is_placeholder","_datamodels","_users","_lazy","_index","datamodel")
 
 	@property
 	def name(self): return self._name
 	@name.setter
-	def name(self,value): self._name = str(value)
+	def name(self,value):
+		value = str(value)
+		if self._datamodels:
+			for dm in self._datamodels: dm._reindex_element(self,"name",self._name,value)
+		self._name = value
 
 	@property
 	def type(self): return self._type
 	@type.setter
-	def type(self,value): self._type = str(value)
+	def type(self,value):
+		value = str(value)
+		if self._datamodels:
+			for dm in self._datamodels: dm._reindex_element(self,"type",self._type,value)
+		self._type = value
 
 	@property
 	def id(self): return self._id
 	
 	def __init__(self,datamodel,name,elemtype="DmElement",id=None,_is_placeholder=False):			
+		self._datamodels = None
+		self._users = 0
+		self._lazy = None
 		self.name = name
 		self.type = elemtype
 		self._is_placeholder = _is_placeholder
-		self._datamodels = set()
-		self._datamodels.add(datamodel)
+		self._datamodels = (datamodel,) # almost always just the one, so not a set
 		
 		if id:
 			if isinstance(id,uuid.UUID): self._id = id
@@ -346,8 +368,61 @@ class Element(collections.OrderedDict):
 	def __hash__(self):
 		return hash(self.id)
 		
+	def _load(self):
+		reader, offset = self._lazy
+		self._lazy = None
+		reader.load_element(self,offset)
+
+	__contains__ = _decode_first(dict.__contains__)
+	__iter__ = _decode_first(dict.__iter__)
+	__reversed__ = _decode_first(dict.__reversed__)
+	__len__ = _decode_first(dict.__len__)
+	__delitem__ = _decode_first(dict.__delitem__)
+	keys = _decode_first(dict.keys)
+	values = _decode_first(dict.values)
+	items = _decode_first(dict.items)
+	pop = _decode_first(dict.pop)
+	clear = _decode_first(dict.clear)
+
+	# through __setitem__, which validates values and adds child elements to the datamodel, as MutableMapping did
+	def update(self,*args,**kwargs):
+		for key, value in dict(*args,**kwargs).items():
+			self[key] = value
+
+	def __ior__(self,other):
+		self.update(other)
+		return self
+
+	def setdefault(self,key,default = None):
+		if key not in self: self[key] = default
+		return self[key]
+
+	def copy(self):
+		'''A new element in the same datamodel, with a random ID and the same name, type and attributes'''
+		elem = self._datamodels[0].add_element(self.name,self.type,id=uuid.uuid4())
+		elem.update(self)
+		return elem
+
+	# the OrderedDict methods Element used to inherit
+	def popitem(self,last = True):
+		if self._lazy: self._load()
+		key = next(reversed(self) if last else iter(self))
+		return key, dict.pop(self,key)
+
+	def move_to_end(self,key,last = True):
+		if self._lazy: self._load()
+		value = dict.pop(self,key)
+		if last:
+			dict.__setitem__(self,key,value)
+		else:
+			items = list(dict.items(self))
+			dict.clear(self)
+			dict.__setitem__(self,key,value)
+			dict.update(self,items)
+
 	def __getitem__(self,item):
 		if type(item) != str: raise TypeError("Attribute name must be a string, not {}".format(type(item)))
+		if self._lazy: self._load()
 		try:
 			return super().__getitem__(item)
 		except KeyError as e:
@@ -356,12 +431,13 @@ class Element(collections.OrderedDict):
 	def __setitem__(self,key,item):
 		key = str(key)
 		if key in ["name", "id"]: raise KeyError("\"{}\" is a reserved name".format(key))
+		if self._lazy: self._load()
 		
 		def import_element(elem):
 			for dm in [dm for dm in self._datamodels if not dm in elem._datamodels]:
 				dm.validate_element(elem)
-				dm.elements.append(elem)
-				elem._datamodels.add(dm)
+				dm._register_element(elem)
+				elem._datamodels += (dm,)
 				for attr in elem.values():
 					t = type(attr)
 					if t == Element:
@@ -389,59 +465,21 @@ class Element(collections.OrderedDict):
 	def get(self,k,d=None):
 		return self[k] if k in self else d
 
-	def get_kv2(self,deep = True):
-		out = ""
-		out += _quote(self.type)
-		out += "\n" + _kv2_indent + "{\n"
-		_add_kv2_indent()
-		
-		def _make_attr_str(name,dm_type,value, is_array = False):
-			if value is not None:
-				if is_array:
-					return "{}\"{}\" \"{}\" {}\n".format(_kv2_indent,name,dm_type,value)
-				else:
-					return "{}\"{}\" \"{}\" \"{}\"\n".format(_kv2_indent,name,dm_type,value)
-			else:
-				return "{}\"{}\" \"{}\" \"\"\n".format(_kv2_indent,name,dm_type)
-		
-		out += _make_attr_str("id", "elementid", self.id)
-		out += _make_attr_str("name", "string", self.name)
-		
-		for name in self:
-			attr = self[name]
-			if attr == None:
-				out += _make_attr_str(name, "element", None)
-				continue
-			
-			t = type(attr)
-			
-			if t == Element and attr._users < 2 and deep:
-				out += _kv2_indent
-				out += _quote(name)
-				out += " {}".format( attr.get_kv2() )
-				out += "\n"
-			else:				
-				if issubclass(t,_Array):
-					if t == _ElementArray:
-						type_str = "element_array"
-					else:
-						type_str = _dmxtypes_str[_dmxtypes_array.index(t)] + "_array"
-				else:
-					type_str = _dmxtypes_str[_dmxtypes.index(t)]
-				
-				out += _make_attr_str(name, type_str, _get_kv2_repr(attr), issubclass(t,_Array))
-		_sub_kv2_indent()
-		out += _kv2_indent + "}"
-		return out
+	def get_kv2(self,deep = True,indent = ""):
+		out = []
+		writer = _KV2Writer(out.append)
+		writer.write_element(self,indent,deep)
+		writer.flush()
+		return "".join(out)
 
 	def tobytes(self,dm):
 		if self._is_placeholder:
-			if self.encoding_ver < 5:
-				return b'-1'
+			if dm.encoding_ver < 5:
+				return _struct_int.pack(-1)
 			else:
-				return bytes.join(b'',b'-2',bytes.decode(self.id,encoding='ASCII'))
+				return _struct_int.pack(-2) + _encode_binary_string(str(self.id))
 		else:
-			return struct.pack("i",self._index)
+			return _struct_int.pack(self._index)
 
 class _ElementArray(_Array):
 	type = Element
@@ -463,7 +501,7 @@ attr_list_v2 = [
 	None,Element,int,float,bool,str,Binary,Time,Color,Vector2,Vector3,Vector4,Angle,Quaternion,Matrix,
 	_ElementArray,_IntArray,_FloatArray,_BoolArray,_StrArray,_BinaryArray,_TimeArray,_ColorArray,_Vector2Array,_Vector3Array,_Vector4Array,_AngleArray,_QuaternionArray,_MatrixArray
 ]
-attr_list_v3 = [None,Element,int,float,bool,str,Binary,Time,Color,Vector2,Vector3,Vector4,Angle,Quaternion,Matrix,int,int] # last two are meant to be uint64, uint8
+attr_list_v3 = [None,Element,int,float,bool,str,Binary,Time,Color,Vector2,Vector3,Vector4,Angle,Quaternion,Matrix,uint64,"uint8"] # uint8 is read as int
 
 def _get_type_from_string(type_str):
 	return _dmxtypes[_dmxtypes_str.index(type_str)]
@@ -482,15 +520,17 @@ def _get_dmx_id_type(encoding,version,id):
 			return attr_list_v2[id]
 		if version in [9]:
 			if id >= 32: # array
-				return eval("_" + attr_list_v3[id-32].__name__.capitalize() + "Array")
-			return attr_list_v3[id]
+				if attr_list_v3[id-32] not in (uint64, "uint8"):
+					return _get_array_type(attr_list_v3[id-32])
+			else:
+				return attr_list_v3[id]
 	if encoding == "keyvalues2":
 		return _dmxtypes[ _dmxtypes_str.index(id) ]
 				
 	raise ValueError("Type ID {} invalid in {} {}".format(id,encoding,version))
 	
-def _get_dmx_type_id(encoding,version,t):	
-	if t == type(None): t = Element
+def _get_dmx_type_id(encoding,version,t):
+	if t == type(None) or t == NullElement: t = Element
 	if encoding == "keyvalues2": raise ValueError("Type IDs do not exist in KeyValues2")
 	try:
 		if encoding == "binary":
@@ -512,7 +552,7 @@ def _get_dmx_type_id(encoding,version,t):
 class _StringDictionary(list):
 	dummy = False
 	
-	def __init__(self,encoding,encoding_ver,in_file=None,out_datamodel=None):
+	def __init__(self,encoding,encoding_ver,in_file=None,out_elements=None):
 		if encoding == "binary":
 			self.indice_size = self.length_size = intsize
 				
@@ -532,25 +572,17 @@ class _StringDictionary(list):
 			for i in range(num_strings):
 				self.append(get_str(in_file))
 		
-		elif out_datamodel:
-			checked = set()
+		elif out_elements:
 			string_set = set()
-			def process_element(elem):
-				checked.add(elem)
+			for elem in out_elements:
 				string_set.add(elem.name)
 				string_set.add(elem.type)
-				for name in elem:
-					attr = elem[name]
+				for name, attr in elem.items():
 					string_set.add(name)
 					if isinstance(attr, str): string_set.add(attr)
-					elif isinstance(attr, Element):
-						if attr not in checked: process_element(attr)
-					elif type(attr) == _ElementArray:
-						for item in [item for item in attr if item and item not in checked]:
-							process_element(item)
-			process_element(out_datamodel.root)
 			self.extend(string_set)
 			self.sort()
+		self.indices = {string: i for i, string in enumerate(self)}
 		
 	def read_string(self,in_file):
 		if self.dummy:
@@ -562,14 +594,12 @@ class _StringDictionary(list):
 		if self.dummy:
 			out_file.write( _encode_binary_string(string) )
 		else:
-			assert(string in self)
-			out_file.write( struct.pack("H" if self.indice_size == shortsize else "i", self.index(string) ) )
-		
+			out_file.write( (_struct_short if self.indice_size == shortsize else _struct_int).pack(self.indices[string]) )
+
 	def write_dictionary(self,out_file):
 		if not self.dummy:
-			out_file.write( struct.pack("H" if self.length_size == shortsize else "i", len(self) ) )
-			for string in self:
-				out_file.write( _encode_binary_string(string) )
+			out_file.write( (_struct_short if self.length_size == shortsize else _struct_int).pack(len(self)) )
+			out_file.write( b''.join([_encode_binary_string(string) for string in self]) )
 	
 class DataModel:
 	'''Container for Element objects. Has a format name (str) and format version (int). Can write itself to a string object or a file.'''
@@ -595,11 +625,17 @@ class DataModel:
 	@property
 	def prefix_attributes(self): return self.__prefix_attributes
 
-	def __init__(self,format,format_ver):		
+	def __init__(self,format,format_ver):
 		self.format = format
 		self.format_ver = format_ver
-		
+
 		self.__elements = []
+		# lookup tables for find_elements. name and type buckets are keyed by id(elem) and kept in self.elements order
+		self.__elements_by_id = {}
+		self.__elements_by_name = collections.defaultdict(dict)
+		self.__elements_by_type = collections.defaultdict(dict)
+		self.__positions = {}
+		self.__unsorted_buckets = set()
 		self.__prefix_attributes = Element(self,"")
 		self.root = None
 		self.allow_random_ids = True
@@ -611,31 +647,79 @@ class DataModel:
 		if elem._is_placeholder:
 			return
 
-		try:
-			collision = self.elements[self.elements.index(elem)]
-		except ValueError:
+		collision = self.__elements_by_id.get(elem.id)
+		if collision is None:
 			return # no match
-		
+
 		if not collision._is_placeholder:
 			raise IDCollisionError("{} invalid for {}: ID collision with {}. ID is {}.".format(elem, self, collision, elem.id))
-		
+
+	def _register_element(self,elem):
+		'''Appends an already validated element and indexes it. A real element takes over the ID of its placeholder.'''
+		key = id(elem)
+		self.__positions[key] = len(self.__elements)
+		self.__elements.append(elem)
+		if elem._is_placeholder:
+			self.__elements_by_id.setdefault(elem.id, elem)
+		else:
+			self.__elements_by_id[elem.id] = elem
+		self.__elements_by_name[elem.name][key] = elem
+		self.__elements_by_type[elem.type][key] = elem
+
+	def _reindex_element(self,elem,index,old,new):
+		'''Called by Element before its name or type changes.'''
+		if old == new: return
+		table = self.__elements_by_name if index == "name" else self.__elements_by_type
+		key = id(elem)
+		bucket = table.get(old)
+		if bucket is None or bucket.pop(key, None) is None:
+			return # not registered here (yet)
+		if not bucket:
+			del table[old]
+		bucket = table[new]
+		if bucket and self.__positions[next(reversed(bucket))] > self.__positions[key]:
+			self.__unsorted_buckets.add((index, new))
+		bucket[key] = elem
+
+	def _get_bucket(self,index,value):
+		table = self.__elements_by_name if index == "name" else self.__elements_by_type
+		bucket = table.get(value)
+		if not bucket:
+			return {}
+		if (index, value) in self.__unsorted_buckets:
+			self.__unsorted_buckets.discard((index, value))
+			positions = self.__positions
+			sorted_items = sorted(bucket.items(), key=lambda item: positions[item[0]])
+			bucket.clear()
+			bucket.update(sorted_items)
+		return bucket
+
+	def _get_element_by_id(self,id):
+		return self.__elements_by_id.get(id)
+
 	def add_element(self,name,elemtype="DmElement",id=None,_is_placeholder=False):
 		if id == None and not self.allow_random_ids:
 			raise ValueError("{} does not allow random IDs.".format(self))
 		elem = Element(self,name,elemtype,id,_is_placeholder)
 		self.validate_element(elem)
-		self.elements.append(elem)
+		self._register_element(elem)
 		elem.datamodel = self
 		if len(self.elements) == 1: self.root = elem
 		return elem
-		
+
 	def find_elements(self,name=None,id=None,elemtype=None) -> Optional[Iterable[Element]]:
-		out = []
 		if isinstance(id, str): id = uuid.UUID(id)
-		for elem in self.elements:
-			if elem.id == id: return [elem]
-			if elem.name == name: out.append(elem)
-			if elem.type == elemtype: out.append(elem)
+		if id is not None:
+			elem = self.__elements_by_id.get(id)
+			if elem is not None: return [elem]
+		by_name = self._get_bucket("name",name) if name is not None else {}
+		by_type = self._get_bucket("type",elemtype) if elemtype is not None else {}
+		if by_name and by_type:
+			# both: in element order, elements matching both appear twice
+			positions = self.__positions
+			out = [elem for key, elem in sorted([*by_name.items(), *by_type.items()], key=lambda item: positions[item[0]])]
+		else:
+			out = list((by_name or by_type).values())
 		if len(out): return out
 		
 	def _write(self,value, elem = None, suppress_dict = None):
@@ -666,126 +750,173 @@ class DataModel:
 
 		elif t == Element:
 			self.out.write(bytes.join(b'',[item.tobytes(self) if item else struct.pack("i",-1) for item in value]))
-		elif issubclass(t,(_Vector,Matrix, Time)):
-			self.out.write(bytes.join(b'',[item.tobytes() for item in value]))
-		
+		elif t == Color:
+			self.out.write( _pack_values("B",chain.from_iterable(value)) )
+		elif issubclass(t,_Vector):
+			self.out.write( _pack_values("f",chain.from_iterable(value)) )
+		elif t == Matrix:
+			self.out.write( _pack_values("f",(f for matrix in value for row in matrix for f in row)) )
+		elif t == Time:
+			self.out.write( _pack_values("i",[int(item * 10000) for item in value]) )
+
 		elif t == bool:
-			self.out.write( struct.pack("b" * len(value),*value) )
+			self.out.write( _pack_values("b",value) )
 		elif t == int:
-			self.out.write( struct.pack("i" * len(value),*value) )
+			self.out.write( _pack_values("i",value) )
 		elif t == float:
-			self.out.write( struct.pack("f" * len(value),*value) )
+			self.out.write( _pack_values("f",value) )
+		elif t == uint64:
+			self.out.write( _pack_values("Q",value) )
 			
 		else:
 			raise TypeError("Cannot write attributes of type {}".format(t))
 	
+	def _get_element_chain(self):
+		'''Elements reachable from root in depth-first order, which is the order of the binary element index.'''
+		chain = []
+		stack = [self.root]
+		while stack:
+			elem = stack.pop()
+			if elem._is_placeholder or hasattr(elem,"_index"): continue
+			elem._index = len(chain)
+			chain.append(elem)
+
+			children = []
+			for attr in elem.values():
+				t = type(attr)
+				if t == Element:
+					children.append(attr)
+				elif t == _ElementArray:
+					children.extend([item for item in attr if item])
+			stack.extend(reversed(children))
+		return chain
+
 	def _write_element_index(self,elem):
-		if elem._is_placeholder or hasattr(elem,"_index"): return
 		self._write(elem.type, suppress_dict = False)
 		self._write(elem.name)
 		self._write(elem.id)
-		
-		elem._index = len(self.elem_chain)
-		self.elem_chain.append(elem)
-		
-		for name in elem:
-			attr = elem[name]
+
+	def _write_attributes(self,elem,use_string_dict = True):
+		out = self.out
+		out.write(_struct_int.pack(len(elem)))
+		type_ids = self._type_ids
+		for name, attr in elem.items():
+			if use_string_dict:
+				self._string_dict.write_string(out,name)
+			else:
+				out.write(_encode_binary_string(name))
 			t = type(attr)
-			if t == Element:
-				self._write_element_index(attr)
-			elif t == _ElementArray:
-				for item in [item for item in attr if item]:
-					self._write_element_index(item)
-		
-	def _write_element_props(self):	
+			type_id = type_ids.get(t)
+			if type_id is None:
+				type_id = type_ids[t] = bytes((_get_dmx_type_id(self.encoding, self.encoding_ver, t),))
+			out.write(type_id)
+			if attr is None or t == NullElement:
+				out.write(_struct_int.pack(-1))
+			else:
+				self._write(attr, elem, suppress_dict = None if use_string_dict else True)
+
+	def _write_element_props(self):
 		for elem in self.elem_chain:
-			if elem._is_placeholder: continue
-			self._write(len(elem))
-			for name in elem:
-				attr = elem[name]
-				self._write(name, suppress_dict = False)
-				self._write( struct.pack("b", _get_dmx_type_id(self.encoding, self.encoding_ver, type(attr) )) )
-				if attr == None:
-					self._write(-1)
-				else:
-					self._write(attr,elem)
-					
-	def echo(self,encoding,encoding_ver):
-		check_support(encoding, encoding_ver)
-		
-		if encoding in ["binary", "binary_proto"]:
-			self.out = io.BytesIO()
-		else:
-			self.out = io.StringIO()
-			_kv2_indent = ""
-		
-		self.encoding = encoding
-		self.encoding_ver = encoding_ver
-		
+			self._write_attributes(elem)
+
+	def _echo_binary(self):
 		if self.encoding == 'binary_proto':
-			self.out.write( _encode_binary_string(header_proto2.format(encoding_ver) + "\n") )
+			self.out.write( _encode_binary_string(header_proto2.format(self.encoding_ver) + "\n") )
 		else:
-			header = header_format.format(encoding,encoding_ver,self.format,self.format_ver)
-			if self.encoding == 'binary':
-				self.out.write( _encode_binary_string(header + "\n") )
-			elif self.encoding == 'keyvalues2':
-				self.out.write(header + "\n")
-		
-		if encoding == 'binary':
-			if encoding_ver >= 9:
+			header = header_format.format(self.encoding,self.encoding_ver,self.format,self.format_ver)
+			self.out.write( _encode_binary_string(header + "\n") )
+
+		self._type_ids = {}
+		self.elem_chain = self._get_element_chain()
+		try:
+			if self.encoding == 'binary' and self.encoding_ver >= 9:
 				self._write(1 if len(self.prefix_attributes) else 0)
 				if len(self.prefix_attributes):
-					self._write(len(self.prefix_attributes))
-					for name,value in self.prefix_attributes.items():
-						self._write(name)
-						self._write(value)
+					self._write_attributes(self.prefix_attributes, use_string_dict = False)
 
-			self._string_dict = _StringDictionary(encoding,encoding_ver,out_datamodel=self)
+			self._string_dict = _StringDictionary(self.encoding,self.encoding_ver,out_elements=self.elem_chain)
 			self._string_dict.write_dictionary(self.out)
-			
-		# count elements
+
+			self._write(len(self.elem_chain))
+			for elem in self.elem_chain:
+				self._write_element_index(elem)
+			self._write_element_props()
+		finally:
+			for elem in self.elem_chain: del elem._index
+			self.elem_chain = None
+			self._string_dict = None
+
+	def _count_users(self):
+		'''Sets _users on every element reachable from root, returns those elements.'''
 		out_elems = set()
 		for elem in self.elements:
 			elem._users = 0
-		def _count_child_elems(elem):
-			if elem in out_elems: return
-
-			out_elems.add(elem)
-			for name in elem:
-				attr = elem[name]
+		out_elems.add(self.root)
+		stack = [self.root]
+		while stack:
+			elem = stack.pop()
+			for attr in elem.values():
 				t = type(attr)
 				if t == Element:
-					if attr not in out_elems:
-						_count_child_elems(attr)
-					attr._users += 1
+					items = (attr,)
 				elif t == _ElementArray:
-					for item in [item for item in attr if item]:
-						if item not in out_elems:
-							_count_child_elems(item)
-						item._users += 1
-		_count_child_elems(self.root)
-		
-		if self.encoding in ["binary", "binary_proto"]:
-			self._write(len(out_elems))
-			self.elem_chain = []
-			self._write_element_index(self.root)
-			self._write_element_props()
+					items = [item for item in attr if item]
+				else:
+					continue
+				for item in items:
+					if item not in out_elems:
+						out_elems.add(item)
+						stack.append(item)
+					item._users += 1
+		return out_elems
+
+	def echo(self,encoding,encoding_ver):
+		check_support(encoding, encoding_ver)
+
+		self.encoding = encoding
+		self.encoding_ver = encoding_ver
+
+		if encoding in ["binary", "binary_proto"]:
+			self.out = io.BytesIO()
+			self._echo_binary()
+			return self.out.getvalue()
+
+		out = io.StringIO()
+		self._echo_kv2(out.write)
+		return out.getvalue()
+
+	def _echo_kv2(self,write):
+		writer = _KV2Writer(write)
+		writer.parts.append(header_format.format(self.encoding,self.encoding_ver,self.format,self.format_ver) + "\n")
+
+		out_elems = self._count_users()
+		writer.write_element(self.prefix_attributes)
+		writer.parts.append("\n")
+		writer.write_element(self.root)
+		writer.parts.append("\n\n")
+		for elem in out_elems:
+			if elem._users > 1:
+				writer.write_element(elem)
+				writer.parts.append("\n\n")
+		writer.flush()
 
-			for elem in self.elem_chain: del elem._index
-		elif self.encoding == 'keyvalues2':
-			self.out.write(self.prefix_attributes.get_kv2() + "\n" + self.root.get_kv2() + "\n\n")
-			for elem in out_elems:
-				if elem._users > 1:
-					self.out.write(elem.get_kv2() + "\n\n")
-				
-		self._string_dict = None
-		return self.out.getvalue()
-		
 	def write(self,path,encoding,encoding_ver):
-		with open(path,'wb') as file:
-			dm = self.echo(encoding,encoding_ver)
-			if encoding == 'keyvalues2': dm = dm.encode('utf-8')
-			file.write(dm)
+		check_support(encoding, encoding_ver)
+		# A lazily loaded model maps its source file until every element is decoded. Decode them first,
+		# which releases the file, so that it can be overwritten.
+		for elem in self.elements:
+			if elem._lazy: elem._load()
+		self.encoding = encoding
+		self.encoding_ver = encoding_ver
+		if encoding in ["binary", "binary_proto"]:
+			with open(path,'wb',buffering=1 << 20) as self.out:
+				self._echo_binary()
+			self.out = None
+			return
+
+		# streamed as it is generated, never holding the whole text
+		with open(path,'w',encoding='utf-8',newline='',buffering=1 << 20) as file:
+			self._echo_kv2(file.write)
 
 def remove_ids(kv2_path: Path):
     """For lack of keyvalues2_noids"""
@@ -801,10 +932,768 @@ def remove_ids(kv2_path: Path):
 class DatamodelParseError(Exception):
 	pass
 
+def _map_file(in_file):
+	'''The whole file as one buffer. Memory-mapped when it is a file on disk, read into memory otherwise.'''
+	try:
+		return mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ)
+	except (AttributeError, io.UnsupportedOperation, OSError, ValueError):
+		in_file.seek(0)
+		return in_file.read()
+
+def _make_groups(cls,values,width):
+	'''[cls(values[0:width]), cls(values[width:width*2]), ...] without per-item validation'''
+	new = cls.__new__
+	init = list.__init__
+	out = []
+	append = out.append
+	for group in zip(*[iter(values)] * width):
+		item = new(cls)
+		init(item, group)
+		append(item)
+	return out
+
+class _BinaryReader:
+	'''Decodes the body of a binary DMX held in one buffer, walking it by offset instead of reading the file value by value.'''
+	_int = struct.Struct("<i")
+	_short = struct.Struct("<H")
+	_uint64 = struct.Struct("<Q")
+	_float = struct.Struct("<f")
+	_vec2 = struct.Struct("<2f")
+	_vec3 = struct.Struct("<3f")
+	_vec4 = struct.Struct("<4f")
+	_matrix = struct.Struct("<16f")
+	_color = struct.Struct("<4B")
+
+	# bytes taken by one value of the fixed size types
+	value_sizes = {int: 4, float: 4, bool: 1, Time: 4, Color: 4, Vector2: 8, Vector3: 12, Angle: 12, QAngle: 12,
+		Vector4: 16, Quaternion: 16, Matrix: 64, uint64: 8, "uint8": 1}
+
+	def __init__(self,dm,encoding,encoding_ver,data,pos):
+		self.dm = dm
+		self.encoding = encoding
+		self.encoding_ver = encoding_ver
+		self.data = data
+		self.view = memoryview(data)
+		self.pos = pos
+		self.strings = None
+		self.index_struct = None
+		self.attr_readers = {}
+		self.attr_skippers = {}
+		self.pending = 0 # lazily loaded elements not decoded yet
+		self.value_readers = {
+			Element: self.read_element_ref,
+			str: self.read_str,
+			int: self.read_int,
+			float: self.read_float,
+			bool: self.read_bool,
+			Vector2: lambda: self.read_vector(Vector2, self._vec2),
+			Vector3: lambda: self.read_vector(Vector3, self._vec3),
+			Angle: lambda: self.read_vector(Angle, self._vec3),
+			QAngle: lambda: self.read_vector(QAngle, self._vec3),
+			Vector4: lambda: self.read_vector(Vector4, self._vec4),
+			Quaternion: lambda: self.read_vector(Quaternion, self._vec4),
+			Matrix: self.read_matrix,
+			Color: self.read_color,
+			Time: lambda: Time.from_int(self.read_int()),
+			Binary: self.read_binary,
+			uint64: self.read_uint64,
+			"uint8": self.read_byte,
+		}
+		# fixed size items, decoded a whole array at a time
+		self.array_readers = {
+			int: lambda count: self.read_values("i", count),
+			float: lambda count: self.read_values("f", count),
+			bool: lambda count: [value != 0 for value in self.read_values("B", count)],
+			Time: lambda count: [Time(value / 10000) for value in self.read_values("i", count)],
+			Vector2: lambda count: _make_groups(Vector2, self.read_values("f", count * 2), 2),
+			Vector3: lambda count: _make_groups(Vector3, self.read_values("f", count * 3), 3),
+			Angle: lambda count: _make_groups(Angle, self.read_values("f", count * 3), 3),
+			QAngle: lambda count: _make_groups(QAngle, self.read_values("f", count * 3), 3),
+			Vector4: lambda count: _make_groups(Vector4, self.read_values("f", count * 4), 4),
+			Quaternion: lambda count: _make_groups(Quaternion, self.read_values("f", count * 4), 4),
+			Color: lambda count: _make_groups(Color, self.read_values("B", count * 4), 4),
+			Matrix: self.read_matrices,
+		}
+
+	def close(self):
+		self.view.release()
+		if isinstance(self.data, mmap.mmap): self.data.close()
+
+	def read_int(self):
+		value, = self._int.unpack_from(self.view, self.pos)
+		self.pos += 4
+		return value
+	def read_short(self):
+		value, = self._short.unpack_from(self.view, self.pos)
+		self.pos += 2
+		return value
+	def read_uint64(self):
+		value, = self._uint64.unpack_from(self.view, self.pos)
+		self.pos += 8
+		return uint64(value)
+	def read_float(self):
+		value, = self._float.unpack_from(self.view, self.pos)
+		self.pos += 4
+		return value
+	def read_byte(self):
+		self.pos += 1
+		return self.view[self.pos - 1]
+	def read_bool(self):
+		return self.read_byte() != 0
+	def read_bytes(self,length):
+		if self.pos + length > len(self.view):
+			raise DatamodelParseError("Unexpected EOF at offset {}".format(self.pos))
+		self.pos += length
+		return bytes(self.view[self.pos - length:self.pos])
+
+	def read_values(self,typecode,count):
+		values = array.array(typecode)
+		end = self.pos + count * values.itemsize
+		if end > len(self.view):
+			raise DatamodelParseError("Unexpected EOF at offset {}".format(self.pos))
+		values.frombytes(self.view[self.pos:end])
+		if sys.byteorder != 'little': values.byteswap()
+		self.pos = end
+		return values.tolist()
+
+	def read_str(self):
+		end = self.data.find(b'\0', self.pos)
+		if end == -1:
+			raise DatamodelParseError("Unterminated string at offset {}".format(self.pos))
+		value = str(self.view[self.pos:end], 'utf-8')
+		self.pos = end + 1
+		return value
+	def skip_str(self):
+		end = self.data.find(b'\0', self.pos)
+		if end == -1:
+			raise DatamodelParseError("Unterminated string at offset {}".format(self.pos))
+		self.pos = end + 1
+	def read_dict_string(self):
+		index, = self.index_struct.unpack_from(self.view, self.pos)
+		self.pos += self.index_struct.size
+		return self.strings[index]
+
+	def read_vector(self,cls,fmt):
+		value = cls.__new__(cls)
+		list.__init__(value, fmt.unpack_from(self.view, self.pos))
+		self.pos += fmt.size
+		return value
+	def read_matrix(self):
+		m = self._matrix.unpack_from(self.view, self.pos)
+		self.pos += self._matrix.size
+		return Matrix([list(m[0:4]), list(m[4:8]), list(m[8:12]), list(m[12:16])])
+	def read_matrices(self,count):
+		values = self.read_values("f", count * 16)
+		return [Matrix([values[i:i+4], values[i+4:i+8], values[i+8:i+12], values[i+12:i+16]]) for i in range(0, len(values), 16)]
+	def read_color(self):
+		value = Color.__new__(Color)
+		list.__init__(value, self._color.unpack_from(self.view, self.pos))
+		self.pos += 4
+		return value
+	def read_binary(self):
+		return Binary(self.read_bytes(self.read_int()))
+
+	def read_element_ref(self):
+		element_index = self.read_int()
+		if element_index == -1:
+			return None
+		elif element_index == -2:
+			id = uuid.UUID(hex=self.read_str())
+			return self.dm._get_element_by_id(id) or self.dm.add_element("Missing element",id=id,_is_placeholder=True)
+		return self.dm.elements[element_index]
+
+	def skip_binary(self):
+		length = self.read_int()
+		self.pos += length
+	def skip_element_ref(self):
+		if self.read_int() == -2:
+			self.skip_str()
+
+	def get_attr_skipper(self,type_id):
+		'''Function moving past an attribute value of a type ID without decoding it'''
+		skip = self.attr_skippers.get(type_id)
+		if skip is None:
+			attr_type = _get_dmx_id_type(self.encoding,self.encoding_ver,type_id)
+			is_array = attr_type in _dmxtypes_array
+			item_type = _get_single_type(attr_type) if is_array else attr_type
+			if item_type == str and not is_array and self.encoding_ver >= 4 and self.index_struct:
+				size = self.index_struct.size
+			else:
+				size = self.value_sizes.get(item_type)
+
+			if size is not None:
+				if is_array:
+					def skip():
+						count = self.read_int()
+						self.pos += count * size
+				else:
+					def skip():
+						self.pos += size
+			else:
+				skip_item = {str: self.skip_str, Binary: self.skip_binary, Element: self.skip_element_ref}.get(item_type)
+				if skip_item is None:
+					raise TypeError("Cannot read attributes of type {}".format(attr_type))
+				if is_array:
+					def skip():
+						for _ in range(self.read_int()): skip_item()
+				else:
+					skip = skip_item
+			self.attr_skippers[type_id] = skip
+		return skip
+
+	def get_attr_reader(self,type_id):
+		'''(array type, reader taking the item count) or (None, value reader) for a type ID'''
+		reader = self.attr_readers.get(type_id)
+		if reader is None:
+			attr_type = _get_dmx_id_type(self.encoding,self.encoding_ver,type_id)
+			if attr_type in _dmxtypes_array:
+				item_type = _get_single_type(attr_type)
+				read = self.array_readers.get(item_type)
+				if read is None:
+					# strings in arrays are never in the dictionary
+					read_item = self.read_str if item_type == str else self.value_readers.get(item_type)
+					if read_item is not None:
+						read = lambda count, read_item=read_item: [read_item() for _ in range(count)]
+			else:
+				read = self.value_readers.get(attr_type)
+				attr_type = None
+			if read is None:
+				raise TypeError("Cannot read attributes of type {}".format(attr_type))
+			reader = self.attr_readers[type_id] = (attr_type, read)
+		return reader
+
+	def read_element(self,elem,use_string_dict = True):
+		read_name = self.read_dict_string if use_string_dict else self.read_str
+		attr_readers = self.attr_readers
+		setitem = dict.__setitem__
+		for _ in range(self.read_int()):
+			name = read_name()
+			type_id = self.view[self.pos]
+			self.pos += 1
+			array_type, read = attr_readers.get(type_id) or self.get_attr_reader(type_id)
+			if array_type is None:
+				value = read()
+			else:
+				value = array_type()
+				value.extend(read(self.read_int()))
+			# decoded values are always valid attribute types, and elements already belong to this datamodel
+			setitem(elem, name, value)
+
+	def skip_element(self):
+		name_size = self.index_struct.size if self.index_struct else None
+		attr_skippers = self.attr_skippers
+		for _ in range(self.read_int()):
+			if name_size is None: self.skip_str()
+			else: self.pos += name_size
+			type_id = self.view[self.pos]
+			self.pos += 1
+			(attr_skippers.get(type_id) or self.get_attr_skipper(type_id))()
+
+	def load_element(self,elem,offset):
+		'''Decodes the attributes of a lazily loaded element. The buffer is closed after the last one.'''
+		pos = self.pos
+		self.pos = offset
+		try:
+			self.read_element(elem)
+		finally:
+			self.pos = pos
+			self.pending -= 1
+			if self.pending == 0: self.close()
+
+	def read_selected(self,elements,offsets,element_types,lazy):
+		'''Decodes the root, then elements of the requested types and every element they reference.'''
+		offsets = {id(elem): offset for elem, offset in zip(elements, offsets)}
+		def decode(elem):
+			offset = offsets.pop(id(elem), None)
+			if offset is None: return False # decoded already, or a placeholder
+			if lazy: elem._lazy = None
+			self.pos = offset
+			self.read_element(elem)
+			return True
+
+		# the root only for its own attributes; it usually references everything
+		decode(elements[0])
+		values = dict.values
+		stack = [elem for elem in elements if elem.type in element_types]
+		while stack:
+			elem = stack.pop()
+			if not decode(elem): continue
+			for attr in values(elem):
+				t = type(attr)
+				if t == Element:
+					stack.append(attr)
+				elif t == _ElementArray:
+					stack.extend([item for item in attr if item])
+		if lazy: self.pending = len(offsets)
+
+	def read(self,lazy = False,element_types = None):
+		dm = self.dm
+		encoding_ver = self.encoding_ver
+
+		# prefix attributes
+		if encoding_ver >= 9:
+			for prefix_elem in range(self.read_int()):
+				self.read_element(dm.prefix_attributes, use_string_dict = False)
+
+		string_dict = dm._string_dict = _StringDictionary(self.encoding,encoding_ver)
+		if string_dict.dummy:
+			self.read_dict_string = self.read_str
+		else:
+			num_strings = self.read_short() if string_dict.length_size == shortsize else self.read_int()
+			string_dict.extend([self.read_str() for _ in range(num_strings)])
+			self.strings = string_dict
+			self.index_struct = self._short if string_dict.indice_size == shortsize else self._int
+		if encoding_ver >= 4:
+			self.value_readers[str] = self.read_dict_string
+
+		# element headers
+		elements = []
+		for i in range(self.read_int()):
+			elemtype = self.read_dict_string()
+			name = self.read_dict_string() if encoding_ver >= 4 else self.read_str()
+			id = uuid.UUID(bytes_le = self.read_bytes(16)) # little-endian
+			elements.append(dm.add_element(name,elemtype,id))
+
+		# element bodies
+		if not lazy and element_types is None:
+			for elem in elements:
+				self.read_element(elem)
+			return
+
+		# find where each body starts, then decode what was asked for
+		offsets = []
+		for elem in elements:
+			offsets.append(self.pos)
+			self.skip_element()
+		if lazy:
+			for elem, offset in zip(elements, offsets):
+				elem._lazy = (self, offset)
+			self.pending = len(elements)
+		if element_types is not None and elements:
+			self.read_selected(elements, offsets, set(element_types), lazy)
+
 def parse(parse_string, element_path=None):
 	return load(in_file=io.StringIO(parse_string),element_path=element_path)
 
-def load(path = None, in_file = None, element_path = None):
+class _BinaryPatcher(_BinaryReader):
+	'''Finds where a binary DMX stores element names and string attributes, skipping over everything else.'''
+	def __init__(self,encoding,encoding_ver,data,pos):
+		super().__init__(None,encoding,encoding_ver,data,pos)
+		self.changed = 0
+
+	def read_string_at(self,indexed):
+		'''(start, end, value) of a dictionary index or an inline string'''
+		start = self.pos
+		if indexed:
+			value = self.read_dict_string()
+		else:
+			value = self.read_str()
+		return start, self.pos, value
+
+	def find_edits(self,edit,element_types):
+		'''Sorted (start, end, replacement bytes) for the whole file'''
+		encoding_ver = self.encoding_ver
+		edits = []
+
+		# prefix attributes are never in the dictionary; skip them, then forget the skippers used
+		if encoding_ver >= 9:
+			for prefix_elem in range(self.read_int()):
+				self.skip_element()
+			self.attr_skippers.clear()
+
+		string_dict = _StringDictionary(self.encoding,encoding_ver)
+		indexed = not string_dict.dummy
+		if indexed:
+			count_struct = self._short if string_dict.length_size == shortsize else self._int
+			count_pos = self.pos
+			count, = count_struct.unpack_from(self.view, self.pos)
+			self.pos += count_struct.size
+			self.strings = [self.read_str() for _ in range(count)]
+			dict_end = self.pos
+			self.index_struct = self._short if string_dict.indice_size == shortsize else self._int
+
+		# offered strings: (element type, attribute name, start, end, value, indexed)
+		found = []
+		elements = []
+		for i in range(self.read_int()):
+			elemtype = self.read_dict_string() if indexed else self.read_str()
+			start, end, name = self.read_string_at(indexed and encoding_ver >= 4)
+			self.pos += 16 # id
+			wanted = element_types is None or elemtype in element_types
+			elements.append(elemtype if wanted else None)
+			if wanted: found.append((elemtype, "name", start, end, name, indexed and encoding_ver >= 4))
+
+		str_type_id = _get_dmx_type_id(self.encoding,encoding_ver,str)
+		values_indexed = indexed and encoding_ver >= 4
+		for elemtype in elements:
+			if elemtype is None:
+				self.skip_element()
+				continue
+			for _ in range(self.read_int()):
+				name = self.read_dict_string() if indexed else self.read_str()
+				type_id = self.view[self.pos]
+				self.pos += 1
+				if type_id == str_type_id:
+					found.append((elemtype, name, *self.read_string_at(values_indexed), values_indexed))
+				else:
+					(self.attr_skippers.get(type_id) or self.get_attr_skipper(type_id))()
+
+		# new strings go at the end of the dictionary, so every index already in the file stays valid
+		new_strings = {}
+		for elemtype, name, start, end, value, is_index in found:
+			new_value = edit(elemtype, name, value)
+			if new_value is None or new_value == value: continue
+			new_value = str(new_value)
+			if is_index:
+				index = new_strings.get(new_value)
+				if index is None:
+					index = new_strings[new_value] = len(self.strings) + len(new_strings)
+				if index >= 1 << (8 * self.index_struct.size - (self.index_struct is self._int)):
+					raise ValueError("Too many strings for a version {} dictionary".format(encoding_ver))
+				edits.append((start, end, self.index_struct.pack(index)))
+			else:
+				edits.append((start, end, _encode_binary_string(new_value)))
+			self.changed += 1
+
+		if new_strings:
+			edits.append((count_pos, count_pos + count_struct.size, count_struct.pack(len(self.strings) + len(new_strings))))
+			edits.append((dict_end, dict_end, b''.join([_encode_binary_string(string) for string in new_strings])))
+		edits.sort(key=lambda edit: edit[0])
+		return edits
+
+def _kv2_floats(cls):
+	if cls.type is int: # Color
+		return lambda value: cls([float(f) for f in value.split()])
+	width = len(cls.type_str)
+	new = cls.__new__
+	init = list.__init__
+	def read(value):
+		floats = [float(f) for f in value.split()]
+		if len(floats) != width:
+			raise TypeError("Expected {} values, got {}".format(width, len(floats)))
+		item = new(cls)
+		init(item, floats)
+		return item
+	return read
+
+def _kv2_matrix(value):
+	floats = [float(f) for f in value.split()]
+	return Matrix([floats[0:4], floats[4:8], floats[8:12], floats[12:16]])
+
+class _KV2Writer:
+	'''Writes elements as keyvalues2 text through a write function, passing on a few thousand lines at a time.
+	Indentation is passed down the calls, so writers don't share any state.'''
+	flush_size = 4096
+
+	def __init__(self,write):
+		self.write = write
+		self.parts = []
+		self.type_names = {}
+
+	def flush(self):
+		self.write("".join(self.parts))
+		self.parts.clear()
+
+	def type_name(self,t):
+		name = self.type_names.get(t)
+		if name is None:
+			if t == _ElementArray:
+				name = "element_array"
+			elif issubclass(t,_Array):
+				name = _dmxtypes_str[_dmxtypes_array.index(t)] + "_array"
+			else:
+				name = _dmxtypes_str[_dmxtypes.index(t)]
+			self.type_names[t] = name
+		return name
+
+	def write_element_array(self,arr,indent):
+		'''Elements used only here are written inline, others by ID'''
+		parts = self.parts
+		inner = indent + "\t"
+		parts.append("\n{}[\n{}".format(indent,inner))
+		for i, item in enumerate(arr):
+			if i: parts.append(",\n" + inner)
+			if item and item._users == 1:
+				self.write_element(item,inner)
+			else:
+				parts.append("\"element\" \"{}\"".format(item.id if item else ""))
+		parts.append("\n{}]".format(indent))
+
+	def write_element(self,elem,indent = "",deep = True):
+		parts = self.parts
+		inner = indent + "\t"
+		parts.append("\"{}\"\n{}{{\n".format(elem.type,indent))
+		parts.append("{}\"id\" \"elementid\" \"{}\"\n".format(inner,elem.id))
+		parts.append("{}\"name\" \"string\" \"{}\"\n".format(inner,elem.name))
+
+		for name, attr in elem.items():
+			if attr is None:
+				parts.append("{}\"{}\" \"element\" \"\"\n".format(inner,name))
+				continue
+			t = type(attr)
+			if t == Element and attr._users < 2 and deep:
+				parts.append("{}\"{}\" ".format(inner,name))
+				self.write_element(attr,inner)
+				parts.append("\n")
+			elif t == _ElementArray and attr:
+				parts.append("{}\"{}\" \"element_array\" ".format(inner,name))
+				self.write_element_array(attr,inner)
+				parts.append("\n")
+			elif issubclass(t,_Array):
+				parts.append("{}\"{}\" \"{}\" {}\n".format(inner,name,self.type_name(t),attr.to_kv2()))
+			else:
+				parts.append("{}\"{}\" \"{}\" \"{}\"\n".format(inner,name,self.type_name(t),_get_kv2_repr(attr)))
+			if len(parts) >= self.flush_size: self.flush()
+		parts.append(indent + "}")
+
+class _KV2Reader:
+	'''Parses keyvalues2 text held in one buffer, scanning it with one precompiled pattern instead of line by line.'''
+	# Up to three quoted strings on one line (an attribute: name, type and value), or a bracket.
+	# Commas between array items end a match, so every item comes on its own. Strings may span lines.
+	_token = re.compile(rb'[\s,]*(?:"([^"]*)"(?:[ \t]*"([^"]*)"(?:[ \t]*"([^"]*)")?)?|([{}\[\]]))')
+
+	# by type name, all taking the raw bytes of the value
+	value_readers = {
+		b'string': bytes.decode,
+		b'int': int,
+		b'uint8': int,
+		b'uint64': lambda value: uint64(value, 0),
+		b'float': float,
+		b'bool': lambda value: bool(int(value)),
+		b'time': Time,
+		b'color': _kv2_floats(Color),
+		b'vector2': _kv2_floats(Vector2),
+		b'vector3': _kv2_floats(Vector3),
+		b'vector4': _kv2_floats(Vector4),
+		b'quaternion': _kv2_floats(Quaternion),
+		b'angle': _kv2_floats(Angle),
+		b'qangle': _kv2_floats(QAngle),
+		b'matrix': _kv2_matrix,
+		b'binary': lambda value: Binary(binascii.unhexlify(b"".join(value.split()))),
+	}
+
+	def __init__(self,dm,data,pos,element_path=None):
+		self.dm = dm
+		self.data = data
+		self.next_match = self._token.finditer(data, pos).__next__
+		self.match = None
+		self.pos = pos
+		# names of the elements to descend into, starting at the root. Elements off the path are skipped.
+		self.element_path = [name.lower() for name in element_path] if element_path else None
+		# forward references, resolved once every element has been read
+		self.element_users = collections.defaultdict(list)
+		# one str per attribute name and element type, shared by every element that has it
+		self.names = {}
+
+	@property
+	def line(self):
+		pos = self.match.start(self.match.lastindex or 0) if self.match else self.pos
+		return self.data[:pos].count(b"\n") + 1
+
+	def next_token(self):
+		'''(string, string, string, bracket) with the unmatched parts None. Raises StopIteration at the end of the buffer.'''
+		match = self.match = self.next_match()
+		return match.groups()
+
+	def name(self,raw):
+		name = self.names.get(raw)
+		if name is None: name = self.names[raw] = raw.decode()
+		return name
+
+	def skip_block(self):
+		'''Skips past the bracket closing the one just read.'''
+		depth = 1
+		while depth:
+			bracket = self.next_token()[3]
+			if bracket in (b"{", b"["): depth += 1
+			elif bracket in (b"}", b"]"): depth -= 1
+
+	def read_element_ref(self,owner,name,value,index=-1):
+		if not value:
+			return NullElement()
+		id = uuid.UUID(hex=value.decode())
+		known = self.dm._get_element_by_id(id)
+		if known is not None and not known._is_placeholder:
+			return known
+		self.element_users[id].append((owner, name, index))
+		return known or self.dm.add_element("Missing element",id=id,_is_placeholder=True)
+
+	def read_element_array(self,owner,name,depth):
+		'''Items up to the closing "]": "element" "id" references and inline elements.'''
+		arr = _ElementArray()
+		strings = []
+		def add_references():
+			if len(strings) % 2:
+				raise DatamodelParseError("Element array item without a value")
+			for value in strings[1::2]:
+				arr.append(self.read_element_ref(owner, name, value, len(arr)))
+			strings.clear()
+
+		while True:
+			*values, bracket = self.next_token()
+			if bracket is None:
+				strings.extend([value for value in values if value is not None])
+			elif bracket == b"{": # inline element, the last string is its type
+				if not strings:
+					raise DatamodelParseError("Inline element without a type")
+				elem_type = self.name(strings.pop())
+				add_references()
+				arr.append(self.read_element(elem_type, depth + 1))
+			elif bracket == b"]":
+				add_references()
+				return arr
+			else:
+				raise DatamodelParseError("Unexpected \"{}\" in element array".format(bracket.decode()))
+
+	def read_array(self,type_str):
+		'''Items up to the closing "]".'''
+		arr = _get_array_type(_get_type_from_string(type_str.decode()))()
+		read = self.value_readers[type_str]
+		values = []
+		while True:
+			first, second, third, bracket = self.next_token()
+			if bracket is None:
+				values.append(read(first))
+				if second is not None: # items not separated by commas
+					values.append(read(second))
+					if third is not None: values.append(read(third))
+			elif bracket == b"]":
+				list.extend(arr, values)
+				return arr
+			else:
+				raise DatamodelParseError("Unexpected \"{}\" in array".format(bracket.decode()))
+
+	def on_element_path(self,name,depth):
+		element_path = self.element_path
+		return element_path is None or depth >= len(element_path) or str(name).lower() == element_path[depth]
+
+	def read_element(self,elem_type,depth):
+		'''Reads the body of an element after its opening "{". Returns None if the element is skipped.'''
+		dm = self.dm
+		next_match = self.next_match
+		setitem = dict.__setitem__
+		value_readers = self.value_readers
+		names = self.names
+		prefix = elem_type == "$prefix_element$"
+		elem = dm.prefix_attributes if prefix else None
+		id = name = None
+
+		while True:
+			match = self.match = next_match()
+			key, type_str, value, bracket = match.groups()
+			if bracket is not None:
+				if bracket == b"}": break
+				raise DatamodelParseError("Unexpected \"{}\" in element".format(bracket.decode()))
+			if type_str is None:
+				raise DatamodelParseError("Expected an attribute name and type")
+			name_bytes = key
+			key = names.get(name_bytes)
+			if key is None: key = names[name_bytes] = name_bytes.decode()
+			if value is None: # a bracket, or a value on the next line
+				value, _, _, bracket = self.next_token()
+
+			if key == "id" or key == "name":
+				if value is None:
+					raise DatamodelParseError("Expected a value for \"{}\"".format(key))
+				if key == "id": id = value.decode()
+				elif elem is not None and not prefix: elem.name = value.decode()
+				else: name = value.decode()
+				continue
+
+			if elem is None:
+				if id is None: # nowhere to put attributes that come before the ID
+					if bracket is not None: self.skip_block()
+					continue
+				# created once the ID and (usually) the name are known, before any child elements
+				elem = dm.add_element(name,elem_type,uuid.UUID(hex=id))
+				if not self.on_element_path(elem.name, depth):
+					if bracket is not None: self.skip_block()
+					self.skip_block()
+					return None
+
+			if bracket is None:
+				read = value_readers.get(type_str)
+				if read is not None:
+					value = read(value)
+				elif type_str == b'element':
+					value = self.read_element_ref(elem, key, value)
+				else:
+					value = None
+			elif bracket == b"{": # inline element, type_str is its type
+				value = self.read_element(self.name(type_str), depth + 1)
+			elif bracket == b"[" and type_str == b"element_array":
+				value = self.read_element_array(elem, key, depth)
+			elif bracket == b"[" and type_str.endswith(b"_array"):
+				value = self.read_array(type_str[:-len(b"_array")])
+			else:
+				raise DatamodelParseError("Unexpected \"{}\" after attribute \"{}\"".format(bracket.decode(), key))
+
+			# decoded values are always valid attribute types, and elements already belong to this datamodel
+			setitem(elem, key, value)
+
+		if elem is None and id is not None:
+			elem = dm.add_element(name,elem_type,uuid.UUID(hex=id))
+			if not self.on_element_path(elem.name, depth): return None
+		return elem
+
+	def read(self):
+		try:
+			while True:
+				try:
+					elem_type, extra, _, bracket = self.next_token()
+				except StopIteration:
+					break
+				if elem_type is None or extra is not None:
+					raise DatamodelParseError("Expected an element type")
+				if self.next_token()[3] != b"{":
+					raise DatamodelParseError("Expected \"{\"")
+				self.read_element(self.name(elem_type), 0)
+		except StopIteration:
+			raise DatamodelParseError("Unexpected EOF") from None
+
+		for id, users in self.element_users.items():
+			element = self.dm._get_element_by_id(id)
+			if element._is_placeholder: continue
+			for owner, name, index in users:
+				if index == -1:
+					owner[name] = element
+				else:
+					owner[name][index] = element
+
+def _read_header(in_file):
+	'''(header, encoding, encoding_ver, format, format_ver) from the start of a DMX file'''
+	try:
+		header = ""
+		while not header.endswith(">"):
+			chunk = in_file.read(64)
+			if not chunk: raise EOFError()
+			end = chunk.find(b">" if isinstance(chunk, bytes) else ">")
+			if end != -1: chunk = chunk[:end + 1]
+			header += chunk.decode('ASCII') if isinstance(chunk, bytes) else chunk
+		
+		matches = re.findall(header_format_regex,header)
+		
+		if len(matches) != 1 or len(matches[0]) != 4:
+			matches = re.findall(header_proto2_regex,header)
+			if len(matches) == 1 and len(matches[0]) == 1:
+				return header, "binary_proto", int(matches[0][0]), "undefined_format", 0
+			raise Exception()
+		encoding,encoding_ver, format,format_ver = matches[0]
+		return header, encoding, int(encoding_ver), format, int(format_ver)
+	except Exception as e:
+		raise IOError("Could not read DMX header") from e
+
+def read_header(path):
+	'''(encoding, encoding_ver, format, format_ver) of a DMX file'''
+	with open(path,'rb') as in_file:
+		return _read_header(in_file)[1:]
+
+def load(path = None, in_file = None, element_path = None, lazy = False, element_types = None):
+	'''Reads a DMX file. For binary files:
+	lazy: only the element table is read up front; the attributes of an element are decoded when first accessed.
+	element_types: only elements of these types, everything they reference and the root's own attributes are decoded.
+	The other elements are left without attributes, or decoded on access if lazy.
+	keyvalues2 files are always read in full.'''
 	if bool(path) == bool(in_file):
 		raise ValueError("A path string OR a file object must be provided")
 	if element_path != None and type(element_path) != list:
@@ -813,282 +1702,485 @@ def load(path = None, in_file = None, element_path = None):
 		in_file = open(path,'rb')
 	
 	try:
-		import re
-		
-		try:
-			header = ""
-			while True:
-				header += get_char(in_file)
-				if header.endswith(">"): break
-			
-			matches = re.findall(header_format_regex,header)
-			
-			if len(matches) != 1 or len(matches[0]) != 4:
-				matches = re.findall(header_proto2_regex,header)
-				if len(matches) == 1 and len(matches[0]) == 1:
-					encoding = "binary_proto"
-					encoding_ver = int(matches[0][0])
-					format = "undefined_format"
-					format_ver = 0
-				else:
-					raise Exception()
-			else:
-				encoding,encoding_ver, format,format_ver = matches[0]
-				encoding_ver = int(encoding_ver)
-				format_ver = int(format_ver)
-		except Exception as e:
-			raise IOError("Could not read DMX header") from e
-		
+		header, encoding, encoding_ver, format, format_ver = _read_header(in_file)
 		check_support(encoding,encoding_ver)
 		dm = DataModel(format,format_ver)
 		
-		class LineTracker():
-			line = 0
-
-			def __next__(self):
-				self.line += 1
-
-		line_tracker = LineTracker()
-
-		max_elem_path = len(element_path) + 1 if element_path else 0
-		
 		if encoding == 'keyvalues2':
-			class AttributeReference:
-				def __init__(self,Owner,Name,Index=-1):
-					self.Owner = Owner
-					self.Name = Name
-					self.Index = Index
-			
-			def parse_line(line):
-				return re.findall("\"(.*?)\"",line.strip("\n\t ") )
-				
-			def read_element(elem_type, line_tracker):
-				id = None
-				name = None
-				prefix = elem_type == "$prefix_element$"
-				if prefix: element_chain.append(dm.prefix_attributes)
-				
-				def read_value(name,type_str,kv2_value, index=-1):
-					if type_str == 'element': # make a record; will link everything up once all elements have been read
-						if not kv2_value:
-							return NullElement(kv2_value)#None
-						else:
-							element_users[kv2_value].append(AttributeReference(element_chain[-1], name, index))
-							return dm.add_element("Missing element",id=uuid.UUID(hex=kv2_value),_is_placeholder=True)
-					
-					elif type_str == 'string': return kv2_value
-					elif type_str in ['int',"uint8"]: return int(kv2_value)
-					elif type_str == "uint64": return uint64(kv2_value, 0)
-					elif type_str == 'float': return float(kv2_value)
-					elif type_str == 'bool': return bool(int(kv2_value))
-					elif type_str == 'time': return Time(kv2_value)
-					elif type_str.startswith('vector') or type_str in ['color','quaternion','angle', 'qangle']:
-						return _get_type_from_string(type_str)( [float(i) for i in kv2_value.split(" ")] )
-					elif type_str == 'binary': return Binary(binascii.unhexlify(kv2_value))
-				
-				new_elem = None
-				for line_raw in in_file:
-					next(line_tracker)
-					if line_raw.strip("\n\t, ").endswith("}"):
-						#print("{}- {}".format('\t' * (len(element_chain)-1),element_chain[-1].name))
-						return element_chain.pop()
-					
-					line = parse_line(line_raw)
-					if len(line) == 0:
-						continue
-					
-					if line[0] == 'id':
-						if not prefix:
-							new_elem = dm.add_element(name,elem_type,uuid.UUID(hex=line[2]))
-							element_chain.append(new_elem)
-						continue
-					elif line[0] == 'name':
-						if new_elem: new_elem.name = line[2]
-						else: name = line[2]
-						continue
-					
-					# don't read elements outside the element path
-					if max_elem_path and name and len(dm.elements):
-						if len(element_path):
-							skip = name.lower() != element_path[0].lower()
-						else:
-							skip = len(element_chain) < max_elem_path
-						if skip:
-							child_level = 0
-							for line_raw in in_file:
-								next(line_tracker)
-								if "{" in line_raw: child_level += 1
-								if "}" in line_raw:
-									if child_level == 0: return
-									else: child_level -= 1
-							return
-						elif len(element_path):
-							del element_path[0]
-					
-					if new_elem == None and not prefix:
-						continue
-					
-					if len(line) >= 2:
-						if line[1] == "element_array":
-							arr_name = line[0]
-							arr = _ElementArray()
-							
-							if "[" not in line_raw: # immediate "[" means and empty array; elements must be on separate lines
-								for line in in_file:
-									next(line_tracker)
-									if "[" in line: continue
-									if "]" in line: break
-									line = parse_line(line)
-									
-									if len(line) == 1:
-										arr.append( read_element(line[0], line_tracker) )
-									elif len(line) == 2:
-										arr.append( read_value(arr_name,"element",line[1],index=len(arr)) )
-							
-							element_chain[-1][arr_name] = arr
-							continue
-						
-						elif line[1].endswith("_array"):
-							arr_name = line[0]
-							arr_type_str = line[1].split("_")[0]
-							arr = _get_array_type(_get_type_from_string(arr_type_str))()
-							
-							if "[" in line_raw: # one-line array
-								for item in line[2:]:
-									arr.append(read_value(arr_name,arr_type_str,item))
-								element_chain[-1][arr_name] = arr
-								
-							else: # multi-line array
-								for line in in_file:
-									next(line_tracker)
-									if "[" in line:
-										continue
-									if "]" in line:
-										element_chain[-1][arr_name] = arr
-										break
-										
-									line = parse_line(line)
-									if line:
-										arr.append(read_value(arr_name,arr_type_str,line[0]))
-						
-						elif len(line) == 2: # inline element or binary
-							if line[1] == "binary":
-								num_quotes = 0
-								value = Binary()
-								for line in in_file:
-									next(line_tracker)
-									if "\"" in line:
-										num_quotes += 1
-										if num_quotes == 2: break
-									else:				
-										value = read_value(line[0],line[1], in_file.readline().strip())
-										next(line_tracker)
-							else:
-								value = read_element(line[1], line_tracker)
-							element_chain[-1][line[0]] = value
-						elif len(line) == 3: # ordinary attribute or element ID
-							element_chain[-1][line[0]] = read_value(line[0],line[1],line[2])
-
-				raise IOError("Unexpected EOF")
-			
-			if hasattr(in_file,'mode') and 'b' in in_file.mode: in_file = io.TextIOWrapper(in_file)
-			in_file.seek(len(header))
-			
-			element_chain = []
-			element_users = collections.defaultdict(list)
-			for line in in_file:
-				try:
-					next(line_tracker)
-					line = parse_line(line)
-					if len(line) == 0: continue
-				
-					if len(element_chain) == 0 and len(line) == 1:
-						read_element(line[0], line_tracker)
-				except Exception as ex:
-					raise DatamodelParseError("Parsing of {} failed on line {}".format(path, line_tracker.line)) from ex
-			
-			for element in dm.elements:
-				if element._is_placeholder == True: continue
-				users = element_users[str(element.id)]
-				for user_info in users:
-					if user_info.Index == -1:
-						user_info.Owner[user_info.Name] = element
-					else:
-						user_info.Owner[user_info.Name][user_info.Index] = element
-				
+			data = _map_file(in_file)
+			if isinstance(data, str): data = data.encode('utf-8')
+			reader = _KV2Reader(dm,data,len(header),element_path)
+			try:
+				reader.read()
+			except Exception as ex:
+				raise DatamodelParseError("Parsing of {} failed on line {}".format(path, reader.line)) from ex
+			finally:
+				if isinstance(data, mmap.mmap): data.close()
+
 		elif encoding in ['binary', 'binary_proto']:
-			in_file.seek(2,1) # skip header's line break and null terminator
-
-			def get_value(attr_type,from_array = False):
-				if attr_type == Element:
-					element_index = get_int(in_file)
-					if element_index == -1:
-						return None
-					elif element_index == -2:
-						return dm.add_element("Missing element",id=uuid.UUID(hex=get_str(in_file)),_is_placeholder=True)
-					else:
-						return dm.elements[element_index]
-					
-				elif attr_type == str:		return get_str(in_file) if encoding_ver < 4 or from_array else dm._string_dict.read_string(in_file)
-				elif attr_type == int:		return get_int(in_file)
-				elif attr_type == float:	return get_float(in_file)
-				elif attr_type == bool:		return get_bool(in_file)
-					
-				elif attr_type == Vector2:		return Vector2(get_vec(in_file,2))
-				elif attr_type == Vector3:		return Vector3(get_vec(in_file,3))
-				elif attr_type == Angle:		return Angle(get_vec(in_file,3))
-				elif attr_type == QAngle:		return QAngle(get_vec(in_file,3))
-				elif attr_type == Vector4:		return Vector4(get_vec(in_file,4))
-				elif attr_type == Quaternion:	return Quaternion(get_vec(in_file,4))
-				elif attr_type == Matrix:
-					out = []
-					for i in range(4): out.append(get_vec(in_file,4))
-					return Matrix(out)
-					
-				elif attr_type == Color:		return get_color(in_file)
-				elif attr_type == Time: return Time.from_int(get_int(in_file))
-				elif attr_type == Binary: return Binary(in_file.read(get_int(in_file)))
-					
-				else:
-					raise TypeError("Cannot read attributes of type {}".format(attr_type))
-			
-			def read_element(elem, use_string_dict = True):
-				#print(elem.name,"@",in_file.tell())
-				num_attributes = get_int(in_file)
-				for _ in range(num_attributes):
-					name = dm._string_dict.read_string(in_file) if use_string_dict else get_str(in_file)
-					#print("\t",name,"@",in_file.tell(), end=' ')
-					attr_type = _get_dmx_id_type(encoding,encoding_ver,get_byte(in_file))
-					#print(attr_type)
-					if attr_type in _dmxtypes:
-						elem[name] = get_value(attr_type)
-					elif attr_type in _dmxtypes_array:
-						array_len = get_int(in_file)
-						arr = elem[name] = attr_type()
-						arr_item_type = _get_single_type(attr_type)
-						for x in range(array_len):
-							arr.append( get_value(arr_item_type,from_array=True) )
-
-			# prefix attributes
-			if encoding_ver >= 9:
-				for prefix_elem in range(get_int(in_file)):
-					read_element(dm.prefix_attributes, use_string_dict = False)
-			
-			dm._string_dict = _StringDictionary(encoding,encoding_ver,in_file=in_file)			
-			num_elements = get_int(in_file)
-			
-			# element headers
-			for i in range(num_elements):
-				elemtype = dm._string_dict.read_string(in_file)
-				name = dm._string_dict.read_string(in_file) if encoding_ver >= 4 else get_str(in_file)
-				id = uuid.UUID(bytes_le = in_file.read(16)) # little-endian
-				dm.add_element(name,elemtype,id)			
-			
-			# element bodies
-			for elem in [elem for elem in dm.elements if not elem._is_placeholder]:
-				read_element(elem)
+			data = _map_file(in_file)
+			# skip header's line break and null terminator
+			reader = _BinaryReader(dm,encoding,encoding_ver,data,len(header) + 2)
+			try:
+				reader.read(lazy,element_types)
+			except:
+				reader.close()
+				raise
+			# lazily loaded elements keep the buffer until they are all decoded
+			if not reader.pending: reader.close()
 
 		dm._string_dict = None
 		return dm
 	finally:
 		if in_file: in_file.close()
+
+def patch(path,out_path,edit,element_types = None):
+	'''Rewrites strings of a binary DMX without loading it: element names and string attributes.
+	edit(element_type, attribute_name, value) returns the new value, or None to keep it. attribute_name is "name" for an element's own name.
+	Only elements of element_types are offered, if given. Everything else is copied byte for byte.
+	Returns the number of strings changed.'''
+	if os.path.exists(out_path) and os.path.samefile(path, out_path):
+		raise ValueError("Cannot patch a DMX into itself")
+	with open(path,'rb') as in_file:
+		header, encoding, encoding_ver, format, format_ver = _read_header(in_file)
+		check_support(encoding,encoding_ver)
+		if encoding not in ['binary', 'binary_proto']:
+			raise ValueError("Only binary DMX can be patched, not {}".format(encoding))
+		data = _map_file(in_file)
+
+	patcher = _BinaryPatcher(encoding,encoding_ver,data,len(header) + 2)
+	try:
+		edits = patcher.find_edits(edit,element_types)
+		with open(out_path,'wb',buffering=1 << 20) as out:
+			pos = 0
+			for start, end, replacement in edits:
+				out.write(patcher.view[pos:start])
+				out.write(replacement)
+				pos = end
+			out.write(patcher.view[pos:])
+	finally:
+		patcher.close()
+	return patcher.changed
+
+if __name__ == '__main__':
+	import unittest, tempfile, os
+
+	def _binary_v5_dmx():
+		strings = ["DmElement", "root", "DmeParticleSystemDefinition", "child", "children", "radius", "material", "tint", "origin", "names"]
+		ref = lambda s: struct.pack("<i", strings.index(s))
+		out = _encode_binary_string(header_format.format("binary", 5, "pcf", 2) + "\n")
+		out += struct.pack("<i", len(strings)) + b''.join(_encode_binary_string(s) for s in strings)
+		out += struct.pack("<i", 2)
+		out += ref("DmElement") + ref("root") + uuid.UUID(int=1).bytes_le
+		out += ref("DmeParticleSystemDefinition") + ref("child") + uuid.UUID(int=2).bytes_le
+		out += struct.pack("<i", 1) + ref("children") + b'\x0f' + struct.pack("<iii", 2, 1, -1)
+		out += struct.pack("<i", 5)
+		out += ref("radius") + b'\x03' + struct.pack("<f", 2.5)
+		out += ref("material") + b'\x05' + ref("child")
+		out += ref("tint") + b'\x08' + bytes((255, 128, 0, 255))
+		out += ref("origin") + b'\x0a' + struct.pack("<3f", 1, 2, 3)
+		out += ref("names") + b'\x13' + struct.pack("<i", 2) + b'a\0bb\0'
+		return out
+
+	class Test_BinaryLoad(unittest.TestCase):
+		def check(self, dm):
+			root, child = dm.elements
+			self.assertIs(dm.root, root)
+			self.assertEqual((child.name, child.type, child.id), ("child", "DmeParticleSystemDefinition", uuid.UUID(int=2)))
+			self.assertEqual(root["children"], [child, None])
+			self.assertIs(type(root["children"]), _ElementArray)
+			self.assertEqual(child["radius"], 2.5)
+			self.assertEqual(child["material"], "child")
+			self.assertEqual((type(child["tint"]), child["tint"]), (Color, [255, 128, 0, 255]))
+			self.assertEqual((type(child["origin"]), child["origin"]), (Vector3, [1.0, 2.0, 3.0]))
+			self.assertEqual((type(child["names"]), child["names"]), (_StrArray, ["a", "bb"]))
+
+		def test_buffer(self):
+			self.check(load(in_file=io.BytesIO(_binary_v5_dmx())))
+
+		def test_mapped_file(self):
+			with tempfile.TemporaryDirectory() as tmp:
+				path = os.path.join(tmp, "test.pcf")
+				with open(path, 'wb') as fp:
+					fp.write(_binary_v5_dmx())
+				self.check(load(path))
+
+		def test_truncated(self):
+			with self.assertRaises((DatamodelParseError, struct.error)):
+				load(in_file=io.BytesIO(_binary_v5_dmx()[:-4]))
+
+	class Test_BinaryArrays(unittest.TestCase):
+		def test_round_trip(self):
+			arrays = [
+				make_array([1, -2, 3], int),
+				make_array([0.5, 1.25], float),
+				make_array([True, False, True], bool),
+				make_array([Time(0.5), Time(2)], Time),
+				make_array([[1, 2], [3, 4]], Vector2),
+				make_array([[1, 2, 3]] * 3, Vector3),
+				make_array([[0, 90, 0]], Angle),
+				make_array([[0, 0, 0, 1], [0.5, 0.5, 0.5, 0.5]], Quaternion),
+				make_array([[255, 0, 128, 255]], Color),
+				make_array([Matrix([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 1, 0], [0, 0, 0, 1]])], Matrix),
+				make_array([], float),
+			]
+			dm = DataModel("test", 1)
+			dm.encoding, dm.encoding_ver, dm.out = "binary", 5, io.BytesIO()
+			for arr in arrays:
+				dm._write(arr)
+
+			reader = _BinaryReader(dm, "binary", 5, dm.out.getvalue(), 0)
+			for arr in arrays:
+				array_type, read = reader.get_attr_reader(_get_dmx_type_id("binary", 5, type(arr)))
+				decoded = read(reader.read_int())
+				self.assertIs(array_type, type(arr))
+				self.assertEqual(decoded, arr)
+				self.assertEqual([type(item) for item in decoded], [type(item) for item in arr])
+			self.assertEqual(reader.pos, len(dm.out.getvalue()))
+
+	class Test_Registry(unittest.TestCase):
+		def test_find(self):
+			dm = DataModel("test", 1)
+			a = dm.add_element("a", "DmeGameModel", id="a")
+			b = dm.add_element("b", "DmeGameSound", id="b")
+			c = dm.add_element("c", "DmeGameModel", id="c")
+			self.assertEqual(dm.find_elements(elemtype="DmeGameModel"), [a, c])
+			self.assertEqual(dm.find_elements(id=str(b.id)), [b])
+			self.assertIsNone(dm.find_elements(elemtype="DmeProjectedLight"))
+
+			a.type = "DmeGameSound"
+			c.name = "a"
+			self.assertEqual(dm.find_elements(elemtype="DmeGameSound"), [a, b])
+			self.assertEqual(dm.find_elements(name="a"), [a, c])
+			self.assertEqual(dm.find_elements(name="a", elemtype="DmeGameSound"), [a, a, b, c])
+
+			d = DataModel("other", 1).add_element("d", "DmeGameModel", id="d")
+			b["model"] = d
+			self.assertEqual(dm.find_elements(elemtype="DmeGameModel"), [c, d])
+
+		def test_collision(self):
+			dm = DataModel("test", 1)
+			placeholder = dm.add_element("Missing element", id="a", _is_placeholder=True)
+			self.assertIs(dm.find_elements(id=placeholder.id)[0], placeholder)
+			real = dm.add_element("a", id="a")
+			self.assertIs(dm.find_elements(id=real.id)[0], real)
+			with self.assertRaises(IDCollisionError):
+				dm.add_element("a again", id="a")
+
+	class Test_BinaryWrite(unittest.TestCase):
+		@staticmethod
+		def make():
+			dm = DataModel("test", 1)
+			root = dm.add_element("root", id="root")
+			child = dm.add_element("child", "DmeChild", id="child")
+			shared = dm.add_element("shared", id="shared")
+			root["children"] = make_array([child, shared], Element)
+			root["label"] = "root"
+			child["shared"] = shared
+			child["empty"] = None
+			child["i"] = 3
+			child["v"] = Vector3([1, 2, 3])
+			child["s"] = make_array(["a", "b"], str)
+			shared["color"] = Color([255, 0, 128, 255])
+			return dm
+
+		def round_trip(self, dm, encoding_ver):
+			return load(in_file=io.BytesIO(dm.echo("binary", encoding_ver)))
+
+		def test_round_trip(self):
+			for encoding_ver in (2, 3, 4, 5, 9):
+				dm = self.make()
+				out = self.round_trip(dm, encoding_ver)
+				self.assertEqual([(e.id, e.name, e.type) for e in out.elements], [(e.id, e.name, e.type) for e in dm.elements])
+				for elem, loaded in zip(dm.elements, out.elements):
+					self.assertEqual(dict(loaded), dict(elem))
+				self.assertIs(out.elements[1]["shared"], out.elements[2])
+
+		def test_placeholder_and_prefix(self):
+			dm = self.make()
+			missing = dm.add_element("Missing element", id="missing", _is_placeholder=True)
+			dm.root["missing"] = missing
+			dm.root["big"] = uint64(2**40)
+			dm.prefix_attributes["asset_version"] = 2
+			out = self.round_trip(dm, 9)
+			self.assertEqual(len(out.elements), 4)
+			self.assertTrue(out.root["missing"]._is_placeholder)
+			self.assertEqual(out.root["missing"].id, missing.id)
+			self.assertEqual(out.root["big"], 2**40)
+			self.assertEqual(dict(out.prefix_attributes), {"asset_version": 2})
+
+		def test_write(self):
+			dm = self.make()
+			with tempfile.TemporaryDirectory() as tmp:
+				path = Path(tmp) / "out.dmx"
+				dm.write(path, "binary", 5)
+				self.assertEqual(path.read_bytes(), dm.echo("binary", 5))
+
+	class Test_Patch(unittest.TestCase):
+		def test_patch(self):
+			def edit(elemtype, name, value):
+				return {"name": "renamed", "model": value.replace(".mdl", ".vmdl")}.get(name)
+			for encoding_ver in (2, 3, 4, 5, 9):
+				dm = Test_BinaryWrite.make()
+				dm.elements[1]["model"] = "models/a.mdl"
+				dm.root["model"] = "models/b.mdl"
+				with tempfile.TemporaryDirectory() as tmp:
+					path, out_path = Path(tmp) / "in.dmx", Path(tmp) / "out.dmx"
+					dm.write(path, "binary", encoding_ver)
+					self.assertEqual(patch(path, out_path, edit, element_types=["DmeChild"]), 2)
+					out = load(out_path)
+				child = dm.elements[1]
+				child.name = "renamed"
+				child["model"] = "models/a.vmdl"
+				self.assertEqual([(e.name, dict(e)) for e in out.elements], [(e.name, dict(e)) for e in dm.elements])
+
+		def test_untouched(self):
+			data = Test_LazyLoad.make_session()
+			with tempfile.TemporaryDirectory() as tmp:
+				path, out_path = Path(tmp) / "in.dmx", Path(tmp) / "out.dmx"
+				path.write_bytes(data)
+				self.assertEqual(patch(path, out_path, lambda *args: None), 0)
+				self.assertEqual(out_path.read_bytes(), data)
+				with self.assertRaises(ValueError):
+					patch(path, path, lambda *args: None)
+				path.write_text(load(in_file=io.BytesIO(data)).echo("keyvalues2", 1))
+				with self.assertRaises(ValueError):
+					patch(path, out_path, lambda *args: None)
+
+	class Test_KV2Load(unittest.TestCase):
+		def test_round_trip(self):
+			dm = Test_BinaryWrite.make()
+			dm.root["m"] = Matrix([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 1, 0], [0, 0, 0, 1]])
+			dm.root["bin"] = Binary(b"\x01\x02")
+			dm.root["t"] = make_array([Time(0.5)], Time)
+			dm.prefix_attributes.type = "$prefix_element$"
+			dm.prefix_attributes["asset_version"] = 2
+			text = dm.echo("keyvalues2", 1)
+			for data in (text, text.encode()):
+				out = load(in_file=io.StringIO(data) if isinstance(data, str) else io.BytesIO(data))
+				# the forward reference to "shared" leaves a placeholder behind
+				loaded = [e for e in out.elements if not e._is_placeholder]
+				self.assertEqual([(e.id, e.name, e.type) for e in loaded], [(e.id, e.name, e.type) for e in dm.elements])
+				for elem, loaded_elem in zip(dm.elements, loaded):
+					# null element references come back as NullElement
+					self.assertEqual({k: None if type(v) == NullElement else v for k, v in loaded_elem.items()}, dict(elem))
+				self.assertIs(loaded[1]["shared"], loaded[2])
+				self.assertEqual(dict(out.prefix_attributes), {"asset_version": 2})
+
+		def test_layout(self):
+			kv2 = header_format.format("keyvalues2", 1, "test", 1) + '''
+"DmElement"
+{
+	"id" "elementid" "00000000-0000-0000-0000-000000000001"
+	"name" "string" "root"
+	"later" "element" "00000000-0000-0000-0000-000000000002"
+	"none" "element" ""
+	"floats" "float_array" ["1", "2.5"]
+	"ints" "int_array"
+	[
+		"1",
+		"2"
+	]
+	"data" "binary"
+	"
+	0102
+	03
+	"
+	"children" "element_array"
+	[
+		"element" "00000000-0000-0000-0000-000000000002",
+		"DmElement"
+		{
+			"id" "elementid" "00000000-0000-0000-0000-000000000003"
+			"name" "string" "inline"
+		}
+	]
+}
+"DmElement"
+{
+	"id" "elementid" "00000000-0000-0000-0000-000000000002"
+	"name" "string" "later"
+}
+'''
+			dm = load(in_file=io.StringIO(kv2))
+			root, inline, later = [e for e in dm.elements if not e._is_placeholder]
+			self.assertEqual([e.name for e in (root, inline, later)], ["root", "inline", "later"])
+			self.assertIs(root["later"], later)
+			self.assertIsInstance(root["none"], NullElement)
+			self.assertEqual(root["floats"], [1.0, 2.5])
+			self.assertEqual(root["ints"], [1, 2])
+			self.assertEqual(root["data"], b"\x01\x02\x03")
+			self.assertEqual(root["children"], [later, inline])
+			self.assertIs(root["children"][0], later)
+
+		def test_error_line(self):
+			kv2 = header_format.format("keyvalues2", 1, "test", 1) + '\n"DmElement"\n{\n\t"id" "elementid" "00000000-0000-0000-0000-000000000001"\n\t"x" "int" "one"\n}\n'
+			with self.assertRaisesRegex(DatamodelParseError, "line 5"):
+				load(in_file=io.StringIO(kv2))
+			with self.assertRaisesRegex(DatamodelParseError, "line 4"):
+				load(in_file=io.StringIO(kv2[:kv2.index('\t"x"')]))
+
+	class Test_KV2Write(unittest.TestCase):
+		@staticmethod
+		def make(count):
+			dm = DataModel("vmap", 29)
+			dm.prefix_attributes.type = "$prefix_element$"
+			root = dm.add_element("", "CMapRootElement", id="root")
+			entities = []
+			for i in range(count):
+				entity = dm.add_element("entity{}".format(i), "CMapEntity", id="entity{}".format(i))
+				entity["origin"] = Vector3([i, 0, 0])
+				entity["properties"] = dm.add_element("", "EditGameClassProps", id="props{}".format(i))
+				entity["properties"]["classname"] = "info_target"
+				entities.append(entity)
+			root["children"] = make_array(entities, Element)
+			root["shared"] = entities[0]["properties"]["target"] = entities[1]
+			return dm
+
+		def test_write(self):
+			dm = self.make(2000) # more lines than are held back before writing
+			text = dm.echo("keyvalues2", 4)
+			self.assertEqual(dm.root.get_kv2(), text[text.index('"CMapRootElement"'):text.index("\n\n")])
+			with tempfile.TemporaryDirectory() as tmp:
+				path = Path(tmp) / "out.vmap"
+				dm.write(path, "keyvalues2", 4)
+				self.assertEqual(path.read_bytes(), text.encode())
+			out = load(in_file=io.StringIO(text))
+			self.assertEqual(len(out.root["children"]), 2000)
+			self.assertIs(out.root["shared"], out.root["children"][1])
+			self.assertEqual(out.root["children"][5]["properties"]["classname"], "info_target")
+
+		def test_threads(self):
+			from concurrent.futures import ThreadPoolExecutor
+			models = [self.make(200 + i) for i in range(4)]
+			expected = [dm.echo("keyvalues2", 4) for dm in models]
+			with ThreadPoolExecutor(4) as pool:
+				self.assertEqual(list(pool.map(lambda dm: dm.echo("keyvalues2", 4), models)), expected)
+
+	class Test_Compact(unittest.TestCase):
+		def test_memory(self):
+			'''Against the old representation: OrderedDict elements, and values with an instance dictionary each'''
+			import tracemalloc
+			class LegacyElement(collections.OrderedDict): pass
+			class LegacyVector(list): pass
+			class LegacyTime(float): pass
+			def legacy(i):
+				elem = LegacyElement()
+				elem._name, elem._type, elem._id, elem._is_placeholder, elem._datamodels = "e{}".format(i), "DmeDag", uuid.uuid4(), False, {None}
+				return elem
+			def build(make_element, make_vector, make_time):
+				out = []
+				for i in range(5000):
+					elem = make_element(i)
+					for name in ("position", "velocity", "scale"):
+						dict.__setitem__(elem, name, make_vector([i, i + 1.0, i + 2.0]))
+					dict.__setitem__(elem, "time", make_time(i / 30))
+					out.append(elem)
+				return out
+			def traced(*args):
+				tracemalloc.start()
+				try:
+					out = build(*args)
+					return tracemalloc.get_traced_memory()[0]
+				finally:
+					tracemalloc.stop()
+			compact = traced(lambda i: Element(None, "e{}".format(i), "DmeDag"), Vector3, Time)
+			old = traced(legacy, lambda l: LegacyVector([float(f) for f in l]), LegacyTime)
+			self.assertLess(compact, old * 0.8)
+
+		def test_mapping(self):
+			elem = DataModel("test", 1).add_element("root")
+			for name in "abcd": elem[name] = name
+			elem.move_to_end("a")
+			elem.move_to_end("d", last=False)
+			self.assertEqual(list(elem), ["d", "b", "c", "a"])
+			self.assertEqual(elem.popitem(), ("a", "a"))
+			self.assertEqual(elem.popitem(last=False), ("d", "d"))
+			self.assertEqual(list(elem.items()), [("b", "b"), ("c", "c")])
+			self.assertFalse(hasattr(elem, "__dict__"))
+			self.assertFalse(hasattr(Vector3([0, 0, 0]), "__dict__"))
+
+		def test_update(self):
+			dm = DataModel("test", 1)
+			elem = dm.add_element("root", id="root")
+			other = DataModel("other", 1).add_element("child", id="child")
+			elem.update({"child": other}, n=1)
+			self.assertEqual(dm.find_elements(name="child"), [other])
+			elem |= {"v": Vector3([1, 2, 3])}
+			self.assertEqual(elem.setdefault("n", 2), 1)
+			for bad in (lambda: elem.update({"x": [1, 2, 3]}), lambda: elem.update(name="x"), lambda: elem.setdefault("x", [1])):
+				self.assertRaises((ValueError, KeyError), bad)
+			self.assertNotIn("x", elem)
+			copy = elem.copy()
+			self.assertIsInstance(copy, Element)
+			self.assertNotEqual(copy.id, elem.id)
+			self.assertEqual(dict(copy), dict(elem))
+			self.assertEqual(dm.find_elements(name="root"), [elem, copy])
+
+	class Test_LazyLoad(unittest.TestCase):
+		@staticmethod
+		def make_session():
+			'''A few models, and a lot of animation data in channels that nothing else references'''
+			dm = DataModel("test", 1)
+			root = dm.add_element("session", "DmElement", id="session")
+			models = [dm.add_element("model{}".format(i), "DmeGameModel", id="model{}".format(i)) for i in range(4)]
+			channels = []
+			for i in range(10):
+				channel = dm.add_element("channel{}".format(i), "DmeChannel", id="channel{}".format(i))
+				channel["times"] = make_array([Time(n / 30) for n in range(2000)], Time)
+				channel["values"] = make_array([Vector3([n, n, n]) for n in range(2000)], Vector3)
+				channels.append(channel)
+			for model in models:
+				model["modelName"] = "models/{}.mdl".format(model.name)
+				model["transform"] = dm.add_element("transform", "DmeTransform", id=model.name + "transform")
+				model["transform"]["position"] = Vector3([1, 2, 3])
+			root["models"] = make_array(models, Element)
+			root["channels"] = make_array(channels, Element)
+			return dm.echo("binary", 5)
+
+		@staticmethod
+		def peak(data, **kwargs):
+			import tracemalloc
+			tracemalloc.start()
+			try:
+				dm = load(in_file=io.BytesIO(data), **kwargs)
+				return dm, tracemalloc.get_traced_memory()[1]
+			finally:
+				tracemalloc.stop()
+
+		def test_element_types(self):
+			data = self.make_session()
+			full, full_peak = self.peak(data)
+			dm, peak = self.peak(data, element_types=["DmeGameModel"])
+			self.assertLess(peak, full_peak / 4)
+			models = dm.find_elements(elemtype="DmeGameModel")
+			self.assertEqual([dict(model) for model in models], [dict(model) for model in full.find_elements(elemtype="DmeGameModel")])
+			self.assertEqual(models[0]["transform"]["position"], [1, 2, 3])
+			self.assertEqual(list(dm.root.keys()), ["models", "channels"])
+			self.assertEqual(len(dm.root["channels"][0]), 0)
+
+		def test_lazy(self):
+			data = self.make_session()
+			full, full_peak = self.peak(data)
+			dm, peak = self.peak(data, lazy=True)
+			self.assertLess(peak, full_peak / 4)
+			channel = dm.find_elements(name="channel3")[0]
+			self.assertEqual(channel["values"][10], [10, 10, 10])
+			self.assertEqual(dict(channel), dict(full.find_elements(name="channel3")[0]))
+			self.assertEqual(dm.echo("binary", 5), full.echo("binary", 5))
+			model = dm.find_elements(name="model1")[0]
+			model.update(modelName="models/other.mdl")
+			self.assertEqual(list(model.keys()), ["modelName", "transform"])
+			self.assertEqual(model["transform"]["position"], [1, 2, 3])
+
+		def test_lazy_write_to_source(self):
+			data = self.make_session()
+			with tempfile.TemporaryDirectory() as tmp:
+				path = os.path.join(tmp, "session.dmx")
+				with open(path, 'wb') as file: file.write(data)
+				dm = load(path, lazy=True)
+				dm.write(path, "binary", 5)
+				with open(path, 'rb') as file:
+					self.assertEqual(file.read(), load(in_file=io.BytesIO(data)).echo("binary", 5))
+
+	unittest.main()
@@ -2,13 +2,24 @@
 
 # cppkeyvalues is nice for parsing, but we need an actual python object to work efficiently
 
-from collections import Counter
+import re
+import marshal
+from os import stat, replace, getpid
+from os.path import abspath
+from shutil import rmtree
+from hashlib import blake2b
+from time import perf_counter
+from sys import intern
+from threading import Lock, get_ident
+from collections import Counter, OrderedDict
 from typing import Any, Optional, Union
 from pathlib import Path
 try:
-    from cppkeyvalues import KeyValues, CUtlBuffer, CKeyValuesTokenReader
+    from cppkeyvalues import KeyValues, CUtlBuffer, CKeyValuesTokenCursor, KeyValuesError
+    from typedvalues import TypedValue
 except ImportError:
-    from shared.cppkeyvalues import KeyValues, CUtlBuffer, CKeyValuesTokenReader
+    from shared.cppkeyvalues import KeyValues, CUtlBuffer, CKeyValuesTokenCursor, KeyValuesError
+    from shared.typedvalues import TypedValue
 
 
 class VDFDict(dict):
@@ -17,6 +28,14 @@ class VDFDict(dict):
     
     Copyright (c) 2015 Rossen Georgiev <rossen@rgp.io>
     """
+    # Entries live in two parallel lists in insert order. A deleted entry leaves a hole (key None)
+    # that is compacted away once holes make up half of the lists.
+    # __index maps each key to the position of its entry, or to a list of positions for duplicates.
+    # __ci_index maps lowercased keys to lists of positions. Built on the first *_ci call.
+    # The underlying dict storage mirrors each key's first value, what ``self[key]`` returns, so C code that reads
+    # dicts directly (the json encoder checks the native size before calling items()) doesn't see an empty mapping.
+    __slots__ = ('__keys', '__values', '__index', '__holes', '__ci_index')
+
     def __init__(self, data=None):
         """
         This is a dictionary that supports duplicate keys and preserves insert order
@@ -29,8 +48,11 @@ class VDFDict(dict):
 
         When the ``key`` is ``str``, instead of tuple, set will create a duplicate and get will look up ``(0, key)``
         """
-        self.__omap = []
-        self.__kcount = Counter()
+        self.__keys: list[Optional[str]] = []
+        self.__values: list = []
+        self.__index: dict[str, Union[int, list[int]]] = {}
+        self.__holes = 0
+        self.__ci_index: Optional[dict[str, list[int]]] = None
 
         if data is not None:
             if not isinstance(data, (list, dict)):
@@ -40,8 +62,11 @@ class VDFDict(dict):
     def __repr__(self):
         return f"{self.__class__.__name__}({repr(list(self.iteritems()))})"
 
+    def __reduce__(self):
+        return self.__class__, (self.items(),)
+
     def __len__(self):
-        return len(self.__omap)
+        return len(self.__keys) - self.__holes
 
     def _verify_key_tuple(self, key):
         if len(key) != 2:
@@ -60,64 +85,135 @@ class VDFDict(dict):
             raise TypeError("Expected key to be a str or tuple, got %s" % type(key))
         return key
 
+    def __position(self, key) -> int:
+        "Position of the entry for ``key`` in the entry lists. KeyError if missing"
+        if isinstance(key, str):
+            pos = self.__index[key]
+            return pos if pos.__class__ is int else pos[0]
+        dup_idx, skey = self._normalize_key(key)
+        pos = self.__index.get(skey)
+        if pos is not None:
+            if pos.__class__ is int:
+                if dup_idx == 0:
+                    return pos
+            elif 0 <= dup_idx < len(pos):
+                return pos[dup_idx]
+        raise KeyError(key)
+
     def __setitem__(self, k, v) -> None:
-        if k in self:
-            return super().__setitem__(self._normalize_key(k), v)
-        self.add(k, v)
+        try:
+            self.__set_value(self.__position(k), v)
+        except KeyError:
+            self.add(k, v)
+
+    def __set_value(self, pos: int, value):
+        self.__values[pos] = value
+        key = self.__keys[pos]
+        first = self.__index[key]
+        if pos == (first if first.__class__ is int else first[0]):
+            dict.__setitem__(self, key, value)
 
     def add(self, key, value):
+        if isinstance(value, dict) and not isinstance(value, VDFDict):
+            value = VDFDict(value)
         if isinstance(key, str):
-            key = (self.__kcount[key], key)
-            self.__omap.append(key)
+            key = intern(key)
+            pos = len(self.__keys)
+            self.__keys.append(key)
+            self.__values.append(value)
+            existing = self.__index.get(key)
+            if existing is None:
+                self.__index[key] = pos
+                dict.__setitem__(self, key, value)
+            elif existing.__class__ is int:
+                self.__index[key] = [existing, pos]
+            else:
+                existing.append(pos)
+            if self.__ci_index is not None:
+                self.__ci_index.setdefault(key.lower(), []).append(pos)
         elif isinstance(key, tuple):
             self._verify_key_tuple(key)
             if key not in self:
                 raise KeyError("%s doesn't exist" % repr(key))
+            self.__set_value(self.__position(key), value)
         else:
             raise TypeError("Expected either a str or tuple for key, got %s, %s" % (type(key), key))
-        if isinstance(value, dict):
-            value = VDFDict(value)
-        super().__setitem__(key, value)
-        self.__kcount[key[1]] += 1
 
     def __getitem__(self, key):
-        return super().__getitem__(self._normalize_key(key))
+        return self.__values[self.__position(key)]
 
     def __delitem__(self, key):
-        key = self._normalize_key(key)
-        result = super().__delitem__(key)
-
-        start_idx = self.__omap.index(key)
-        del self.__omap[start_idx]
-
-        dup_idx, skey = key
-        self.__kcount[skey] -= 1
-        tail_count = self.__kcount[skey] - dup_idx
-
-        if tail_count > 0:
-            for idx in range(start_idx, len(self.__omap)):
-                if self.__omap[idx][1] == skey:
-                    oldkey = self.__omap[idx]
-                    newkey = (dup_idx, skey)
-                    super().__setitem__(newkey, self[oldkey])
-                    super().__delitem__(oldkey)
-                    self.__omap[idx] = newkey
-
-                    dup_idx += 1
-                    tail_count -= 1
-                    if tail_count == 0:
-                        break
-
-        if self.__kcount[skey] == 0:
-            del self.__kcount[skey]
-
-        return result
+        pos = self.__position(key)
+        dup_idx, skey = self._normalize_key(key)
+
+        # later duplicates shift down by one index
+        positions = self.__index[skey]
+        if positions.__class__ is int:
+            del self.__index[skey]
+            dict.__delitem__(self, skey)
+        else:
+            del positions[dup_idx]
+            if dup_idx == 0:
+                dict.__setitem__(self, skey, self.__values[positions[0]])
+            if len(positions) == 1:
+                self.__index[skey] = positions[0]
+
+        self.__remove_entry(pos)
+        self.__maybe_compact()
+
+    def __remove_entry(self, pos: int):
+        "Leave a hole at ``pos``. The caller updates the index, then calls ``__maybe_compact``"
+        keys, values = self.__keys, self.__values
+        if self.__ci_index is not None:
+            ci_key = keys[pos].lower()
+            positions = self.__ci_index[ci_key]
+            positions.remove(pos)
+            if not positions:
+                del self.__ci_index[ci_key]
+        if pos == len(keys) - 1:
+            keys.pop()
+            values.pop()
+            while keys and keys[-1] is None:
+                keys.pop()
+                values.pop()
+                self.__holes -= 1
+            return
+        keys[pos] = None
+        values[pos] = None
+        self.__holes += 1
+
+    def __maybe_compact(self):
+        if self.__holes > 8 and self.__holes * 2 > len(self.__keys):
+            self.__compact()
+
+    def __compact(self):
+        "Drop the holes and rebuild the index"
+        keys, values = self.__keys, self.__values
+        live = [pos for pos, key in enumerate(keys) if key is not None]
+        self.__keys = [keys[pos] for pos in live]
+        self.__values = [values[pos] for pos in live]
+        self.__holes = 0
+        self.__ci_index = None
+        self.__index = index = {}
+        for pos, key in enumerate(self.__keys):
+            existing = index.get(key)
+            if existing is None:
+                index[key] = pos
+                dict.__setitem__(self, key, self.__values[pos])
+            elif existing.__class__ is int:
+                index[key] = [existing, pos]
+            else:
+                existing.append(pos)
 
     def __iter__(self):
         return iter(self.iterkeys())
 
     def __contains__(self, key):
-        return super().__contains__(self._normalize_key(key))
+        try:
+            self.__position(key)
+        except KeyError:
+            return False
+        return True
 
     def __eq__(self, other):
         if isinstance(other, VDFDict):
@@ -129,12 +225,32 @@ class VDFDict(dict):
         return not self.__eq__(other)
 
     def clear(self):
-        super().clear()
-        self.__kcount.clear()
-        self.__omap = list()
-
-    def get(self, key, *args):
-        return super().get(self._normalize_key(key), *args)
+        dict.clear(self)
+        self.__keys = []
+        self.__values = []
+        self.__index = {}
+        self.__holes = 0
+        self.__ci_index = None
+
+    def copy(self, nested=False):
+        "Shallow copy, keeps the type. ``nested`` also copies every nested ``VDFDict``, other values stay shared"
+        rv = self.__class__.__new__(self.__class__)
+        VDFDict.__init__(rv)
+        rv.__keys = [key for key in self.__keys if key is not None]
+        rv.__values = [value for key, value in zip(self.__keys, self.__values) if key is not None]
+        rv.__compact()
+        if nested:
+            values = rv.__values
+            for pos, value in enumerate(values):
+                if isinstance(value, VDFDict):
+                    values[pos] = value.copy(nested=True)
+        return rv
+
+    def get(self, key, default=None):
+        try:
+            return self.__values[self.__position(key)]
+        except KeyError:
+            return default
 
     def setdefault(self, key, default=None):
         if key not in self:
@@ -148,10 +264,10 @@ class VDFDict(dict):
         return value
 
     def popitem(self):
-        if not self.__omap:
+        if not len(self):
             raise KeyError("VDFDict is empty")
-        key = self.__omap[-1]
-        return key[1], self.pop(key)
+        key = self.__keys[-1]
+        return key, self.pop((len(self.get_all_for(key)) - 1, key))
 
     def update(self, data=None, overwrite=False):
         if isinstance(data, dict):
@@ -167,19 +283,28 @@ class VDFDict(dict):
                 update_func(key, value)
 
     def iterkeys(self):
-        return (key[1] for key in self.__omap)
+        return (key for key in self.__keys if key is not None)
 
     def keys(self):
         return list(self.iterkeys())
 
     def itervalues(self):
-        return (self[key] for key in self.__omap)
+        return (value for key, value in zip(self.__keys, self.__values) if key is not None)
 
     def values(self):
         return list(self.itervalues())
 
     def iteritems(self, indexed_keys = False):
-        return ((key if indexed_keys else key[1], self[key]) for key in self.__omap)
+        if indexed_keys:
+            return self.__iter_indexed_items()
+        return ((key, value) for key, value in zip(self.__keys, self.__values) if key is not None)
+
+    def __iter_indexed_items(self):
+        seen = Counter()
+        for key, value in zip(self.__keys, self.__values):
+            if key is not None:
+                yield (seen[key], key), value
+                seen[key] += 1
 
     def items(self, indexed_keys = False):
         return list(self.iteritems(indexed_keys))
@@ -188,51 +313,290 @@ class VDFDict(dict):
         """ Returns all values of the given key """
         if not isinstance(key, str):
             raise TypeError("Key needs to be a string.")
-        return [self[(idx, key)] for idx in range(self.__kcount[key])]
+        positions = self.__index.get(key, ())
+        if positions.__class__ is int:
+            return [self.__values[positions]]
+        return [self.__values[pos] for pos in positions]
 
     def remove_all_for(self, key):
         """ Removes all items with the given key """
         if not isinstance(key, str):
             raise TypeError("Key need to be a string.")
 
-        for idx in range(self.__kcount[key]):
-            super().__delitem__((idx, key))
-
-        self.__omap = list(filter(lambda x: x[1] != key, self.__omap))
+        positions = self.__index.pop(key, ())
+        dict.pop(self, key, None)
+        if positions.__class__ is int:
+            positions = (positions,)
+        for pos in reversed(positions):
+            self.__remove_entry(pos)
+        self.__maybe_compact()
 
-        del self.__kcount[key]
+    def __ci_positions(self, key: str):
+        if not isinstance(key, str):
+            raise TypeError("Key needs to be a string.")
+        if self.__ci_index is None:
+            self.__ci_index = ci_index = {}
+            for pos, k in enumerate(self.__keys):
+                if k is not None:
+                    ci_index.setdefault(k.lower(), []).append(pos)
+        return self.__ci_index.get(key.lower(), ())
+
+    def get_ci(self, key, default=None):
+        """ ``get`` ignoring case. Returns the first value whose key matches """
+        positions = self.__ci_positions(key)
+        return self.__values[positions[0]] if positions else default
+
+    def contains_ci(self, key):
+        """ ``in`` ignoring case """
+        return bool(self.__ci_positions(key))
+
+    def get_all_for_ci(self, key):
+        """ Returns all values whose key matches the given key ignoring case """
+        return [self.__values[pos] for pos in self.__ci_positions(key)]
+
+    def set_ci(self, key, value):
+        """ Sets the first value whose key matches ignoring case, keeping that key's spelling. Adds ``key`` if none does """
+        positions = self.__ci_positions(key)
+        if positions:
+            self.__set_value(positions[0], value)
+        else:
+            self.add(key, value)
 
     def has_duplicates(self):
         """
         Returns ``True`` if the dict contains keys with duplicates.
         Recurses through any all keys with value that is ``VDFDict``.
         """
-        for n in getattr(self.__kcount, 'itervalues')():
-            if n != 1:
+        for positions in self.__index.values():
+            if positions.__class__ is not int:
                 return True
 
-        def dict_recurse(obj):
-            for v in getattr(obj, 'itervalues')():
-                if isinstance(v, VDFDict) and v.has_duplicates():
-                    return True
-                elif isinstance(v, dict):
-                    return dict_recurse(v)
-            return False
-
-        return dict_recurse(self)
-    def ToString(self, level = 0, quoteKeys=False):
-        line_indent = '\t' * level
-        s = ""
-        s += "\n" + line_indent + '{\n'
-        for key, value in self.items():
+        return any(isinstance(v, VDFDict) and v.has_duplicates() for v in self.itervalues())
+    def iter_lines(self, level = 0, quoteKeys=False):
+        "Text of the block, starting with its opening brace, one line at a time"
+        line_indent = _Indent(level)
+        item_indent = _Indent(level+1)
+        yield line_indent + '{\n'
+        for key, value in self.iteritems():
             if quoteKeys:
                 key = '"'+key+'"'
             if isinstance(value, VDFDict):
-                s += line_indent + f"\t{key}{value.ToString(level+1, quoteKeys)}"
+                # a nested KV (as_value) is a plain block, its keyName is the key
+                yield f"{item_indent}{key}\n"
+                yield from VDFDict.iter_lines(value, level+1, quoteKeys)
             else:
-                s += line_indent + f'\t{key}\t"{value}"\n'
-        s += line_indent + "}\n"
-        return s
+                yield f'{item_indent}{key}\t"{value}"\n'
+        yield line_indent + "}\n"
+
+    def ToString(self, level = 0, quoteKeys=False):
+        return "\n" + "".join(self.iter_lines(level, quoteKeys))
+
+_indents = ['\t' * level for level in range(16)]
+def _Indent(level: int) -> str:
+    try:
+        return _indents[level]
+    except IndexError:
+        return '\t' * level
+
+def _RecursiveLoadFromBuffer(block: VDFDict, tokenReader: CKeyValuesTokenCursor, case_sensitive = False, loadingCollectionFile = False):
+    "`KeyValues.RecursiveLoadFromBuffer` that adds straight into a `VDFDict`"
+    ReadToken = tokenReader.NextToken
+    while True:
+        # get the key name
+        name, wasQuoted = ReadToken()
+        if name is None: # EOF stop reading
+            if not loadingCollectionFile:
+                tokenReader.ReportError("RecursiveLoadFromBuffer:  got EOF instead of keyname")
+            break
+        if name == "":
+            tokenReader.ReportError("RecursiveLoadFromBuffer:  got empty keyname")
+            break
+        if name[0] == '}' and not wasQuoted: # top level closed, stop reading
+            break
+        if not case_sensitive:
+            name = name.lower()
+
+        value, wasQuoted = ReadToken()
+        # support the '=' as an assignment, makes multiple-keys-on-one-line easier to read in a keyvalues file
+        if value == '=' and not wasQuoted:
+            value, wasQuoted = ReadToken()
+        if value is None:
+            tokenReader.ReportError("RecursiveLoadFromBuffer:  got NULL key")
+            break
+
+        if value and not wasQuoted:
+            if value[0] == '}':
+                tokenReader.ReportError("RecursiveLoadFromBuffer:  got } in key")
+                break
+            if value[0] == '{':
+                # sub value list
+                sub = VDFDict()
+                tokenReader.m_ErrorStack.Push(name)
+                _RecursiveLoadFromBuffer(sub, tokenReader, case_sensitive)
+                tokenReader.m_ErrorStack.Pop()
+                block.add(name, sub)
+                continue
+
+        block.add(name, TypedValue(value) if value else value)
+
+def _ApproxSize(block: VDFDict) -> int:
+    "Rough memory footprint in bytes"
+    size = 100
+    for key, value in block.iteritems():
+        if isinstance(value, VDFDict):
+            size += 60 + _ApproxSize(value)
+        else:
+            size += 60 + len(key) + (len(value) if isinstance(value, str) else 8)
+    return size
+
+class CKVFileCache:
+    """
+    Process-wide LRU of parsed KeyValues files, bounded by approximate memory size.
+    Keyed on the absolute path and its size and mtime, so edited files are parsed again.
+    Callers get their own copy, the cached tree is never handed out.
+    """
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.m_Entries: OrderedDict[tuple, tuple[VDFDict, int]] = OrderedDict()
+        self.m_nBytes = 0
+        self.hits = self.misses = self.evictions = 0
+        self.m_Lock = Lock()
+
+    def Load(self, loader, file: Union[str, Path], *args, **params) -> VDFDict:
+        path = abspath(file)
+        st = stat(path)
+        key = (loader.__self__, loader.__name__, path, st.st_size, st.st_mtime_ns, args, tuple(sorted(params.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return loader(file, *args, **params)
+
+        with self.m_Lock:
+            entry = self.m_Entries.get(key)
+            if entry is not None:
+                self.m_Entries.move_to_end(key)
+                self.hits += 1
+        if entry is not None:
+            return entry[0].copy(nested=True)
+
+        kv = loader(file, *args, **params)
+        size = _ApproxSize(kv)
+        with self.m_Lock:
+            self.misses += 1
+            if size <= self.max_bytes and key not in self.m_Entries:
+                self.m_Entries[key] = kv, size
+                self.m_nBytes += size
+                while self.m_nBytes > self.max_bytes:
+                    _, (_, evicted_size) = self.m_Entries.popitem(last=False)
+                    self.m_nBytes -= evicted_size
+                    self.evictions += 1
+        return kv.copy(nested=True)
+
+    def Clear(self):
+        with self.m_Lock:
+            self.m_Entries.clear()
+            self.m_nBytes = 0
+
+    def __str__(self):
+        return (f"{self.hits} hits | {self.misses} misses | {self.evictions} evicted | "
+                f"{len(self.m_Entries)} files, ~{self.m_nBytes / (1024 * 1024):.1f} MiB")
+
+g_KVFileCache = CKVFileCache()
+
+def _MarshalItems(block: VDFDict) -> list:
+    "``block`` as nested lists of (key, value) pairs. Blocks are the only lists"
+    return [(key, _MarshalItems(value) if isinstance(value, VDFDict) else value) for key, value in block.iteritems()]
+
+def _UnmarshalItems(block: VDFDict, items: list):
+    for key, value in items:
+        if value.__class__ is list:
+            sub = VDFDict()
+            _UnmarshalItems(sub, value)
+            value = sub
+        block.add(key, value)
+
+class CKVDiskCache:
+    """
+    Parsed KeyValues files kept on disk between runs, one marshal file per source file and parse arguments.
+    An entry is used only while the source file's size and mtime are unchanged.
+    Entries are sharded into folders by hash, and written through a temp file so parallel importers can share one cache.
+    Off until `SetDirectory`.
+    """
+    VERSION = 1
+
+    def __init__(self):
+        self.m_Path: Optional[Path] = None
+        self.hits = self.misses = self.writes = 0
+        self.bytes_saved = 0
+        self.time_saved = 0.0
+        self.m_Lock = Lock()
+
+    def SetDirectory(self, path: Optional[Path]):
+        self.m_Path = None if path is None else Path(path)
+
+    def Clear(self):
+        if self.m_Path is not None:
+            rmtree(self.m_Path, ignore_errors=True)
+
+    def EntryPath(self, key: str) -> Path:
+        digest = blake2b(key.encode(), digest_size=16).hexdigest()
+        return self.m_Path / digest[:2] / f"{digest}.kv1"
+
+    def Load(self, cls: type, parse, file: Union[str, Path], *args, **params) -> VDFDict:
+        "``parse(buf, file, *args, **params)`` unless the cache has the result"
+        if self.m_Path is None:
+            with open(file, 'r', encoding="utf-8") as f:
+                return parse(f.read(), file, *args, **params)
+
+        start = perf_counter()
+        path = abspath(file)
+        st = stat(path)
+        key = repr((cls.__qualname__, parse.__name__, path, args, sorted(params.items())))
+        signature = (self.VERSION, key, st.st_size, st.st_mtime_ns)
+        entry_path = self.EntryPath(key)
+        try:
+            with open(entry_path, 'rb') as fp:
+                entry_signature, parse_time, keyName, items = marshal.load(fp)
+        except (OSError, EOFError, ValueError, TypeError):
+            entry_signature = None
+
+        if entry_signature == signature:
+            rv = cls(keyName, None)
+            _UnmarshalItems(rv, items)
+            with self.m_Lock:
+                self.hits += 1
+                self.bytes_saved += st.st_size
+                self.time_saved += parse_time - (perf_counter() - start)
+            return rv
+
+        with open(file, 'r', encoding="utf-8") as f:
+            rv = parse(f.read(), file, *args, **params)
+        parse_time = perf_counter() - start
+
+        with self.m_Lock:
+            self.misses += 1
+        # don't keep files that have errors, so that they are reported every run
+        if not rv.parseErrors:
+            try:
+                entry_path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = entry_path.with_name(f"{entry_path.name}.{getpid()}.{get_ident()}.tmp")
+                with open(tmp_path, 'wb') as fp:
+                    marshal.dump((signature, parse_time, rv.keyName, _MarshalItems(rv)), fp)
+                replace(tmp_path, entry_path)
+            except OSError:
+                pass
+            else:
+                with self.m_Lock:
+                    self.writes += 1
+        return rv
+
+    def __str__(self):
+        if self.m_Path is None:
+            return "off"
+        return (f"{self.hits} hits | {self.misses} misses | {self.writes} written | "
+                f"{self.bytes_saved / (1024 * 1024):.1f} MiB not parsed, ~{self.time_saved:.1f} s saved")
+
+g_KVDiskCache = CKVDiskCache()
 
 def _NoneOnException(func):
     def wrapper(*args, **kwargs):
@@ -241,34 +605,76 @@ def _NoneOnException(func):
     return wrapper
 
 class KV(VDFDict):
+    __slots__ = ('keyName', 'parseErrors')
 
     @classmethod
     def FromFile(cls, file: Union[str, bytes, Path], case_sensitive=False, escape=False, **params):
-        with open(file, 'r', encoding="utf-8") as f:
-            return cls.FromBuffer(f.read(), file, case_sensitive, escape, **params)
+        return g_KVDiskCache.Load(cls, cls.FromBuffer, file, case_sensitive, escape, **params)
 
     @classmethod
     def CollectionFromFile(cls, file: Path, case_sensitive=False, escape=False, **params):
-        with open(file, 'r', encoding="utf-8") as f:
-            return cls.CollectionFromBuffer(f.read(), file, case_sensitive, escape, **params)
+        return g_KVDiskCache.Load(cls, cls.CollectionFromBuffer, file, case_sensitive, escape, **params)
+
+    @classmethod
+    def FromFileCached(cls, file: Union[str, Path], case_sensitive=False, escape=False, **params):
+        "`FromFile` through `g_KVFileCache`, for files that get read many times. The result is the caller's to modify"
+        return g_KVFileCache.Load(cls.FromFile, file, case_sensitive, escape, **params)
+
+    @classmethod
+    def CollectionFromFileCached(cls, file: Path, case_sensitive=False, escape=False, **params):
+        "`CollectionFromFile` through `g_KVFileCache`"
+        return g_KVFileCache.Load(cls.CollectionFromFile, file, case_sensitive, escape, **params)
 
     @classmethod
     def FromBuffer(cls, buf: str, resourceName: Union[str, bytes, Path] = None, case_sensitive=False, escape=False, **params):
-        cppkv = KeyValues(case_sensitive = case_sensitive, escape = escape)
-        cppkv.LoadFromBuffer(resourceName, buf = CUtlBuffer(buf), **params)
-        return cls(cppkv.keyName, cppkv.value.ToBuiltin())
-    
+        "Same result as `KeyValues.LoadFromBuffer`, without building the intermediate `KeyValues` tree"
+        rv = cls("None", None)
+        tokenReader = CKeyValuesTokenCursor(buf)
+        tokenReader.m_ErrorStack.SetFilename(resourceName)
+        rv.parseErrors = tokenReader.m_ErrorStack.errors
+        while True:
+            # the first thing must be a key
+            s, wasQuoted = tokenReader.NextToken()
+            if not tokenReader.IsValid() or s is None:
+                break
+
+            if s == '#include' or s == '#base': # special include macro (not a key name)
+                macro = s
+                s, _ = tokenReader.NextToken()
+                if not s:
+                    tokenReader.ReportError(f"{macro} is NULL.")
+                continue
+
+            rv.keyName = s if case_sensitive else s.lower()
+
+            s, wasQuoted = tokenReader.NextToken()
+            if s and s[0] == '{' and not wasQuoted:
+                # header is valid so load the file. last one wins
+                rv.clear()
+                # errors in the block have it as the outermost key, as the nested blocks do
+                tokenReader.m_ErrorStack.Push(rv.keyName)
+                _RecursiveLoadFromBuffer(rv, tokenReader, case_sensitive)
+                tokenReader.m_ErrorStack.Pop()
+            else:
+                tokenReader.ReportError("LoadFromBuffer: missing {")
+
+            if not tokenReader.IsValid():
+                break
+        return rv
+
     @classmethod
     def CollectionFromBuffer(cls, buf: str, resourceName: Path = None, case_sensitive=False, escape=False, **params):
-        cppkv = KeyValues(
-            k="" if resourceName is None else resourceName.name,
-            case_sensitive = case_sensitive, escape = escape
-        )
-        cppkv.RecursiveLoadFromBuffer(resourceName, CKeyValuesTokenReader(CUtlBuffer(buf)), True)
-        return cls(cppkv.keyName, cppkv.value.ToBuiltin())
+        keyName = "" if resourceName is None else resourceName.name
+        rv = cls(keyName if case_sensitive else keyName.lower(), None)
+        tokenReader = CKeyValuesTokenCursor(buf)
+        tokenReader.m_ErrorStack.SetFilename(resourceName)
+        rv.parseErrors = tokenReader.m_ErrorStack.errors
+        _RecursiveLoadFromBuffer(rv, tokenReader, case_sensitive, loadingCollectionFile=True)
+        return rv
 
     def __init__(self, keyName: str, value: dict) -> None:
         self.keyName: str = keyName
+        self.parseErrors: list[KeyValuesError] = []  # from FromBuffer/CollectionFromBuffer
         super().__init__(value)
 
     def __getitem__(self, key) -> Optional[Any]:
@@ -293,19 +699,35 @@ class KV(VDFDict):
     def __repr__(self):
         return f"{self.__class__.__name__}({self.keyName!r}, {list(self.iteritems())!r})"
 
+    def __reduce__(self):
+        return self.__class__, (self.keyName, self.items())
+
+    def copy(self, nested=False):
+        rv = super().copy(nested)
+        rv.keyName = self.keyName
+        rv.parseErrors = list(self.parseErrors)
+        return rv
+
     def __str__(self):
         return self.ToString()
 
     def as_value(self):
         return VDFDict({self.keyName:self})
 
+    def iter_lines(self, level=0, quoteKeys=False):
+        yield _Indent(level) + f'"{self.keyName}"\n'
+        yield from super().iter_lines(level, quoteKeys)
+
     def ToString(self, level=0, quoteKeys=False):
-        line_indent = "\t" * level
-        return line_indent + f'"{self.keyName}"{super().ToString(level, quoteKeys)}'
+        return "".join(self.iter_lines(level, quoteKeys))
+
+    def write(self, fp, quoteKeys=False):
+        "Stream the text to a file object opened for writing text"
+        fp.writelines(self.iter_lines(quoteKeys=quoteKeys))
 
     def save(self, path, quoteKeys=False):
         with open(path, 'w') as fp:
-            fp.write(self.ToString(quoteKeys=quoteKeys))
+            self.write(fp, quoteKeys)
 
     def ToKeyValues(self):
         raise NotImplementedError
@@ -317,3 +739,176 @@ class KV(VDFDict):
             else:
                 kv.value.append(KeyValues(k, v))
         return kv
+
+if __name__ == '__main__':
+    import io
+    import json
+    import unittest
+    from contextlib import redirect_stdout
+    class Test_KV(unittest.TestCase):
+        vmt = (
+            '"VertexLitGeneric"\n{\n\t$basetexture "models/a/b" // c\n\t$Alpha .5\n\t$n 3\n\t$color "[1 1 1]"\n'
+            '\t$empty ""\n\t$h 0x0123456789abcdef\n\tproxies\n\t{\n\t\tSine { resultvar $alpha }\n\t\tSine { resultvar $color }\n\t}\n}\n'
+        )
+        def test_same_as_keyvalues_tree(self):
+            cppkv = KeyValues()
+            cppkv.LoadFromBuffer(None, None, tokenReader=CKeyValuesTokenCursor(self.vmt))
+            self.assertEqual(KV.FromBuffer(self.vmt), KV(cppkv.keyName, cppkv.value.ToBuiltin()))
+
+        def test_typed_values(self):
+            kv = KV.FromBuffer(self.vmt)
+            self.assertEqual(kv.keyName, 'vertexlitgeneric')
+            self.assertEqual(kv['$alpha'], 0.5)
+            self.assertEqual(kv['$n'], 3)
+            self.assertEqual(kv['$color'], "[1 1 1]")
+            self.assertEqual(kv['$empty'], "")
+            self.assertEqual(kv['$h'], str(0x0123456789abcdef))
+
+        def test_duplicates(self):
+            kv = KV.FromBuffer(self.vmt)
+            self.assertEqual(kv['proxies'].get_all_for('sine'), [VDFDict({'resultvar': '$alpha'}), VDFDict({'resultvar': '$color'})])
+
+        def test_nested_kv(self):
+            kv = KV('LightmappedGeneric', {'$basetexture': 'a'})
+            self.assertEqual(kv.as_value().ToString(), '\n{\n\tLightmappedGeneric\n\t{\n\t\t$basetexture\t"a"\n\t}\n}\n')
+
+        def test_json(self):
+            self.assertEqual(json.dumps(VDFDict({'A': 1})), '{"A": 1}')
+            kv = KV('x', {'a': {'b': '1'}})
+            kv.add('a', '2')
+            self.assertEqual(json.dumps(kv), '{"a": {"b": "1"}, "a": "2"}')
+            # the native storage follows every change to the first value of a key
+            kv[(1, 'a')] = '3'
+            del kv['a']
+            kv.add('c', '4')
+            kv.set_ci('C', '5')
+            self.assertEqual(json.dumps(kv), '{"a": "3", "c": "5"}')
+            kv.remove_all_for('c')
+            self.assertEqual(dict.items(kv), {'a': '3'}.items())
+            self.assertEqual(dict.items(kv.copy()), {'a': '3'}.items())
+            kv.clear()
+            self.assertEqual(json.dumps(kv), '{}')
+
+        def test_case_sensitive(self):
+            kv = KV.FromBuffer(self.vmt, case_sensitive=True)
+            self.assertEqual(kv.keyName, 'VertexLitGeneric')
+            self.assertEqual(kv['$Alpha'], 0.5)
+            self.assertIsNone(kv['$alpha'])
+
+        def test_delete_duplicates(self):
+            d = VDFDict([('a', 1), ('b', 2), ('a', 3), ('c', 4), ('a', 5)])
+            del d[(1, 'a')]
+            self.assertEqual(d.items(True), [((0, 'a'), 1), ((0, 'b'), 2), ((0, 'c'), 4), ((1, 'a'), 5)])
+            del d['a']
+            self.assertEqual(d['a'], 5)
+            d.remove_all_for('a')
+            self.assertEqual(d.items(), [('b', 2), ('c', 4)])
+            self.assertNotIn('a', d)
+            for i in range(100):
+                d.add('x', i)
+            for i in range(99):
+                del d['x']
+            self.assertEqual(d.items(), [('b', 2), ('c', 4), ('x', 99)])
+
+        def test_case_insensitive(self):
+            kv = KV.FromBuffer(self.vmt, case_sensitive=True)
+            self.assertEqual(kv.get_ci('$alpha'), 0.5)
+            self.assertTrue(kv.contains_ci('$ALPHA'))
+            self.assertFalse(kv.contains_ci('$beta'))
+            kv.add('$ALPHA', 1)
+            self.assertEqual(kv.get_all_for_ci('$alpha'), [0.5, 1])
+            del kv['$Alpha']
+            self.assertEqual(kv.get_all_for_ci('$alpha'), [1])
+            kv.set_ci('$alpha', 2)
+            kv.set_ci('$Beta', 3)
+            self.assertEqual(kv.items()[-2:], [('$ALPHA', 2), ('$Beta', 3)])
+            self.assertIsNone(kv.get_ci('$gamma'))
+
+        def test_copy(self):
+            kv = KV.FromBuffer(self.vmt)
+            patch = kv.copy()
+            kv.clear()
+            self.assertIsInstance(patch, KV)
+            self.assertEqual(patch.keyName, 'vertexlitgeneric')
+            self.assertEqual(patch, KV.FromBuffer(self.vmt))
+
+        def test_file_cache(self):
+            import tempfile, os
+            with tempfile.TemporaryDirectory() as tmp:
+                vmt_path = Path(tmp) / "a.vmt"
+                vmt_path.write_text(self.vmt)
+                cache = CKVFileCache()
+                a = cache.Load(KV.FromFile, vmt_path)
+                a['proxies'].clear()
+                b = cache.Load(KV.FromFile, vmt_path)
+                self.assertEqual(b, KV.FromFile(vmt_path))
+                self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+                vmt_path.write_text(self.vmt.replace("$n 3", "$n 4"))
+                os.utime(vmt_path, ns=(0, 0))
+                self.assertEqual(cache.Load(KV.FromFile, vmt_path)['$n'], 4)
+                self.assertEqual(cache.misses, 2)
+
+                cache.max_bytes = cache.m_nBytes // 2
+                cache.Load(KV.FromFile, vmt_path, case_sensitive=True)
+                self.assertEqual((len(cache.m_Entries), cache.evictions), (1, 2))
+
+        def test_disk_cache(self):
+            import tempfile
+            with tempfile.TemporaryDirectory() as tmp:
+                vmt_path = Path(tmp) / "a.vmt"
+                vmt_path.write_text(self.vmt)
+                g_KVDiskCache.SetDirectory(Path(tmp) / "cache")
+                try:
+                    parsed = KV.FromFile(vmt_path)
+                    self.assertEqual((g_KVDiskCache.hits, g_KVDiskCache.writes), (0, 1))
+                    cached = KV.FromFile(vmt_path)
+                    self.assertEqual(g_KVDiskCache.hits, 1)
+                    self.assertEqual(cached, parsed)
+                    self.assertEqual(cached.keyName, parsed.keyName)
+                    self.assertEqual(KV.CollectionFromFile(vmt_path), KV.CollectionFromBuffer(self.vmt, vmt_path))
+                    self.assertEqual(g_KVDiskCache.hits, 1)
+                finally:
+                    g_KVDiskCache.Clear()
+                    g_KVDiskCache.SetDirectory(None)
+
+        def test_write(self):
+            kv = KV.FromBuffer(self.vmt)
+            fp = io.StringIO()
+            kv.write(fp)
+            self.assertEqual(fp.getvalue(), kv.ToString())
+            self.assertEqual(KV.FromBuffer(fp.getvalue()).ToString(), kv.ToString())
+            self.assertEqual(kv['proxies'].ToString(1),
+                '\n\t{\n\t\tsine\n\t\t{\n\t\t\tresultvar\t"$alpha"\n\t\t}\n\t\tsine\n\t\t{\n\t\t\tresultvar\t"$color"\n\t\t}\n\t}\n'
+            )
+
+        def test_errors(self):
+            with redirect_stdout(io.StringIO()):
+                kv = KV.FromBuffer('"a"\n{\n\tb\n\t{\n\t\tc }\n}\n', "x.vmt")
+            self.assertEqual(len(kv.parseErrors), 1)
+            error = kv.parseErrors[0]
+            self.assertEqual((error.file, error.line, error.column, error.keyPath), ("x.vmt", 5, 6, ('a', 'b')))
+            self.assertIn("got } in key", error.message)
+            with redirect_stdout(io.StringIO()):
+                collection = KV.CollectionFromBuffer('"a"\n{\n\tb\n\t{\n\t\tc }\n}\n', Path("x.vmt"))
+            self.assertEqual(collection.parseErrors, kv.parseErrors)
+            self.assertEqual(KV.FromBuffer(self.vmt).parseErrors, [])
+
+        def test_threads(self):
+            from concurrent.futures import ThreadPoolExecutor
+            bad = self.vmt.replace("$n 3", "$n }")
+            with ThreadPoolExecutor(8) as pool, redirect_stdout(io.StringIO()):
+                results = list(pool.map(lambda buf: KV.FromBuffer(buf, "t.vmt"), [self.vmt, bad] * 50))
+            for kv in results[0::2]:
+                self.assertEqual(kv.parseErrors, [])
+            for kv in results[1::2]:
+                self.assertEqual(kv.parseErrors, results[1].parseErrors)
+                self.assertTrue(kv.parseErrors)
+
+        def test_collection(self):
+            kv = KV.CollectionFromBuffer('"Weapon.Fire" { wave a.wav } "Weapon.Reload" { wave b.wav }')
+            self.assertEqual(kv.keyName, '')
+            self.assertEqual(kv.keys(), ['weapon.fire', 'weapon.reload'])
+            self.assertEqual(kv['weapon.reload']['wave'], 'b.wav')
+
+    unittest.main()
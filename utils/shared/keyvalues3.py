@@ -24,50 +24,129 @@ class KV3File(dict):
         self.header = KV3Header(format="source1imported")
 
     def __str__(self):
-        kv3 = str(self.header) + '\n'
-
-        def obj_serialize(obj, indent = 1, dictKey = False):
-            preind = ('\t' * (indent-1))
-            ind = ('\t' * indent)
-            if obj is None:
-                return 'null'
-            elif isinstance(obj, bool):
-                if obj: return 'true'
-                return 'false'
-            elif isinstance(obj, str):
-                return '"' + obj + '"'
-            elif isinstance(obj, list):
-                s = '['
-                if any(isinstance(item, dict) for item in obj):  # TODO: only non numbers
-                    s = f'\n{preind}[\n'
-                    for item in obj:
-                        s += (obj_serialize(item, indent+1) + ',\n')
-                    return s + preind + ']\n'
-
-                return f'[{", ".join((obj_serialize(item, indent+1) for item in obj))}]'
-            elif isinstance(obj, dict):
-                s = preind + '{\n'
-                if dictKey:
-                    s = '\n' + s
-                for key, value in obj.items():
-                    #if value == [] or value == "" or value == {}: continue
-                    if not isinstance(key, str):
-                        key = f'"{key}"'
-                    s +=  ind + f"{key} = {obj_serialize(value, indent+1, dictKey=True)}\n"
-                return s + preind + '}'
-            else: # int, float, resource
-                # round off inaccurate dmx floats
-                if type(obj) == float:
-                    obj = round(obj, 6)
-                return str(obj)
-
-        kv3 += obj_serialize(self)
-
-        return kv3
+        writer = _KV3TextWriter()
+        writer.serialize(self)
+        return str(self.header) + '\n' + ''.join(writer.out)
 
     def ToString(self):
         return self.__str__()
 
+    def write(self, fp, compact: bool = False):
+        """
+        Stream the text to an open text file.
+        compact: minimal whitespace, for files that are only read back by tools.
+        """
+        fp.write(str(self.header) + '\n')
+        writer = _KV3TextWriter(fp, compact)
+        writer.serialize(self)
+        writer.flush()
+
+    def save(self, path: Path, compact: bool = False):
+        with open(path, 'w') as fp:
+            self.write(fp, compact)
+
+_indents = [''] + ['\t' * i for i in range(1, 32)]
+
+class _KV3TextWriter:
+    """
+    Appends KV3 text chunks to a list, handed to `fp` every FLUSH_CHUNKS chunks.
+    Without `fp` the chunks stay in `out`.
+    """
+    FLUSH_CHUNKS = 4096
+    __slots__ = ('out', 'fp', 'compact')
+
+    def __init__(self, fp = None, compact: bool = False):
+        self.out: list[str] = []
+        self.fp = fp
+        self.compact = compact
+
+    def flush(self):
+        if self.fp is not None:
+            self.fp.write(''.join(self.out))
+            self.out.clear()
+
+    @staticmethod
+    def indent(n: int) -> str:
+        if n < len(_indents):
+            return _indents[n]
+        return '\t' * n
+
+    def serialize(self, obj, indent = 1, dictKey = False):
+        out = self.out
+        if obj is None:
+            out.append('null')
+        elif obj is True:
+            out.append('true')
+        elif obj is False:
+            out.append('false')
+        elif isinstance(obj, str):
+            out.append('"' + obj + '"')
+        elif isinstance(obj, list):
+            self._list(obj, indent)
+        elif isinstance(obj, dict):
+            if self.compact:
+                self._dict_compact(obj)
+            else:
+                self._dict(obj, indent, dictKey)
+        else: # int, float, resource
+            # round off inaccurate dmx floats
+            if type(obj) == float:
+                obj = round(obj, 6)
+            out.append(str(obj))
+
+    def _list(self, obj: list, indent):
+        out = self.out
+        if not self.compact:
+            for item in obj:  # TODO: only non numbers
+                if isinstance(item, dict):
+                    break
+            else:
+                return self._list_inline(obj, indent, ', ')
+            preind = self.indent(indent-1)
+            out.append('\n' + preind + '[\n')
+            for item in obj:
+                self.serialize(item, indent+1)
+                out.append(',\n')
+            out.append(preind + ']\n')
+        else:
+            self._list_inline(obj, indent, ',')
+
+    def _list_inline(self, obj: list, indent, separator):
+        out = self.out
+        out.append('[')
+        for i, item in enumerate(obj):
+            if i:
+                out.append(separator)
+            self.serialize(item, indent+1)
+        out.append(']')
+
+    def _dict(self, obj: dict, indent, dictKey):
+        out = self.out
+        preind = self.indent(indent-1)
+        out.append(('\n' + preind + '{\n') if dictKey else (preind + '{\n'))
+        ind = preind + '\t'
+        for key, value in obj.items():
+            if not isinstance(key, str):
+                key = f'"{key}"'
+            out.append(ind + key + ' = ')
+            self.serialize(value, indent+1, dictKey=True)
+            out.append('\n')
+            if len(out) > self.FLUSH_CHUNKS:
+                self.flush()
+        out.append(preind + '}')
+
+    def _dict_compact(self, obj: dict):
+        out = self.out
+        out.append('{')
+        for i, (key, value) in enumerate(obj.items()):
+            if not isinstance(key, str):
+                key = f'"{key}"'
+            out.append((' ' + key + '=') if i else (key + '='))
+            self.serialize(value, dictKey=True)
+            if len(out) > self.FLUSH_CHUNKS:
+                self.flush()
+        out.append('}')
+
 if __name__ == '__main__':
     import unittest
     class Test_KV3(unittest.TestCase):
@@ -95,4 +174,30 @@ if __name__ == '__main__':
                 expect_text
             )
 
+        def test_write(self):
+            from io import StringIO
+            kv = KV3File(
+                a=[{'b': [1, 2.0000001, None]}, {'c': {'d': True}}],
+                e={'f': resource(Path('materials/A.vmat')), 'g': [[{'h': 1}], []]},
+            )
+            fp = StringIO()
+            _KV3TextWriter.FLUSH_CHUNKS = 4
+            try:
+                kv.write(fp)
+            finally:
+                _KV3TextWriter.FLUSH_CHUNKS = 4096
+            self.assertEqual(fp.getvalue(), kv.ToString())
+
+        def test_write_compact(self):
+            from io import StringIO
+            fp = StringIO()
+            KV3File(
+                a='asd asd',
+                b={(2,):3, 'c': [{'d': False}]},
+                e=["listed_text1", 1.5]
+            ).write(fp, compact=True)
+            self.assertEqual(fp.getvalue(), f'{self.default_s1import_context_header}\n'+\
+                '{a="asd asd" b={"(2,)"=3 c=[{d=false}]} e=["listed_text1",1.5]}'
+            )
+
     unittest.main()
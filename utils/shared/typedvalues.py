@@ -0,0 +1,116 @@
+# typedvalues.py
+# Decoding of the number, vector, color and texture transform strings found in KeyValues values.
+# Results are immutable and memoized, material sets repeat the same few literals over and over.
+
+import re
+from functools import lru_cache
+from typing import Optional, Union
+
+# same spans as cstr.strtol(s) and cstr.strtod(s)
+re_strtol = re.compile(r'\s*[\+\-]?[0-9]*')
+re_strtod = re.compile(r'[+-]?\d*[.]?\d*(?:[eE][+-]?\d+)?')
+
+@lru_cache(maxsize=8192)
+def TypedValue(value: str) -> Union[int, float, str, None]:
+    "KeyValues::RecursiveLoadFromBuffer value typing. str -> uint64 str, float, int or str"
+    length = len(value)
+    if 18 == length and value[0] == '0' and value[1] == 'x':
+        return str(int(value, 16))
+
+    pIEnd = re_strtol.match(value).end()
+    pFEnd = re_strtod.match(value).end()
+    if (pFEnd > pIEnd) and (pFEnd == length):
+        try: return float(value[:pFEnd])
+        except ValueError: return None
+    if pIEnd == length:
+        try: lval = int(value)
+        except ValueError: return None
+        if not (lval == 2147483647 or lval == -2147483646): # overflow
+            return lval
+    return value
+
+@lru_cache(maxsize=4096)
+def ParseFloats(s: str) -> Optional[tuple[float, ...]]:
+    "'1 .5 0' -> (1.0, 0.5, 0.0). None if any term is not a number"
+    try:
+        return tuple(map(float, s.split()))
+    except ValueError:
+        return None
+
+@lru_cache(maxsize=4096)
+def ParseVector(s: str) -> Optional[tuple[float, ...]]:
+    """
+    Vector or color as written in materials: "[0 .3]", "{255 128 0}", "1 1 1", "'[1 1 1]'", "(2.0, 2.0)".
+    Colors in {} with 3 or more components are 0-255 and get scaled to 0-1.
+    None if there are no numbers, or something other than numbers.
+    """
+    likelyColorInt = '{' in s or '}' in s
+    s = s.replace('"', '').replace("'", "").replace(",", "").strip().strip('][}{').strip(')(')
+    values = ParseFloats(s)
+    if not values:
+        return None
+    if likelyColorInt and len(values) >= 3:
+        return tuple(value / 255 for value in values)
+    return values
+
+_transform_pairs = frozenset(('center', 'scale', 'translate'))
+
+@lru_cache(maxsize=1024)
+def ParseTexTransform(s: str) -> tuple[tuple[str, Union[float, tuple[float, float]]], ...]:
+    """
+    "center .5 .5 scale 2 2 rotate 0 translate 0 0" ->
+        (('center', (0.5, 0.5)), ('scale', (2.0, 2.0)), ('rotate', 0.0), ('translate', (0.0, 0.0)))
+    Terms that are missing or malformed are left out. Later terms override earlier ones.
+    """
+    #  scale %f %f translate %f %f rotate %f (count 5, assumed center syntax)
+    #  center %f %f scale %f %f rotate %f translate %f %f (count 7)
+    terms = [term.strip("'") for term in s.strip('"').split(' ')]
+    rv = []
+    for i, term in enumerate(terms):
+        try: nextTerm = float(terms[i+1])
+        except (IndexError, ValueError): continue
+
+        if term == 'rotate':
+            rv.append((term, nextTerm))
+            continue
+
+        try: nextnextTerm = float(terms[i+2])
+        except (IndexError, ValueError): continue
+
+        if term in _transform_pairs:
+            rv.append((term, (nextTerm, nextnextTerm)))
+    return tuple(rv)
+
+if __name__ == '__main__':
+    import unittest
+
+    class Test_TypedValue(unittest.TestCase):
+        def test_types(self):
+            self.assertEqual(TypedValue("3"), 3)
+            self.assertEqual(TypedValue(".5"), 0.5)
+            self.assertEqual(TypedValue("1e3"), 1000.0)
+            self.assertEqual(TypedValue("2147483647"), "2147483647")
+            self.assertEqual(TypedValue("0x0123456789abcdef"), str(0x0123456789abcdef))
+            self.assertEqual(TypedValue("[1 1 1]"), "[1 1 1]")
+            self.assertIsNone(TypedValue("-"))
+
+    class Test_Vectors(unittest.TestCase):
+        def test_vector(self):
+            self.assertEqual(ParseVector("[0 .3]"), (0.0, 0.3))
+            self.assertEqual(ParseVector(" \"[1, 2, 3]\" "), (1.0, 2.0, 3.0))
+            self.assertEqual(ParseVector("{255 0 51}"), (1.0, 0.0, 0.2))
+            self.assertEqual(ParseVector("{255 0}"), (255.0, 0.0))
+            self.assertEqual(ParseVector(str((2.0, 2.0))), (2.0, 2.0))
+            self.assertIsNone(ParseVector("[]"))
+            self.assertIsNone(ParseVector("[1 a 1]"))
+
+        def test_floats(self):
+            self.assertEqual(ParseFloats("0 0\t1"), (0.0, 0.0, 1.0))
+            self.assertIsNone(ParseFloats("0 0 x"))
+
+        def test_transform(self):
+            self.assertEqual(ParseTexTransform('"center .5 .5 scale 2 2 rotate 45 translate 0 1"'),
+                (('center', (0.5, 0.5)), ('scale', (2.0, 2.0)), ('rotate', 45.0), ('translate', (0.0, 1.0))))
+            self.assertEqual(ParseTexTransform("scale 2 translate 1 1"), (('translate', (1.0, 1.0)),))
+
+    unittest.main()